@@ -0,0 +1,279 @@
+'''
+Hot paths timed by run.py. Each scenario builds its depot/state in setup(),
+outside of the timing, and returns a callable that performs the user level
+action once.
+'''
+import os
+import sys
+import time
+import logging
+import tempfile
+
+src = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+if src not in sys.path:
+    sys.path.insert(0, src)
+
+import FakeP4
+
+clientRoot = os.path.join(tempfile.gettempdir(), 'p4vfx_benchmark_ws').replace('\\', '/')
+
+# Installed before the perforce package is imported, see setupEnvironment()
+server = None
+app = None
+
+def setupEnvironment(replayPath=None, latency=0.0):
+    global server, app
+
+    # Every run starts from the server, cached trees are measured separately
+    os.environ['P4VFX_METADATA_CACHE'] = '0'
+
+    # No background polling to add to the command counts
+    os.environ['P4VFX_REFRESH_INTERVAL'] = '0'
+
+    if replayPath:
+        server = FakeP4.ReplayServer(replayPath, realtime=True)
+    else:
+        server = FakeP4.FakeServer(clientRoot=clientRoot, latency={'*': latency})
+    FakeP4.install(server, force=True)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('Perforce').setLevel(logging.WARNING)
+
+    from perforce.AppInterop import interop
+    window, app = interop.setupEnvironment()
+
+def connect():
+    from perforce.PerforceUtils import Resilience
+
+    p4 = Resilience.ResilientP4()
+    p4.connect()
+    p4.cwd = clientRoot
+    return p4
+
+def depotLayout(fileCount):
+    # Keep directory listings growing with the depot, as they do in production
+    return {'filesPerDir': max(100, fileCount // 100), 'dirsPerDir': 10}
+
+def waitFor(condition, timeout=60.0):
+    from perforce.GUI.qtpy import QtCore
+
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise RuntimeError('Timed out waiting for the GUI to update')
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+
+
+#--------------------------------------------------------------------------
+# Depot tree
+#--------------------------------------------------------------------------
+def setupTreePopulate(fileCount, root=None):
+    from perforce.GUI import DepotClientViewModel
+    QModelIndex = DepotClientViewModel.QtCore.QModelIndex
+
+    if not isinstance(server, FakeP4.ReplayServer):
+        server.generate(fileCount, revisions=(1, 10), **depotLayout(fileCount))
+    p4 = connect()
+    model = DepotClientViewModel.PerforceItemModel(p4)
+
+    def run():
+        # Open the client view, then expand down to the first folder of files
+        model.populate(root or clientRoot)
+        index = model.index(0, 0, QModelIndex())
+        while index.isValid() and index.internalPointer().data[1] == 'Folder':
+            model.populateSubDir(index, root or clientRoot)
+            index = model.index(0, 0, index)
+
+    return run
+
+def setupTreeExpandAll(fileCount):
+    from perforce.GUI import DepotClientViewModel
+    QModelIndex = DepotClientViewModel.QtCore.QModelIndex
+
+    server.generate(fileCount, revisions=(1, 10), **depotLayout(fileCount))
+    p4 = connect()
+    model = DepotClientViewModel.PerforceItemModel(p4)
+
+    def run():
+        model.populate(clientRoot)
+        stack = [QModelIndex()]
+        while stack:
+            parent = stack.pop()
+            for row in range(model.rowCount(parent)):
+                index = model.index(row, 0, parent)
+                if index.isValid() and index.internalPointer().data[1] == 'Folder':
+                    model.populateSubDir(index, clientRoot)
+                    stack.append(index)
+
+    return run
+
+def setupTreeLargeFolder(fileCount):
+    from perforce.GUI import DepotClientViewModel
+    QModelIndex = DepotClientViewModel.QtCore.QModelIndex
+
+    # Every file in one folder, like a plate or cache sequence
+    server.generate(fileCount, revisions=(1, 10), filesPerDir=fileCount, dirsPerDir=10)
+    p4 = connect()
+    model = DepotClientViewModel.PerforceItemModel(p4)
+    model.prefetchLimit = 0
+
+    def run():
+        # Expand down to the folder, only its first page of rows is added
+        model.populate(clientRoot)
+        index = model.index(0, 0, QModelIndex())
+        while index.isValid() and index.internalPointer().data[1] == 'Folder':
+            model.populateSubDir(index, clientRoot)
+            index = model.index(0, 0, index)
+
+    return run
+
+
+def setupTreePopulateCached(fileCount):
+    from perforce.GUI import DepotClientViewModel
+    from perforce.PerforceUtils import MetadataCache
+
+    server.generate(fileCount, revisions=(1, 10), **depotLayout(fileCount))
+    p4 = connect()
+
+    path = os.path.join(tempfile.mkdtemp(), 'metadata.db')
+    cache = MetadataCache.MetadataCache(path)
+
+    model = DepotClientViewModel.PerforceItemModel(p4)
+    model.cache = cache
+    model.populate(clientRoot)
+
+    def run():
+        # Reopen the browser from the cache, up to date once revalidated
+        # (only trees within the prefetch limit are cached)
+        model = DepotClientViewModel.PerforceItemModel(p4)
+        model.cache = cache
+        model.populate(clientRoot)
+        waitFor(lambda: model.revalidation.isDone())
+        app.processEvents()
+
+    return run
+
+
+#--------------------------------------------------------------------------
+# File revisions
+#--------------------------------------------------------------------------
+def revisionTab(directory):
+    from perforce.GUI import FileRevisionWindow
+
+    p4 = connect()
+    tab = FileRevisionWindow.BaseRevisionTab(p4)
+    tab.setRoot(directory)
+    tab.create()
+    waitFor(lambda: tab.pathIndex is not None)
+    return tab
+
+def selectFile(tab, path):
+    from perforce.GUI.qtpy import QtCore
+
+    # As clicking it in the tree would
+    for row in range(tab.model.rowCount(QtCore.QModelIndex())):
+        index = tab.model.index(row, 0, QtCore.QModelIndex())
+        if index.internalPointer().data[-1] == path:
+            tab.fileTree.setCurrentIndex(index)
+            break
+    else:
+        raise RuntimeError('%s not found in %s' % (path, tab.root))
+
+    tab.fileRevisions = []
+    tab.populateFileRevisions()
+    waitFor(lambda: tab.fileRevisions)
+
+def setupFileRevisions(revisions, path=None):
+    if not path:
+        server.generate(100, revisions=(revisions, revisions), filesPerDir=100)
+        path = '//depot/d0/file_000002.txt'
+
+    tab = revisionTab(path.rsplit('/', 1)[0])
+
+    def run():
+        selectFile(tab, path)
+
+    return run
+
+def setupFileRevisionsCached(revisions):
+    server.generate(100, revisions=(revisions, revisions), filesPerDir=100)
+    tab = revisionTab('//depot/d0')
+    paths = [x.data[-1] for x in tab.model.rootItem.childItems[:2]]
+    for path in paths:
+        selectFile(tab, path)
+
+    def run():
+        # Flipping between two files already shown
+        for i in range(10):
+            selectFile(tab, paths[i % 2])
+
+    return run
+
+
+def setupSearch(fileCount):
+    from perforce.PerforceUtils import PathIndex
+
+    server.generate(fileCount, revisions=(1, 10), **depotLayout(fileCount))
+    p4 = connect()
+    index = PathIndex.buildIndex(p4, clientRoot)
+    last = index.paths[-1].rsplit('/', 1)[-1]
+
+    def run():
+        # Typing a file name, then a misspelling of it that only matches fuzzily
+        for i in range(1, len(last) + 1):
+            index.search(last[:i])
+        index.search(last.replace('_', ''))
+
+    return run
+
+
+#--------------------------------------------------------------------------
+# Submit and checkout
+#--------------------------------------------------------------------------
+def setupSubmit(fileCount):
+    from perforce.PerforceUtils import CmdsChangelist
+
+    server.generate(10000, revisions=(1, 10), **depotLayout(10000))
+    p4 = connect()
+
+    files = [server.toLocal(p4, x) for x in sorted(server.files)[:fileCount]]
+    p4.run_edit(files)
+
+    def run():
+        CmdsChangelist.submitChange(p4, files, 'Benchmark submit', None)
+
+    return run
+
+def setupCheckout(fileCount):
+    from perforce.GUI import PerforceMenu
+
+    server.generate(10000, revisions=(1, 10), **depotLayout(10000))
+    p4 = connect()
+    shelf = PerforceMenu.MainShelf(p4)
+
+    files = [server.toLocal(p4, x) for x in sorted(server.files)[:fileCount]]
+
+    def run():
+        shelf.run_checkoutFile(None, *files)
+
+    return run
+
+
+# name -> (setup, parameters, parameter label)
+scenarios = {
+    'tree.populate':        (setupTreePopulate,  [1000, 10000, 100000], 'files'),
+    'tree.expandAll':       (setupTreeExpandAll, [1000, 10000, 100000], 'files'),
+    'tree.populateCached':  (setupTreePopulateCached, [1000, 10000, 50000], 'files'),
+    'tree.largeFolder':     (setupTreeLargeFolder, [1000, 10000, 50000], 'files'),
+    'revisions.populate':   (setupFileRevisions, [10, 100, 1000],       'revisions'),
+    'revisions.cached':     (setupFileRevisionsCached, [10, 100, 1000], 'revisions'),
+    'search':               (setupSearch,        [1000, 10000, 100000], 'files'),
+    'submit':               (setupSubmit,        [10, 100, 1000],       'files'),
+    'checkout':             (setupCheckout,      [10, 100, 1000],       'files'),
+}
+
+# Scenarios that only read from the server, and so can run against a recording
+replayScenarios = {
+    'tree.populate':        setupTreePopulate,
+    'revisions.populate':   setupFileRevisions,
+}
@@ -0,0 +1,192 @@
+'''
+Times the plugin's hot paths against FakeP4 and compares them to a stored baseline.
+
+    python benchmarks/run.py                        # everything, compared to baseline.json
+    python benchmarks/run.py tree.populate submit   # a subset
+    python benchmarks/run.py --quick                # smallest size of each scenario
+    python benchmarks/run.py --update-baseline      # store the current numbers
+    python benchmarks/run.py --latency 0.02         # with a 20ms round trip per server call
+    python benchmarks/run.py --replay session.jsonl --root //depot/show --file //depot/show/shot.ma
+
+Every case runs in its own process so the peak RSS belongs to that case alone.
+Exits with 1 when a case issues more server calls than the baseline, or is
+slower/larger than the baseline by more than the tolerances.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+baselinePath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'baseline.json')
+resultPrefix = 'BENCHMARK_RESULT '
+
+def peakRSS():
+    # In MB, ru_maxrss is in KB on Linux and bytes on OSX
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024.0
+    return rss / 1024.0
+
+def caseName(scenario, parameter):
+    return '%s[%s]' % (scenario, parameter)
+
+def runCase(scenario, parameter, replay=None, root=None, path=None, latency=0.0):
+    import Scenarios
+    Scenarios.setupEnvironment(replay, latency)
+
+    from perforce.PerforceUtils import Instrumentation
+
+    if replay:
+        setup = Scenarios.replayScenarios[scenario]
+        action = setup(None, root) if scenario.startswith('tree.') else setup(None, path)
+    else:
+        setup = Scenarios.scenarios[scenario][0]
+        action = setup(parameter)
+
+    recorder = Instrumentation.getRecorder()
+    recorder.reset()
+    rssBefore = peakRSS()
+
+    start = time.time()
+    action()
+    elapsed = time.time() - start
+
+    rssAfter = peakRSS()
+    commands = dict((x['shape'].split(' ')[0], 0) for x in recorder.summary())
+    for entry in recorder.summary():
+        commands[entry['shape'].split(' ')[0]] += entry['count']
+
+    return {
+        'calls': sum(commands.values()),
+        'commands': commands,
+        'wallTime': elapsed,
+        'peakRSS': rssAfter,
+        'rssGrowth': rssAfter - rssBefore if rssAfter is not None else None,
+    }
+
+def spawnCase(scenario, parameter, options):
+    args = [sys.executable, os.path.realpath(__file__), '--case', scenario, str(parameter),
+            '--latency', str(options.latency)]
+    if options.replay:
+        args += ['--replay', options.replay, '--root', options.root or '', '--file', options.file or '']
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+
+    for line in stdout.splitlines():
+        if line.startswith(resultPrefix):
+            return json.loads(line[len(resultPrefix):])
+
+    raise RuntimeError('%s failed:\n%s' % (caseName(scenario, parameter), stderr))
+
+def compare(name, result, baseline, options):
+    failures = []
+    expected = baseline.get(name)
+    if not expected:
+        return failures
+
+    if result['calls'] > expected['calls']:
+        failures.append('%s server calls (baseline %s)' % (result['calls'], expected['calls']))
+
+    if result['wallTime'] > expected['wallTime'] * options.timeTolerance + options.timeSlack:
+        failures.append('%.3fs (baseline %.3fs)' % (result['wallTime'], expected['wallTime']))
+
+    if result.get('rssGrowth') is not None and expected.get('rssGrowth') is not None and \
+       result['rssGrowth'] > expected['rssGrowth'] * options.memoryTolerance + options.memorySlack:
+        failures.append('%.1fMB RSS growth (baseline %.1fMB)' % (result['rssGrowth'], expected['rssGrowth']))
+
+    return failures
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='P4VFX benchmarks')
+    parser.add_argument('scenarios', nargs='*', help='Scenarios to run (default: all)')
+    parser.add_argument('--quick', action='store_true', help='Only run the smallest size of each scenario')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, the fastest is kept')
+    parser.add_argument('--baseline', default=baselinePath)
+    parser.add_argument('--update-baseline', dest='update', action='store_true')
+    parser.add_argument('--time-tolerance', dest='timeTolerance', type=float, default=1.5)
+    parser.add_argument('--time-slack', dest='timeSlack', type=float, default=0.05,
+                        help='Seconds allowed on top of the tolerance, to absorb noise on fast cases')
+    parser.add_argument('--memory-tolerance', dest='memoryTolerance', type=float, default=1.5)
+    parser.add_argument('--memory-slack', dest='memorySlack', type=float, default=16.0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every server call, to see what call counts cost over a real network')
+    parser.add_argument('--replay', help='Run the read-only scenarios against a FakeP4.SessionRecorder file')
+    parser.add_argument('--root', help='Tree root to populate when replaying')
+    parser.add_argument('--file', help='Depot file to show revisions of when replaying')
+    parser.add_argument('--case', nargs=2, help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.update and (options.replay or options.latency):
+        parser.error('The baseline is only kept for the synthetic depot without added latency')
+
+    if options.case:
+        scenario, parameter = options.case
+        result = runCase(scenario, int(parameter) if parameter.isdigit() else parameter,
+                         options.replay, options.root, options.file, options.latency)
+        print resultPrefix + json.dumps(result)
+        return 0
+
+    import Scenarios
+
+    if options.replay:
+        cases = [(x, 'replay') for x in sorted(Scenarios.replayScenarios)
+                 if (x.startswith('tree.') and options.root) or (x.startswith('revisions.') and options.file)]
+    else:
+        cases = []
+        for scenario in sorted(options.scenarios or Scenarios.scenarios):
+            if scenario not in Scenarios.scenarios:
+                parser.error('Unknown scenario %s, expected one of %s' % (scenario, ', '.join(sorted(Scenarios.scenarios))))
+            parameters = Scenarios.scenarios[scenario][1]
+            cases += [(scenario, x) for x in (parameters[:1] if options.quick else parameters)]
+
+    baseline = {}
+    if os.path.exists(options.baseline) and not options.replay and not options.latency:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print '%-32s %8s %10s %10s %10s' % ('case', 'calls', 'time (s)', 'RSS (MB)', 'growth')
+    for scenario, parameter in cases:
+        name = caseName(scenario, parameter)
+        runs = [spawnCase(scenario, parameter, options) for i in range(max(1, options.repeat))]
+        result = min(runs, key=lambda x: x['wallTime'])
+        results[name] = result
+
+        failures = compare(name, result, baseline, options)
+        if failures:
+            regressions.append((name, failures))
+
+        print '%-32s %8d %10.3f %10s %10s %s' % (
+            name, result['calls'], result['wallTime'],
+            '%.1f' % result['peakRSS'] if result['peakRSS'] is not None else '-',
+            '%.1f' % result['rssGrowth'] if result['rssGrowth'] is not None else '-',
+            'REGRESSION' if failures else '')
+
+    if options.update:
+        baseline.update(results)
+        with open(options.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True, separators=(',', ': '))
+        print '\nBaseline written to %s' % options.baseline
+        return 0
+
+    if regressions:
+        print '\nRegressions against %s:' % options.baseline
+        for name, failures in regressions:
+            print '  %s: %s' % (name, ', '.join(failures))
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
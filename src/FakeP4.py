@@ -0,0 +1,1216 @@
+'''
+Pure Python stand-in for the P4Python module, for running the plugin
+(GUI models, CmdsChangelist etc.) without a Perforce server or the
+compiled P4API.
+
+It serves either a synthetic depot:
+
+    import FakeP4
+    server = FakeP4.FakeServer(latency={'fstat': 0.05})
+    server.generate(fileCount=10000, revisions=(1, 50))
+    FakeP4.install(server)
+
+    import perforce     # 'from P4 import P4' now gives FakeP4.P4
+
+or replays a session recorded inside a host application:
+
+    from perforce.PerforceUtils import Instrumentation
+    Instrumentation.getRecorder().addListener(FakeP4.SessionRecorder('/tmp/session.jsonl'))
+    ...
+    FakeP4.install(FakeP4.ReplayServer('/tmp/session.jsonl'))
+'''
+import os
+import sys
+import re
+import json
+import time
+import random
+import datetime
+import tempfile
+import threading
+from contextlib import contextmanager
+
+#============================= P4Python surface ===============================
+class P4Exception(Exception):
+    """Exception thrown by P4 in case of Perforce errors or warnings"""
+
+    def __init__(self, value):
+        Exception.__init__(self)
+
+        if isinstance(value, (list, tuple)) and len(value) > 2:
+            self.value = value[0]
+            self.errors = value[1]
+            self.warnings = value[2]
+        else:
+            self.value = value
+            self.errors = []
+            self.warnings = []
+
+    def __str__(self):
+        return str(self.value)
+
+class Spec(dict):
+    def __getattr__(self, attr):
+        key = attr[1:] if attr.startswith('_') else attr
+        key = key[0].upper() + key[1:]
+        if key in self:
+            return self[key]
+        raise AttributeError(attr)
+
+    def __setattr__(self, attr, value):
+        key = attr[1:] if attr.startswith('_') else attr
+        self[key[0].upper() + key[1:]] = value
+
+class Revision(object):
+    def __init__(self, depotFile):
+        self.depotFile = depotFile
+        self.integrations = []
+        self.rev = None
+        self.change = None
+        self.action = None
+        self.type = None
+        self.time = None
+        self.user = None
+        self.client = None
+        self.desc = None
+        self.digest = None
+        self.fileSize = None
+
+    def __repr__(self):
+        return "Revision (depotFile = %s rev = %s change = %s action = %s)" % \
+            (self.depotFile, self.rev, self.change, self.action)
+
+class DepotFile(object):
+    def __init__(self, name):
+        self.depotFile = name
+        self.revisions = []
+
+    def new_revision(self):
+        r = Revision(self.depotFile)
+        self.revisions.append(r)
+        return r
+
+    def each_revision(self):
+        for r in self.revisions:
+            yield r
+
+def processFilelog(h):
+    df = DepotFile(h['depotFile'])
+    for n, rev in enumerate(h['rev']):
+        r = df.new_revision()
+        r.rev = int(rev)
+        r.change = int(h['change'][n])
+        r.action = h['action'][n]
+        r.type = h['type'][n]
+        r.time = datetime.datetime.utcfromtimestamp(int(h['time'][n]))
+        r.user = h['user'][n]
+        r.client = h['client'][n]
+        r.desc = h['desc'][n]
+        if 'fileSize' in h and n < len(h['fileSize']):
+            r.fileSize = h['fileSize'][n]
+    return df
+
+class OutputHandler(object):
+    REPORT = 0
+    HANDLED = 1
+    CANCEL = 2
+
+    def __init__(self):
+        pass
+
+class Progress(object):
+    TYPE_SENDFILE = 1
+    TYPE_RECEIVEFILE = 2
+    TYPE_TRANSFER = 3
+    TYPE_COMPUTATION = 4
+
+    def __init__(self):
+        pass
+
+class StreamedOutput(list):
+    # Rows already passed to the output handler as they were generated
+    pass
+
+def flatten(args):
+    result = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            result.extend(flatten(arg))
+        else:
+            result.append(arg)
+    return result
+
+
+class P4(object):
+    RAISE_ALL = 2
+    RAISE_ERROR = 1
+    RAISE_ERRORS = 1
+    RAISE_NONE = 0
+
+    # Server used by new instances, set by install()
+    server = None
+
+    def __init__(self, server=None):
+        self.server = server or P4.server or FakeServer()
+
+        self.port = os.getenv('P4PORT', 'fake:1666')
+        self.user = os.getenv('P4USER', 'artist')
+        self.client = os.getenv('P4CLIENT', 'artist_ws')
+        self.password = None
+        self.ticket_file = os.path.join(tempfile.gettempdir(), '.p4tickets')
+        self.charset = 'none'
+        self.prog = 'FakeP4'
+        self.p4config_file = 'noconfig'
+        self.cwd = os.getcwd()
+
+        self.exception_level = P4.RAISE_ALL
+        self.tagged = True
+        self.handler = None
+        self.progress = None
+        self.logger = None
+        self.input = None
+
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+
+        self._connected = False
+
+    def __repr__(self):
+        return "FakeP4 [%s@%s %s] %s" % (self.user, self.client, self.port,
+                                         "connected" if self._connected else "disconnected")
+
+    def __getattr__(self, name):
+        if name.startswith('run_'):
+            cmd = name[len('run_'):]
+            return lambda *args, **kargs: self.run(cmd, *args, **kargs)
+        elif name.startswith('delete_'):
+            cmd = name[len('delete_'):]
+            return lambda *args, **kargs: self.run(cmd, '-d', *args, **kargs)
+        elif name.startswith('fetch_'):
+            cmd = name[len('fetch_'):]
+            return lambda *args, **kargs: self.__fetch(cmd, *args, **kargs)
+        elif name.startswith('save_'):
+            cmd = name[len('save_'):]
+            return lambda *args, **kargs: self.__save(cmd, *args, **kargs)
+        raise AttributeError(name)
+
+    def __fetch(self, cmd, *args, **kargs):
+        result = self.run(cmd, '-o', *args, **kargs)
+        for r in result:
+            if isinstance(r, dict):
+                return r
+        return result[0]
+
+    def __save(self, cmd, *args, **kargs):
+        self.input = args[0]
+        return self.run(cmd, '-i', args[1:], **kargs)
+
+    def connect(self):
+        self.server.latencyFor('connect')
+        if not self.server.acceptConnection():
+            raise P4Exception('[P4.connect()] Connect to server failed; check $P4PORT.\n'
+                              'TCP connect to %s failed.\nconnect: Connection refused' % self.port)
+        self._connected = True
+        return self
+
+    def disconnect(self):
+        if not self._connected:
+            raise P4Exception('[P4.disconnect()] Not connected!')
+        self._connected = False
+
+    def connected(self):
+        return self._connected
+
+    def run(self, *args, **kargs):
+        context = {}
+        kargs.pop('resultLogging', None)
+        for k, v in kargs.items():
+            context[k] = getattr(self, k)
+            setattr(self, k, v)
+
+        try:
+            flatArgs = flatten(args)
+            for arg in flatArgs:
+                if not isinstance(arg, (basestring, dict)):
+                    raise TypeError('Arguments must be strings, got %r' % (arg,))
+
+            # Specs can be passed straight to submit, like P4Python does
+            for n, arg in enumerate(flatArgs):
+                if isinstance(arg, dict):
+                    self.input = flatArgs.pop(n)
+                    flatArgs.append('-i')
+                    break
+
+            if not self._connected:
+                raise P4Exception('[P4#run] Errors during command execution( "p4 %s" )\n\n'
+                                  '\t[Error]: \'Connect to server failed; check $P4PORT.\'' % ' '.join(flatArgs))
+
+            result, errors, warnings = self.server.execute(self, flatArgs)
+            if self.handler is not None and not isinstance(result, StreamedOutput):
+                result = self.handleOutput(result)
+            self.errors = errors
+            self.warnings = warnings
+            self.input = None
+
+            if (errors and self.exception_level >= P4.RAISE_ERRORS) or \
+               (warnings and self.exception_level >= P4.RAISE_ALL):
+                lines = ['\t[Error]: \'%s\'' % x for x in errors] + \
+                        ['\t[Warning]: \'%s\'' % x for x in warnings]
+                raise P4Exception('[P4#run] Errors during command execution( "p4 %s" )\n\n%s' %
+                                  (' '.join(flatArgs), '\n'.join(lines)))
+            return result
+        finally:
+            for k, v in context.items():
+                setattr(self, k, v)
+
+    def handleRow(self, row):
+        method = getattr(self.handler, 'outputStat' if isinstance(row, dict) else 'outputMessage', None)
+        return (method(row) if method else None) or OutputHandler.REPORT
+
+    def handleOutput(self, result):
+        # Same contract as P4Python, HANDLED drops the row and CANCEL stops the command
+        kept = []
+        for row in result:
+            status = self.handleRow(row)
+            if not status & OutputHandler.HANDLED:
+                kept.append(row)
+            if status & OutputHandler.CANCEL:
+                break
+        return kept
+
+    def run_filelog(self, *args, **kargs):
+        raw = self.run('filelog', args, **kargs)
+        if not self.tagged or not raw:
+            return raw
+        return [processFilelog(h) if isinstance(h, dict) else h for h in raw]
+
+    def run_login(self, *args):
+        self.input = self.password
+        return self.run('login', *args)
+
+    def run_submit(self, *args, **kargs):
+        return self.run('submit', *args, **kargs)
+
+    @contextmanager
+    def while_tagged(self, t):
+        old = self.tagged
+        self.tagged = t
+        yield
+        self.tagged = old
+
+    @contextmanager
+    def at_exception_level(self, e):
+        old = self.exception_level
+        self.exception_level = e
+        yield
+        self.exception_level = old
+
+    @contextmanager
+    def using_handler(self, c):
+        old = self.handler
+        self.handler = c
+        yield
+        self.handler = old
+
+
+#============================= Synthetic server ===============================
+class CommandError(Exception):
+    pass
+
+def parseArgs(args, flagsWithValues):
+    '''
+    Split command arguments into a flag dict and a list of file arguments
+    e.g. (['-m', '5', '-l', '//depot/...'], 'm') -> ({'m': '5', 'l': True}, ['//depot/...'])
+    '''
+    flags = {}
+    files = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('-') and len(arg) > 1:
+            name = arg[1:]
+            if len(name) == 1 and name in flagsWithValues:
+                i += 1
+                flags[name] = args[i] if i < len(args) else ''
+            else:
+                flags[name] = True
+        else:
+            files.append(arg)
+        i += 1
+    return flags, files
+
+def parseFilter(expression):
+    # Only the subset the plugin uses, 'field=value' terms joined with '&'
+    terms = []
+    for term in re.split(r'\s*&\s*|\s+', expression.strip().strip('"')):
+        if not term:
+            continue
+        negate = term.startswith('^')
+        field, _, value = term.lstrip('^').partition('=')
+        terms.append((field, value, negate))
+    return terms
+
+def matchesFilter(row, terms):
+    for field, value, negate in terms:
+        matched = str(row.get(field, '')) == value
+        if matched == negate:
+            return False
+    return True
+
+
+class FakeServer(object):
+    '''
+    In-memory depot mapped 1:1 into every client's root.
+    Revision history of generated files is computed on demand, so six
+    figure file counts with deep histories stay cheap.
+    '''
+
+    depotRoot = '//depot'
+    extensions = [('.ma', 'text'), ('.exr', 'binary+F'), ('.txt', 'text'), ('.abc', 'binary'), ('.nk', 'text')]
+    users = ['artist', 'animator', 'lighter', 'compositor']
+
+    def __init__(self, clientRoot=None, latency=None):
+        self.clientRoot = (clientRoot or os.path.join(tempfile.gettempdir(), 'fakep4_ws')).replace('\\', '/').rstrip('/')
+        self.latency = latency or {}
+        self.lock = threading.RLock()
+        self.startTime = 1500000000
+
+        # depotPath -> [type, headRev, deletedAtHead, fileIndex]
+        self.files = {}
+        # dirPath -> (set of subdirs, list of file paths)
+        self.dirs = {self.depotRoot: (set(), [])}
+        # Revisions added after generation, depotPath -> list of revision dicts
+        self.extraRevisions = {}
+        # change number -> dict, for changes submitted against the fake
+        self.submitted = {}
+        self.pendingChanges = {}
+        self.opened = {}
+        self.have = {}
+        self.maxRevisions = 1
+        self.generatedChanges = 0
+        self.nextChange = 1
+
+        self.commandCount = 0
+        self.droppedCommands = 0
+        self.refusedConnections = 0
+
+    #------------------------------ depot setup -------------------------------
+    def generate(self, fileCount=1000, revisions=(1, 10), filesPerDir=100, dirsPerDir=10,
+                 deletedRatio=0.05, otherOpenRatio=0.0, seed=0):
+        rng = random.Random(seed)
+        if isinstance(revisions, int):
+            revisions = (revisions, revisions)
+
+        self.maxRevisions = max(self.maxRevisions, revisions[1])
+        dirCount = max(1, (fileCount + filesPerDir - 1) // filesPerDir)
+
+        for i in range(fileCount):
+            dirIndex = i // filesPerDir
+
+            # Spread directories over a tree dirsPerDir wide
+            parts = []
+            n = dirIndex
+            while True:
+                parts.append('d%d' % (n % dirsPerDir))
+                n //= dirsPerDir
+                if not n:
+                    break
+            if dirCount > 1:
+                parts.append('assets')
+            dirPath = '/'.join([self.depotRoot] + list(reversed(parts)))
+
+            ext, filetype = self.extensions[i % len(self.extensions)]
+            path = '%s/file_%06d%s' % (dirPath, i, ext)
+            headRev = rng.randint(revisions[0], revisions[1])
+            deleted = headRev > 1 and rng.random() < deletedRatio
+
+            self.addFile(path, filetype, headRev, deleted, i)
+
+            if otherOpenRatio and rng.random() < otherOpenRatio:
+                user = self.users[1 + i % (len(self.users) - 1)]
+                self.opened[path] = {'action': 'edit', 'change': 'default', 'type': filetype,
+                                     'user': user, 'client': user + '_ws', 'locked': False}
+
+        self.generatedChanges = fileCount * self.maxRevisions
+        self.nextChange = self.generatedChanges + 1
+        return self
+
+    def addFile(self, path, filetype='text', headRev=1, deleted=False, index=None):
+        self.files[path] = [filetype, headRev, deleted, index if index is not None else len(self.files)]
+        self.have[path] = headRev
+
+        dirPath, name = path.rsplit('/', 1)
+        self.addDir(dirPath)
+        self.dirs[dirPath][1].append(path)
+
+    def addDir(self, dirPath):
+        if dirPath in self.dirs:
+            return
+        self.dirs[dirPath] = (set(), [])
+        parent = dirPath.rsplit('/', 1)[0]
+        if parent.startswith(self.depotRoot) and parent != dirPath:
+            self.addDir(parent)
+            self.dirs[parent][0].add(dirPath)
+
+    def latencyFor(self, command):
+        delay = self.latency.get(command, self.latency.get('*', 0))
+        if delay:
+            time.sleep(delay)
+
+    def outage(self, commands=1, connections=0):
+        '''
+        Drop the connection of the next commands, and refuse the next
+        connections after that, like a network blip would
+        '''
+        self.droppedCommands = commands
+        self.refusedConnections = connections
+
+    def acceptConnection(self):
+        with self.lock:
+            if self.refusedConnections > 0:
+                self.refusedConnections -= 1
+                return False
+        return True
+
+    #------------------------------ revisions ---------------------------------
+    def generatedRevision(self, path, rev):
+        filetype, headRev, deleted, index = self.files[path]
+        change = index * self.maxRevisions + rev
+        user = self.users[(index + rev) % len(self.users)]
+
+        if rev == 1:
+            action = 'add'
+        elif deleted and rev == headRev:
+            action = 'delete'
+        else:
+            action = 'edit'
+
+        return {'rev': rev, 'change': change, 'action': action, 'type': filetype,
+                'time': self.startTime + change * 60, 'user': user, 'client': user + '_ws',
+                'desc': 'Update %s (revision %d)\n\nGenerated history for benchmarking' % (path.rsplit('/', 1)[1], rev),
+                'fileSize': 1024 * (1 + (index + rev) % 512)}
+
+    def revision(self, path, rev):
+        generatedHead = self.files[path][1] - len(self.extraRevisions.get(path, []))
+        if rev > generatedHead:
+            return self.extraRevisions[path][rev - generatedHead - 1]
+        return self.generatedRevision(path, rev)
+
+    def headRevision(self, path):
+        return self.revision(path, self.files[path][1])
+
+    def addRevision(self, path, action, filetype, change, user, client, desc):
+        if path not in self.files:
+            self.addFile(path, filetype, 0)
+            # addFile() starts the generated history at 0 revisions
+            self.files[path][1] = 0
+
+        entry = self.files[path]
+        entry[1] += 1
+        entry[0] = filetype
+        entry[2] = action in ('delete', 'move/delete')
+
+        revision = {'rev': entry[1], 'change': change, 'action': action, 'type': filetype,
+                    'time': int(time.time()), 'user': user, 'client': client, 'desc': desc, 'fileSize': 1024}
+        self.extraRevisions.setdefault(path, []).append(revision)
+        self.have[path] = entry[1]
+        return revision
+
+    def describeChange(self, change):
+        change = int(change)
+        if change in self.submitted:
+            return self.submitted[change]
+
+        if change > self.generatedChanges or change < 1:
+            return None
+
+        index, rev = divmod(change - 1, self.maxRevisions)
+        rev += 1
+        path = self.pathForIndex(index)
+        if not path or rev > self.files[path][1] - len(self.extraRevisions.get(path, [])):
+            return {'change': change, 'files': [], 'user': self.users[0], 'client': self.users[0] + '_ws',
+                    'time': self.startTime + change * 60, 'desc': 'Empty change', 'status': 'submitted'}
+
+        revision = self.generatedRevision(path, rev)
+        return {'change': change, 'files': [(path, rev, revision['action'], revision['type'])],
+                'user': revision['user'], 'client': revision['client'], 'time': revision['time'],
+                'desc': revision['desc'], 'status': 'submitted'}
+
+    def pathForIndex(self, index):
+        if not hasattr(self, 'indexToPath') or len(self.indexToPath) != len(self.files):
+            self.indexToPath = dict((v[3], k) for k, v in self.files.items())
+        return self.indexToPath.get(index)
+
+    #------------------------------ paths -------------------------------------
+    def clientRootFor(self, p4):
+        return self.clientRoot
+
+    def toDepot(self, p4, path):
+        path = path.replace('\\', '/')
+        clientPrefix = '//%s' % p4.client
+
+        if path.startswith(self.depotRoot):
+            return path
+        if path == clientPrefix or path.startswith(clientPrefix + '/'):
+            return self.depotRoot + path[len(clientPrefix):]
+        if path.startswith('//'):
+            raise CommandError("%s - must refer to client '%s'." % (path, p4.client))
+
+        if not os.path.isabs(path) and not re.match(r'^[a-zA-Z]:/', path):
+            path = '/'.join([str(p4.cwd).replace('\\', '/').rstrip('/'), path])
+
+        root = self.clientRootFor(p4)
+        path = os.path.normpath(path).replace('\\', '/')
+        if path == root or path.startswith(root + '/'):
+            return self.depotRoot + path[len(root):]
+
+        raise CommandError("Path '%s' is not under client's root '%s'." % (path, root))
+
+    def toLocal(self, p4, depotPath):
+        return self.clientRootFor(p4) + depotPath[len(self.depotRoot):]
+
+    def toClientSyntax(self, p4, depotPath):
+        return '//%s%s' % (p4.client, depotPath[len(self.depotRoot):])
+
+    def splitRevision(self, path):
+        for marker in ('#', '@'):
+            if marker in path:
+                path, _, spec = path.partition(marker)
+                return path, marker + spec
+        return path, None
+
+    def resolvePaths(self, p4, spec, includeDeleted=True):
+        '''
+        Expand a file argument into (depotPath, revisionSpec) pairs and the
+        directories it matched (for fstat -D)
+        '''
+        spec, revision = self.splitRevision(spec)
+
+        if spec.endswith('/...') or spec == '...':
+            base = self.toDepot(p4, spec[:-4] if spec != '...' else '.')
+            paths = []
+            stack = [base]
+            while stack:
+                subdirs, files = self.dirs.get(stack.pop(), ((), ()))
+                paths.extend(files)
+                stack.extend(subdirs)
+            # Files opened for add only exist in the opened table
+            paths.extend(x for x in self.opened if x.startswith(base + '/') and x not in self.files)
+            return sorted(paths), revision, []
+
+        if spec.endswith('/*'):
+            base = self.toDepot(p4, spec[:-2])
+            subdirs, files = self.dirs.get(base, ((), ()))
+            files = list(files) + [x for x in self.opened
+                                   if x.rsplit('/', 1)[0] == base and x not in self.files]
+            return sorted(files), revision, sorted(subdirs)
+
+        path = self.toDepot(p4, spec)
+        if path in self.dirs and path not in self.files:
+            return [], revision, []
+        if path in self.files or path in self.opened:
+            return [path], revision, []
+        return [], revision, []
+
+    def revisionAt(self, path, revision):
+        # Head revision number for a path, optionally limited by #rev or @change
+        if path not in self.files:
+            return None
+
+        headRev = self.files[path][1]
+        if not revision:
+            return headRev
+        if revision.startswith('#'):
+            value = revision[1:]
+            if value == 'head':
+                return headRev
+            if value in ('none', '0'):
+                return None
+            return min(int(value), headRev)
+        if revision.startswith('@'):
+            change = int(revision.lstrip('@>='))
+            for rev in range(headRev, 0, -1):
+                if self.revision(path, rev)['change'] <= change:
+                    return rev
+            return None
+        return headRev
+
+    def expandFiles(self, p4, fileArgs, missing='no such file(s).'):
+        paths = []
+        warnings = []
+        for spec in fileArgs:
+            matched, revision, dirs = self.resolvePaths(p4, spec)
+            if not matched:
+                warnings.append('%s - %s' % (spec, missing))
+            paths.extend((path, revision) for path in matched)
+        return paths, warnings
+
+    #------------------------------ commands ----------------------------------
+    def execute(self, p4, args):
+        command = args[0]
+        with self.lock:
+            self.commandCount += 1
+
+        self.latencyFor(command)
+
+        with self.lock:
+            if self.droppedCommands > 0:
+                self.droppedCommands -= 1
+                p4._connected = False
+                return [], ['TCP receive failed.\nread: socket: Connection reset by peer'], []
+
+        handler = getattr(self, 'cmd_' + command, None)
+        if handler is None:
+            return [], ['Unknown command.  Try \'p4 help\' for info.'], []
+
+        try:
+            with self.lock:
+                result = handler(p4, args[1:])
+        except CommandError as e:
+            return [], [str(e)], []
+
+        if isinstance(result, tuple):
+            return result
+        return result, [], []
+
+    def cmd_info(self, p4, args):
+        return [{'userName': p4.user, 'clientName': p4.client, 'clientRoot': self.clientRootFor(p4),
+                 'clientHost': 'localhost', 'serverAddress': p4.port, 'serverVersion': 'FakeP4/PY/2016.1',
+                 'serverDate': time.strftime('%Y/%m/%d %H:%M:%S'), 'serverLicense': 'none'}]
+
+    def cmd_login(self, p4, args):
+        if '-s' in args:
+            return [{'User': p4.user, 'TicketExpiration': '43200'}]
+        return [{'User': p4.user, 'TicketExpiration': '43200'}]
+
+    def cmd_trust(self, p4, args):
+        return []
+
+    def cmd_client(self, p4, args):
+        return [Spec({'Client': p4.client, 'Owner': p4.user, 'Root': self.clientRootFor(p4),
+                      'View': ['%s/... //%s/...' % (self.depotRoot, p4.client)]})]
+
+    def cmd_clients(self, p4, args):
+        return [{'client': p4.client, 'Root': self.clientRootFor(p4), 'Owner': p4.user}]
+
+    def cmd_user(self, p4, args):
+        return [Spec({'User': p4.user, 'Email': '%s@localhost' % p4.user, 'FullName': p4.user})]
+
+    def cmd_change(self, p4, args):
+        flags, rest = parseArgs(args, 'd')
+        if 'o' in flags:
+            if rest:
+                change = self.pendingChanges.get(int(rest[0])) or self.describeChange(rest[0])
+                if not change:
+                    raise CommandError('Change %s unknown.' % rest[0])
+                return [Spec({'Change': str(change['change']), 'Description': change['desc'],
+                              'User': change['user'], 'Client': change['client'], 'Status': change['status'],
+                              'Files': [x for x, opened in self.opened.items() if opened['change'] == str(change['change'])]})]
+            return [Spec({'Change': 'new', 'Description': '<enter description here>', 'User': p4.user,
+                          'Client': p4.client, 'Status': 'new'})]
+        if 'd' in flags:
+            number = int(flags['d'])
+            self.pendingChanges.pop(number, None)
+            return ['Change %d deleted.' % number]
+        if 'i' in flags:
+            spec = p4.input or {}
+            number = self.nextChange
+            self.nextChange += 1
+            self.pendingChanges[number] = {'change': number, 'desc': spec.get('Description', ''), 'user': p4.user,
+                                           'client': p4.client, 'time': int(time.time()), 'status': 'pending'}
+            return ['Change %d created.' % number]
+        return []
+
+    def cmd_changes(self, p4, args):
+        flags, rest = parseArgs(args, 'msu')
+        status = flags.get('s')
+        limit = int(flags['m']) if 'm' in flags else None
+        results = []
+
+        if status in (None, 'pending'):
+            for number, change in sorted(self.pendingChanges.items(), reverse=True):
+                results.append(self.changeRow(change))
+
+        if status in (None, 'submitted'):
+            after = 0
+            for spec in rest:
+                match = re.search(r'@>(\d+)', spec)
+                if match:
+                    after = int(match.group(1))
+
+            last = self.nextChange - 1
+            number = last
+            while number > after and (limit is None or len(results) < limit):
+                change = self.describeChange(number)
+                if change:
+                    results.append(self.changeRow(change))
+                number -= 1
+
+        if limit is not None:
+            results = results[:limit]
+        return results
+
+    def changeRow(self, change):
+        return {'change': str(change['change']), 'time': str(change['time']), 'user': change['user'],
+                'client': change['client'], 'status': change['status'], 'desc': change['desc'][:31]}
+
+    def cmd_describe(self, p4, args):
+        flags, rest = parseArgs(args, '')
+        results = []
+        for number in rest:
+            change = self.describeChange(number)
+            if not change:
+                raise CommandError('%s - no such changelist.' % number)
+            row = {'change': str(change['change']), 'user': change['user'], 'client': change['client'],
+                   'time': str(change['time']), 'desc': change['desc'], 'status': change['status'],
+                   'depotFile': [], 'action': [], 'rev': [], 'type': []}
+            for path, rev, action, filetype in change['files']:
+                row['depotFile'].append(path)
+                row['action'].append(action)
+                row['rev'].append(str(rev))
+                row['type'].append(filetype)
+            results.append(row)
+        return results
+
+    def fstatRow(self, p4, path, revision=None):
+        row = {'depotFile': path, 'clientFile': self.toLocal(p4, path)}
+
+        if path in self.files:
+            rev = self.revisionAt(path, revision)
+            if rev:
+                head = self.revision(path, rev)
+                row.update({'headAction': head['action'], 'headType': head['type'], 'headTime': str(head['time']),
+                            'headRev': str(head['rev']), 'headChange': str(head['change']),
+                            'headModTime': str(head['time']), 'fileSize': str(head['fileSize'])})
+            if self.have.get(path):
+                row['haveRev'] = str(self.have[path])
+
+        opened = self.opened.get(path)
+        if opened:
+            mine = opened['user'] == p4.user and opened['client'] == p4.client
+            if mine:
+                row.update({'action': opened['action'], 'change': opened['change'], 'type': opened['type'],
+                            'actionOwner': opened['user'], 'workRev': row.get('haveRev', '1')})
+                if opened.get('locked'):
+                    row['ourLock'] = ''
+            else:
+                row['otherOpen'] = ['%s@%s' % (opened['user'], opened['client'])]
+                row['otherAction'] = [opened['action']]
+                if opened.get('locked'):
+                    row['otherLock'] = ['%s@%s' % (opened['user'], opened['client'])]
+        return row
+
+    def cmd_fstat(self, p4, args):
+        flags, rest = parseArgs(args, 'FTme')
+        filters = parseFilter(flags['F']) if 'F' in flags else []
+        fields = re.split(r'[\s,]+', flags['T'].strip()) if 'T' in flags else None
+        limit = int(flags['m']) if 'm' in flags else None
+        showDirs = any(x.startswith('D') for x in flags)
+        openedOnly = 'Ro' in flags
+
+        # Large listings are handed to the output handler a row at a time, like the server streams them
+        results = StreamedOutput() if p4.handler is not None else []
+        warnings = []
+        count = 0
+        for spec in rest:
+            paths, revision, dirs = self.resolvePaths(p4, spec)
+            matched = False
+
+            for path in paths:
+                if openedOnly and path not in self.opened:
+                    continue
+                row = self.fstatRow(p4, path, revision)
+                if 'headAction' not in row and 'action' not in row and 'otherOpen' not in row:
+                    continue
+                if filters and not matchesFilter(row, filters):
+                    continue
+                if fields:
+                    row = dict((k, v) for k, v in row.items() if k in fields)
+                matched = True
+                count += 1
+
+                status = p4.handleRow(row) if p4.handler is not None else OutputHandler.REPORT
+                if not status & OutputHandler.HANDLED:
+                    results.append(row)
+                if status & OutputHandler.CANCEL or (limit is not None and count >= limit):
+                    return results, [], warnings
+
+            if showDirs:
+                for dirPath in dirs:
+                    results.append({'dir': dirPath})
+                    matched = True
+
+            if not matched:
+                warnings.append('%s - no such file(s).' % spec)
+
+        return results, [], warnings
+
+    def cmd_files(self, p4, args):
+        flags, rest = parseArgs(args, 'm')
+        limit = int(flags['m']) if 'm' in flags else None
+        results = []
+        paths, warnings = self.expandFiles(p4, rest)
+        for path, revision in paths:
+            rev = self.revisionAt(path, revision)
+            if not rev:
+                continue
+            head = self.revision(path, rev)
+            if 'e' in flags and head['action'] in ('delete', 'move/delete'):
+                continue
+            results.append({'depotFile': path, 'rev': str(rev), 'change': str(head['change']),
+                            'action': head['action'], 'type': head['type'], 'time': str(head['time'])})
+            if limit is not None and len(results) >= limit:
+                break
+        return results, [], warnings
+
+    def cmd_dirs(self, p4, args):
+        results = []
+        for spec in args:
+            if spec.endswith('/*'):
+                subdirs = self.dirs.get(self.toDepot(p4, spec[:-2]), ((), ()))[0]
+                results.extend({'dir': x} for x in sorted(subdirs))
+        return results
+
+    def cmd_filelog(self, p4, args):
+        flags, rest = parseArgs(args, 'm')
+        limit = int(flags['m']) if 'm' in flags else None
+        longDesc = 'l' in flags or 'L' in flags
+
+        results = []
+        paths, warnings = self.expandFiles(p4, rest)
+        for path, revision in paths:
+            headRev = self.revisionAt(path, revision)
+            if not headRev:
+                continue
+
+            row = dict((key, []) for key in ('rev', 'change', 'action', 'type', 'time', 'user', 'client', 'desc', 'fileSize'))
+            row['depotFile'] = path
+            for rev in range(headRev, 0, -1):
+                if limit is not None and len(row['rev']) >= limit:
+                    break
+                data = self.revision(path, rev)
+                for key in row:
+                    if key == 'depotFile':
+                        continue
+                    value = data[key]
+                    if key == 'desc' and not longDesc:
+                        value = value[:31]
+                    row[key].append(str(value))
+            results.append(row)
+        return results, [], warnings
+
+    def openedRow(self, p4, path, opened):
+        row = {'depotFile': path, 'clientFile': self.toClientSyntax(p4, path), 'rev': str(self.have.get(path) or 1),
+               'action': opened['action'], 'change': opened['change'], 'type': opened['type'],
+               'user': opened['user'], 'client': opened['client']}
+        if opened.get('locked'):
+            row['ourLock'] = ''
+        return row
+
+    def cmd_opened(self, p4, args):
+        flags, rest = parseArgs(args, 'ucCm')
+        user = flags.get('u')
+        client = flags.get('C')
+        change = flags.get('c')
+
+        if rest:
+            candidates = []
+            for spec in rest:
+                matched, revision, dirs = self.resolvePaths(p4, spec)
+                candidates.extend(matched)
+        else:
+            candidates = sorted(self.opened)
+
+        results = []
+        for path in candidates:
+            opened = self.opened.get(path)
+            if not opened:
+                continue
+            if user and opened['user'] != user:
+                continue
+            if client and opened['client'] != client:
+                continue
+            if change and opened['change'] != change:
+                continue
+            if not ('a' in flags or user or client) and opened['client'] != p4.client:
+                continue
+            results.append(self.openedRow(p4, path, opened))
+
+        if not results:
+            return [], [], ['%s - file(s) not opened on this client.' % (' '.join(rest) or '...')]
+        return results
+
+    def openFiles(self, p4, args, action):
+        flags, rest = parseArgs(args, 'ct')
+        change = flags.get('c', 'default')
+        results = []
+        paths, warnings = self.expandFiles(p4, rest)
+
+        if action == 'add':
+            paths = []
+            warnings = []
+            for spec in rest:
+                path = self.toDepot(p4, spec)
+                if path in self.files and not self.files[path][2]:
+                    warnings.append('%s - can\'t add existing file' % spec)
+                else:
+                    paths.append((path, None))
+
+        for path, revision in paths:
+            existing = self.opened.get(path)
+            if existing and (existing['user'] != p4.user or existing['client'] != p4.client):
+                if existing.get('locked'):
+                    warnings.append('%s - already locked by %s@%s' % (path, existing['user'], existing['client']))
+                    continue
+            if existing and existing['client'] == p4.client:
+                existing['change'] = change
+                results.append({'depotFile': path, 'clientFile': self.toLocal(p4, path), 'action': existing['action'],
+                                'change': change, 'type': existing['type']})
+                continue
+
+            filetype = self.files[path][0] if path in self.files else flags.get('t', 'text')
+            self.opened[path] = {'action': action, 'change': change, 'type': filetype,
+                                 'user': p4.user, 'client': p4.client, 'locked': False}
+            results.append({'depotFile': path, 'clientFile': self.toLocal(p4, path), 'action': action,
+                            'change': change, 'type': filetype, 'workRev': str(self.have.get(path, 1))})
+        return results, [], warnings
+
+    def cmd_edit(self, p4, args):
+        return self.openFiles(p4, args, 'edit')
+
+    def cmd_add(self, p4, args):
+        return self.openFiles(p4, args, 'add')
+
+    def cmd_delete(self, p4, args):
+        return self.openFiles(p4, args, 'delete')
+
+    def setLock(self, p4, args, locked):
+        flags, rest = parseArgs(args, 'c')
+        results = []
+        warnings = []
+        if 'c' in flags and not rest:
+            paths = [(x, None) for x, opened in self.opened.items() if opened['change'] == flags['c']]
+        else:
+            paths, warnings = self.expandFiles(p4, rest or ['...'])
+
+        for path, revision in paths:
+            opened = self.opened.get(path)
+            if not opened or opened['client'] != p4.client:
+                warnings.append('%s - file(s) not opened on this client.' % path)
+                continue
+            opened['locked'] = locked
+            results.append({'depotFile': path, 'clientFile': self.toLocal(p4, path), 'action': opened['action']})
+        return results, [], warnings
+
+    def cmd_lock(self, p4, args):
+        return self.setLock(p4, args, True)
+
+    def cmd_unlock(self, p4, args):
+        return self.setLock(p4, args, False)
+
+    def cmd_revert(self, p4, args):
+        flags, rest = parseArgs(args, 'c')
+        results = []
+        candidates = []
+        for spec in rest:
+            matched, revision, dirs = self.resolvePaths(p4, spec)
+            candidates.extend(matched)
+
+        for path in candidates:
+            opened = self.opened.get(path)
+            if not opened or opened['client'] != p4.client:
+                continue
+            if 'c' in flags and opened['change'] != flags['c']:
+                continue
+            del self.opened[path]
+            results.append({'depotFile': path, 'clientFile': self.toLocal(p4, path), 'action': 'reverted',
+                            'oldAction': opened['action']})
+
+        if not results:
+            return [], [], ['%s - file(s) not opened on this client.' % ' '.join(rest)]
+        return results
+
+    def cmd_submit(self, p4, args):
+        flags, rest = parseArgs(args, 'dc')
+        description = flags.get('d')
+        changeFilter = flags.get('c', 'default')
+
+        if 'i' in flags and p4.input:
+            spec = p4.input
+            description = spec.get('Description', description)
+            changeFilter = str(spec.get('Change', 'default'))
+            if changeFilter == 'new':
+                changeFilter = 'default'
+
+        paths = sorted(path for path, opened in self.opened.items()
+                       if opened['client'] == p4.client and opened['user'] == p4.user
+                       and opened['change'] == changeFilter)
+        if not paths:
+            raise CommandError('No files to submit.')
+
+        number = self.nextChange
+        self.nextChange += 1
+        change = {'change': number, 'files': [], 'user': p4.user, 'client': p4.client,
+                  'time': int(time.time()), 'desc': description or '', 'status': 'submitted'}
+
+        results = [{'change': str(number), 'openFiles': str(len(paths)), 'locked': str(len(paths))}]
+        for path in paths:
+            opened = self.opened[path]
+            revision = self.addRevision(path, opened['action'], opened['type'], number,
+                                        p4.user, p4.client, change['desc'])
+            change['files'].append((path, revision['rev'], revision['action'], revision['type']))
+            results.append({'depotFile': path, 'rev': str(revision['rev']), 'action': revision['action']})
+
+            if 'r' in flags and opened['action'] != 'delete':
+                opened['action'] = 'edit'
+                opened['change'] = 'default'
+            else:
+                del self.opened[path]
+
+        self.submitted[number] = change
+        self.pendingChanges.pop(int(changeFilter) if changeFilter.isdigit() else None, None)
+        results.append({'submittedChange': str(number)})
+        return results
+
+    def cmd_sync(self, p4, args):
+        flags, rest = parseArgs(args, 'm')
+        results = []
+        paths, warnings = self.expandFiles(p4, rest or ['...'])
+        for path, revision in paths:
+            rev = self.revisionAt(path, revision)
+            if rev is None:
+                continue
+            if self.have.get(path) == rev and 'f' not in flags:
+                continue
+            self.have[path] = rev
+            head = self.revision(path, rev)
+            results.append({'depotFile': path, 'clientFile': self.toLocal(p4, path), 'rev': str(rev),
+                            'action': 'deleted' if head['action'] == 'delete' else 'updated'})
+
+        if not results and not warnings:
+            warnings.append('%s - file(s) up-to-date.' % ' '.join(rest or ['...']))
+        return results, [], warnings
+
+    def cmd_resolve(self, p4, args):
+        return [], [], ['No file(s) to resolve.']
+
+    def cmd_print(self, p4, args):
+        flags, rest = parseArgs(args, 'o')
+        paths, warnings = self.expandFiles(p4, rest)
+        results = []
+        for path, revision in paths:
+            rev = self.revisionAt(path, revision)
+            content = 'FakeP4 content of %s#%s\n' % (path, rev)
+            if 'o' in flags:
+                with open(flags['o'], 'w') as f:
+                    f.write(content)
+            results.append({'depotFile': path, 'rev': str(rev)})
+            results.append(content)
+        return results, [], warnings
+
+    def cmd_where(self, p4, args):
+        results = []
+        for spec in args:
+            path = self.toDepot(p4, spec)
+            results.append({'depotFile': path, 'clientFile': self.toClientSyntax(p4, path),
+                            'path': self.toLocal(p4, path)})
+        return results
+
+
+#============================= Record & replay ================================
+def jsonSafe(value):
+    if isinstance(value, dict):
+        return dict((str(k), jsonSafe(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [jsonSafe(x) for x in value]
+    if isinstance(value, (int, long, float, bool)) or value is None:
+        return value
+    if isinstance(value, unicode):
+        return value
+    return str(value).decode('utf-8', 'replace')
+
+class SessionRecorder(object):
+    '''
+    Writes every command and its raw result to a JSON-lines file.
+    Add it as a listener on Instrumentation.getRecorder() in a live session.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, args, elapsed, result, error=None):
+        entry = {'args': [str(x) for x in flatten(args)], 'elapsed': elapsed,
+                 'result': jsonSafe(result), 'error': str(error) if error is not None else None}
+
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+class ReplayServer(object):
+    '''
+    Serves results recorded by SessionRecorder. Commands are matched on their
+    exact arguments, repeated commands replay their recordings in order
+    (the last one is reused once they run out). With realtime=True the
+    recorded latency is reproduced as well.
+    '''
+
+    def __init__(self, path, realtime=False):
+        self.realtime = realtime
+        self.latency = {}
+        self.lock = threading.Lock()
+        self.recordings = {}
+        self.commandCount = 0
+
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    key = tuple(str(x) for x in entry['args'])
+                    self.recordings.setdefault(key, []).append(entry)
+
+    def latencyFor(self, command):
+        pass
+
+    def acceptConnection(self):
+        return True
+
+    def execute(self, p4, args):
+        key = tuple(str(x) for x in args)
+        with self.lock:
+            self.commandCount += 1
+            entries = self.recordings.get(key)
+            if not entries:
+                return [], ['%s - not in the recorded session.' % ' '.join(key)], []
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+
+        if self.realtime:
+            time.sleep(entry['elapsed'])
+
+        if entry['error']:
+            if '[Error]' in entry['error']:
+                return entry['result'] or [], [entry['error']], []
+            return entry['result'] or [], [], [entry['error']]
+        return entry['result'], [], []
+
+
+#============================= Installing ====================================
+def install(server=None, force=False):
+    '''
+    Make 'import P4' return this module. Unless force is set the real
+    P4Python is still preferred when it can be imported.
+    '''
+    if not force and 'P4' in sys.modules and sys.modules['P4'] is not sys.modules[__name__]:
+        return sys.modules['P4']
+
+    if not force:
+        try:
+            return __import__('P4')
+        except ImportError:
+            pass
+
+    P4.server = server or FakeServer()
+    sys.modules['P4'] = sys.modules[__name__]
+    return sys.modules[__name__]
@@ -15,7 +15,8 @@ class TestInterop(BaseInterop):
                 if e.key() == QtCore.Qt.Key_Escape:
                     self.close()
 
-        app = QtWidgets.QApplication([])
+        # Other tests in the same run may have made one already, Qt only allows one
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
 
         TestInterop.window = TestWidget()
         return TestInterop.window, app
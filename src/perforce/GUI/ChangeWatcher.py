@@ -0,0 +1,115 @@
+import os
+
+from qtpy import QtCore
+
+import perforce.Utils as Utils
+from perforce.PerforceUtils import MetadataCache
+from perforce.PerforceUtils import PathIndex
+import CommandExecutor
+
+def watchStart(p4, root):
+    # Where to count changes from, and which depot folder root is for client paths
+    return MetadataCache.latestChange(p4, root), PathIndex.depotRootOf(p4, root)
+
+
+class ChangeWatcher(QtCore.QObject):
+    '''
+    Polls for changes submitted under a PerforceItemModel's root and refreshes
+    just the folders they touched, rather than populating the whole tree again.
+    Each poll is a single 'changes @>N' when nothing has been submitted.
+    '''
+
+    # Depot paths of the files touched by newly submitted changes
+    changed = QtCore.Signal(object)
+
+    # Seconds between polls (0 to disable)
+    interval = float(os.getenv('P4VFX_REFRESH_INTERVAL', 30))
+
+    def __init__(self, model, root, parent=None):
+        super(ChangeWatcher, self).__init__(parent)
+
+        self.model = model
+        self.root = root
+        self.change = None
+        self.depotRoot = None
+        self.request = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.poll)
+
+    def start(self):
+        if not self.interval:
+            return
+
+        self.request = self.submit(watchStart, self.root).then(self.onStarted, self.onFailed)
+        self.timer.start(int(self.interval * 1000))
+
+    def stop(self):
+        self.timer.stop()
+        if self.request:
+            self.request.cancel()
+            self.request = None
+
+    def submit(self, command, *args):
+        # Behind anything the user is waiting on
+        return CommandExecutor.getExecutor(self.model.p4).submit(command, *args, priority=10)
+
+    def onStarted(self, result):
+        self.request = None
+        self.change, self.depotRoot = result
+
+    def onFailed(self, e):
+        self.request = None
+        Utils.p4Logger().warning('Failed to check %s for changes: %s' % (self.root, e))
+
+    def poll(self):
+        if self.request is not None:
+            return
+
+        if self.change is None:
+            self.start()
+            return
+
+        # The model may have caught up further, e.g. revalidating a cached tree
+        since = max(self.change, self.model.change or 0)
+
+        if self.model.trie:
+            trie = self.model.trie
+            self.request = self.submit(MetadataCache.changesSince, self.root, since, [],
+                                       trie.rootNode.depotPath, False)
+            self.request.then(lambda result: self.onChanges(trie, result), self.onFailed)
+        else:
+            self.request = self.submit(MetadataCache.submittedSince, self.root, since)
+            self.request.then(self.onSubmitted, self.onFailed)
+
+    def onChanges(self, trie, result):
+        self.request = None
+        if self.model.trie is not trie:
+            return
+
+        self.change = result[0] if result else None
+        self.model.applyChanges(self.root, result)
+
+        if result and (result[1] or result[2]):
+            self.changed.emit([x['depotFile'] for x in result[1]] + result[2])
+
+    def onSubmitted(self, result):
+        self.request = None
+        if result is None:
+            self.change = None
+            self.model.populate(self.root)
+            return
+
+        self.change, files = result
+        if not files or not self.depotRoot:
+            return
+
+        self.changed.emit(files)
+
+        directories = set()
+        for path in files:
+            if path.startswith(self.depotRoot + '/'):
+                directories.add(os.path.dirname(path[len(self.depotRoot) + 1:]))
+
+        Utils.p4Logger().debug('Refreshing %d folders changed under %s' % (len(directories), self.root))
+        self.model.refreshDirectories(self.root, directories)
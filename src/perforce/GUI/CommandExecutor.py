@@ -0,0 +1,169 @@
+import itertools
+import threading
+import Queue
+
+from P4 import P4, P4Exception
+from qtpy import QtCore
+
+import perforce.Utils as Utils
+from perforce.PerforceUtils import ConnectionPool
+
+class CommandFuture(QtCore.QObject):
+    '''
+    Result of a command queued on a CommandExecutor.
+    finished/failed are always emitted on the thread that created the future
+    (the GUI thread), so they can be connected straight to widget updates.
+    '''
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(object)
+
+    # Emitted from the worker, delivered to deliver() through the event loop
+    completed = QtCore.Signal()
+
+    def __init__(self, command, args, kargs, priority=0, exceptionLevel=P4.RAISE_ERRORS, pending=None):
+        super(CommandFuture, self).__init__()
+        self.command = command
+        self.args = args
+        self.kargs = kargs
+        self.priority = priority
+        self.exceptionLevel = exceptionLevel
+        self.pending = pending
+
+        self.result = None
+        self.error = None
+        self.started = False
+        self.cancelled = False
+        self.doneEvent = threading.Event()
+
+        self.completed.connect(self.deliver, QtCore.Qt.QueuedConnection)
+
+    def __repr__(self):
+        return '<CommandFuture %s %s>' % (self.command, self.args)
+
+    def cancel(self):
+        # Commands already sent to the server can't be stopped, only ignored
+        self.cancelled = True
+        return not self.started
+
+    def isDone(self):
+        return self.doneEvent.is_set()
+
+    def wait(self, timeout=None):
+        self.doneEvent.wait(timeout)
+        if self.error:
+            raise self.error
+        return self.result
+
+    def then(self, callback, errback=None):
+        self.finished.connect(callback)
+        if errback:
+            self.failed.connect(errback)
+        return self
+
+    def execute(self, pool):
+        self.started = True
+        try:
+            with pool.lease() as p4, p4.at_exception_level(self.exceptionLevel):
+                if callable(self.command):
+                    self.result = self.command(p4, *self.args, **self.kargs)
+                else:
+                    self.result = getattr(p4, 'run_' + self.command)(*self.args, **self.kargs)
+        except Exception as e:
+            Utils.p4Logger().debug('%s failed: %s' % (self, e))
+            self.error = e
+
+        # Queue the delivery before waking up anything blocked in wait()
+        self.completed.emit()
+        self.doneEvent.set()
+
+    def deliver(self):
+        # Nothing else may be holding on to us, so stay alive until delivered
+        if self.pending is not None:
+            self.pending.discard(self)
+
+        if self.cancelled:
+            return
+
+        if self.error:
+            self.failed.emit(self.error)
+        else:
+            self.finished.emit(self.result)
+
+
+class CommandExecutor(object):
+    '''
+    Runs P4 commands on worker threads, each with a connection leased
+    from the ConnectionPool, so slow server calls don't block the host.
+
+        future = executor.submit('fstat', '//depot/file.ma')
+        future.then(onResult, onError)
+
+    Commands can also be a callable taking the leased connection as its
+    first argument. Lower priority values are run first, and errors are
+    raised at P4.RAISE_ERRORS unless exceptionLevel is passed.
+    '''
+
+    def __init__(self, p4, maxWorkers=None):
+        self.pool = ConnectionPool.getPool(p4)
+        self.maxWorkers = maxWorkers or self.pool.maxSize
+        self.queue = Queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.workers = []
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, command, *args, **kargs):
+        priority = kargs.pop('priority', 0)
+        exceptionLevel = kargs.pop('exceptionLevel', P4.RAISE_ERRORS)
+        future = CommandFuture(command, args, kargs, priority, exceptionLevel, self.pending)
+        self.pending.add(future)
+
+        self.queue.put((priority, next(self.counter), future))
+        self.startWorker()
+
+        return future
+
+    def startWorker(self):
+        with self.lock:
+            self.workers = [x for x in self.workers if x.is_alive()]
+            if len(self.workers) >= self.maxWorkers:
+                return
+
+            worker = threading.Thread(target=self.work, name='P4Worker%d' % len(self.workers))
+            worker.daemon = True
+            self.workers.append(worker)
+            worker.start()
+
+    def work(self):
+        while True:
+            priority, count, future = self.queue.get()
+            if future is None:
+                break
+            if future.cancelled:
+                # Let the GUI thread release it
+                future.completed.emit()
+                future.doneEvent.set()
+                continue
+            future.execute(self.pool)
+
+    def shutdown(self):
+        with self.lock:
+            for worker in self.workers:
+                self.queue.put((float('inf'), next(self.counter), None))
+            self.workers = []
+
+
+# One executor per main P4 object
+_executors = {}
+
+def getExecutor(p4):
+    executor = _executors.get(id(p4))
+    if executor is None or executor.pool.p4 is not p4:
+        executor = CommandExecutor(p4)
+        _executors[id(p4)] = executor
+    return executor
+
+def shutdownExecutor(p4):
+    executor = _executors.pop(id(p4), None)
+    if executor:
+        executor.shutdown()
@@ -1,52 +1,102 @@
 import os
+import bisect
 
 from P4 import P4, P4Exception
 from qtpy import QtCore, QtGui, QtWidgets
 
 import perforce.Utils as Utils
+from perforce.PerforceUtils import ConnectionPool
+from perforce.PerforceUtils import DepotTrie
+from perforce.PerforceUtils import MetadataCache
 from perforce.AppInterop import interop
+import CommandExecutor
+import IconCache
 
 def epochToTimeStr(time):
     import datetime
     return datetime.datetime.utcfromtimestamp(int(time)).strftime("%d/%m/%Y %H:%M:%S")
 
 class PerforceItem(object):
+    # Tens of thousands of these get created for big folders, so keep them small
+    __slots__ = ('parentItem', 'data', 'childItems', 'rowIndex', 'loaded', 'loading')
 
-    def __init__(self, data, parent=None):
+    # Shown under a folder until its contents have been loaded
+    placeholderData = ('Loading...', '', '', '', '', '')
+
+    # Shared by every file item, only folders get a list of their own
+    noChildren = ()
+
+    def __init__(self, data, parent=None, childItems=None):
         self.parentItem = parent
         self.data = data
-        self.childItems = []
+        self.childItems = [] if childItems is None else childItems
+        self.rowIndex = 0
+        self.loaded = False
+        self.loading = False
 
-    def appendFileItem(self, filepath, filetype, time, action, change):
+    def isPlaceholder(self):
+        return self.data is PerforceItem.placeholderData
+
+    @staticmethod
+    def fileData(filepath, filetype, time, action, change):
         fileName = os.path.basename(filepath)
 
+        # Types, actions and revisions repeat across the whole depot
         # Kludge to pass through the raw path as an extra column that simply isn't used
-        data = (fileName, filetype, time, action, change, filepath)
+        return (fileName, intern(str(filetype)), time, intern(str(action)), intern(str(change)), filepath)
 
-        fileItem = PerforceItem(data, self)
+    def appendFileItem(self, filepath, filetype, time, action, change):
+        fileItem = PerforceItem(self.fileData(filepath, filetype, time, action, change), self, PerforceItem.noChildren)
         self.appendChild(fileItem)
 
+    def insertFileItem(self, row, filepath, filetype, time, action, change):
+        fileItem = PerforceItem(self.fileData(filepath, filetype, time, action, change), self, PerforceItem.noChildren)
+        self.insertChild(row, fileItem)
+
     def appendFolderItem(self, dirpath):
+        self.insertFolderItem(len(self.childItems), dirpath)
+
+    def insertFolderItem(self, row, dirpath):
         dirName = os.path.basename(dirpath)
 
         # Kludge to pass through the raw path as an extra column that simply isn't used
         data = (dirName, 'Folder', '', '', '', dirpath)
 
         fileItem = PerforceItem(data, self)
-        self.appendChild(fileItem)
-        fileItem.appendChild(None)
+        self.insertChild(row, fileItem)
+        fileItem.appendChild(PerforceItem(PerforceItem.placeholderData, fileItem, PerforceItem.noChildren))
 
 
     def appendChild(self, item):
+        item.rowIndex = len(self.childItems)
         self.childItems.append(item)
 
+    def insertChild(self, row, item):
+        self.childItems.insert(row, item)
+        self.renumberChildren(row)
+
+    def removeChildren(self, first, last):
+        del self.childItems[first:last + 1]
+        self.renumberChildren(first)
+
+    def renumberChildren(self, first):
+        for i in range(first, len(self.childItems)):
+            self.childItems[i].rowIndex = i
+
     def popChild(self):
         if self.childItems:
             self.childItems.pop()
 
+    def findFolder(self, name):
+        for item in self.childItems:
+            if item.data[0] == name and item.data[1] == 'Folder':
+                return item
+        return None
+
     def row(self):
+        # Stored when added, and renumbered when rows are inserted or removed
         if self.parentItem:
-            return self.parentItem.childItems.index(self)
+            return self.rowIndex
         return 0
 
     @staticmethod
@@ -62,20 +112,389 @@ class PerforceItem(object):
 
         return list(reversed(result))
 
+deletedActions = ['delete', 'move/delete']
+
+# Left out by the server rather than after they've been sent, when deleted files are hidden
+deletedFilter = ' & '.join('^headAction=%s' % x for x in deletedActions)
+
+# Only the fields the tree shows
+listFields = ','.join(['dir'] + DepotTrie.prefetchFields)
+
+def listDirectory(p4, p4path, root, trie=None, pending=None, limit=None, showDeleted=False):
+    '''
+    Contents of one folder as ('Folder', dirpath) and
+    ('File', filepath, type, time, action, change) entries, with the
+    pending folders in a DepotTrie.PendingIndex added for client paths.
+    With a limit only that many files are fetched from the server, and a
+    ('More', p4path, root) entry is added when there are more to list.
+    Doesn't touch the model so it can run on a worker thread.
+    '''
+    isDepotPath = root.startswith("//depot")
+    isClientPath = not isDepotPath
+    clientRoot = "//{0}".format(p4.client)
+
+    entries = []
+    more = False
+
+    # Served from the prefetched tree when there is one
+    cached = trie.listDirectory(p4path) if trie else None
+
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        if cached is not None:
+            p4fstat = cached
+        else:
+            fstat_args = ['-T', listFields, '-Dl', '/'.join([p4path,'*'])]
+            if not showDeleted:
+                fstat_args[:0] = ['-F', deletedFilter]
+            if limit:
+                fstat_args[:0] = ['-m', str(limit + 1)]
+            p4fstat = p4.run_fstat(*fstat_args)
+
+            # Cut short, so the folders may not have been reached
+            fileRows = [x for x in p4fstat if not x.get('dir')]
+            more = limit and len(fileRows) > limit
+            if more:
+                p4fstat = fileRows + p4.run_dirs('/'.join([p4path,'*']))
+
+        files = []
+        folders = []
+        for f in p4fstat:
+            # p4 fstat returns directory information as well
+            if f.get('dir'):
+                folders.append(f)
+            else:
+                files.append(f)
+
+        for f in folders:
+            # For some reason fstat gives us the depot path, we ~should~ be safe with a simple replace
+            if isClientPath:
+                f['dir'] = f['dir'].replace('//depot', clientRoot)
+
+            Utils.p4Logger().debug('Dir: \t%s' % f['dir'] )
+            entries.append(('Folder', f['dir']))
+
+        for f in files:
+            filepath = f['depotFile'] if isDepotPath else f['clientFile']
+            Utils.p4Logger().debug('File: \t%s' % filepath)
+
+            # Check if this is in a pending changelist,
+            # which gives us different fields to query
+            if f.get('change'):
+                if f['action'] in deletedActions and not showDeleted:
+                    continue
+
+                entries.append(('File', filepath, f['type'], '', f['action'], f['workRev']))
+            else:
+                # Still checked as the prefetched tree keeps deleted files
+                if f['headAction'] in deletedActions and not showDeleted:
+                    continue
+
+                entries.append(('File', filepath, f['headType'], f['headTime'], f['headAction'], f['headRev']))
+
+        # Show pending changelist folders (and files) in client view, fstat only
+        # reports folders that exist in the depot
+        if isClientPath and pending is not None:
+            listed = set(os.path.basename(x[1]) for x in entries if x[0] == 'Folder')
+            for name, dirpath in sorted(pending.foldersIn(p4path).items()):
+                if name not in listed:
+                    Utils.p4Logger().debug('Adding pending path folder %s' % dirpath)
+                    entries.append(('Folder', dirpath.replace('//depot', clientRoot)))
+
+            listed = set(x[1] for x in entries if x[0] == 'File')
+            for f in pending.filesIn(p4path):
+                if f['clientFile'] not in listed and (showDeleted or f['action'] not in deletedActions):
+                    entries.append(('File', f['clientFile'], f['type'], '', f['action'], f.get('workRev', '')))
+
+    if more:
+        entries.append(('More', p4path, root))
+
+    Utils.p4Logger().debug('\n\n')
+    return entries
+
 class PerforceItemModel(QtCore.QAbstractItemModel):
+    # Fetch the whole tree up front when it has fewer files than this (0 to disable)
+    prefetchLimit = int(os.getenv('P4VFX_PREFETCH_LIMIT', 50000))
+
+    # Rows added to a folder at a time, the rest as the view scrolls down to them
+    pageSize = int(os.getenv('P4VFX_PAGE_SIZE', 1000))
+
     def __init__(self, p4, parent=None):
         super(PerforceItemModel, self).__init__(parent)
 
         self.p4 = p4
         self.showDeleted = False
         self.rootItem = None
+        self.trie = None
+        self.revalidation = None
+
+        # Last submitted change the tree is known to include, when it's been asked for
+        self.change = None
+
+        # Opened files by folder, for client views
+        self.pending = None
+
+        # Listings of folders that haven't all been added yet, item: (entries, next entry)
+        self.unfetched = {}
+
+        # Folders with more files on the server than were listed, item: (p4path, root)
+        self.unlisted = {}
+
+        # Roots that had too many files to prefetch, so refreshing doesn't try again
+        self.unprefetchable = set()
+
+        # Trees fetched in earlier sessions, None when disabled
+        self.cache = MetadataCache.getCache()
 
     def populate(self, rootdir):
-        self.rootItem = PerforceItem(None)
         Utils.p4Logger().debug('Populating: %s' % rootdir)
-        self.populateSubDir(idx=None, root=rootdir)
 
-    def populateSubDir(self, idx=None, root="//depot"):
+        self.trie = None
+        self.change = None
+        if self.prefetchLimit and rootdir not in self.unprefetchable:
+            cached = self.cache.load(self.p4, rootdir) if self.cache else None
+            if cached:
+                # Shown straight away, then brought up to date in the background
+                self.trie, self.change = cached
+                self.revalidate(rootdir, self.change)
+            else:
+                self.prefetch(rootdir)
+
+        self.queryPending(rootdir)
+        self.rebuild(rootdir)
+
+    def prefetch(self, rootdir):
+        change = None
+        with ConnectionPool.getPool(self.p4).lease() as p4:
+            if self.cache:
+                change = MetadataCache.latestChange(p4, rootdir)
+            self.trie = DepotTrie.prefetch(p4, rootdir, self.prefetchLimit)
+
+        if self.trie is None:
+            self.unprefetchable.add(rootdir)
+        elif change is not None:
+            self.cache.store(self.p4, rootdir, self.trie, change)
+            self.change = change
+
+    def queryPending(self, rootdir):
+        # Once per populate, rather than looking for pending folders on every expand
+        self.pending = None
+        if rootdir.startswith("//depot"):
+            return
+
+        if self.trie is not None:
+            self.pending = DepotTrie.queryPending(None, rootdir, self.trie)
+        else:
+            with ConnectionPool.getPool(self.p4).lease() as p4:
+                self.pending = DepotTrie.queryPending(p4, rootdir)
+
+    def revalidate(self, rootdir, since):
+        '''
+        Apply whatever changed on the server since the cached tree was stamped,
+        on a worker thread at a lower priority than anything the user asked for
+        '''
+        trie = self.trie
+        openedFiles = self.cache.openedFiles(self.p4, rootdir)
+
+        def onChanges(result):
+            # Populated again since
+            if self.trie is trie:
+                self.applyChanges(rootdir, result)
+
+        def onFailed(e):
+            Utils.p4Logger().warning('Failed to check %s for changes: %s' % (rootdir, e))
+
+        future = CommandExecutor.getExecutor(self.p4).submit(MetadataCache.changesSince, rootdir, since,
+                                                             openedFiles, trie.rootNode.depotPath, priority=10)
+        self.revalidation = future.then(onChanges, onFailed)
+        return self.revalidation
+
+    def applyChanges(self, rootdir, result):
+        '''
+        Update the prefetched tree (and cache) with the result of
+        MetadataCache.changesSince(), then refresh the folders it touched
+        '''
+        if result is None:
+            Utils.p4Logger().info('%s is too far out of date, fetching it again' % rootdir)
+            if self.cache:
+                self.cache.forget(self.p4, rootdir)
+            self.populate(rootdir)
+            return
+
+        self.change, fstats, removed = result
+
+        # Folders get new lists rather than being changed in place, workers may be listing them
+        directories = set()
+        for f in fstats:
+            if self.trie.insert(f, replace=True):
+                rel = self.trie.relativePath(f['depotFile'] if self.trie.isDepotPath else f.get('clientFile', ''))
+                directories.add(os.path.dirname(rel))
+        for path in removed:
+            if self.trie.remove(path):
+                directories.add(os.path.dirname(self.trie.relativeDepotPath(path)))
+
+        if self.cache:
+            self.cache.update(self.p4, rootdir, fstats, removed, self.change)
+
+        # Swapped for a new one, those already listing keep the one they were given
+        if directories and self.pending is not None:
+            self.pending = DepotTrie.queryPending(None, rootdir, self.trie)
+
+        Utils.p4Logger().debug('%s is up to date with change %d, %d folders changed' % (rootdir, self.change, len(directories)))
+        self.refreshDirectories(rootdir, directories)
+
+    def setShowDeleted(self, showDeleted, rootdir):
+        '''
+        Show or hide deleted files, listing the loaded folders again a page at
+        a time rather than collapsing the tree. Only the deleted rows are
+        added or removed, the rest are kept along with the selection.
+        '''
+        if showDeleted == self.showDeleted:
+            return
+
+        self.showDeleted = showDeleted
+        stack = [self.rootItem] if self.rootItem else []
+        while stack:
+            treeItem = stack.pop()
+            if treeItem.loaded:
+                self.reloadChildren(treeItem, rootdir)
+                stack.extend(x for x in treeItem.childItems if x.data[1] == 'Folder')
+
+    def refreshDirectories(self, rootdir, directories):
+        '''
+        List the loaded folders in directories (paths relative to rootdir) again,
+        folders that haven't been expanded are left to load when they are
+        '''
+        stale = set()
+        for rel in directories:
+            treeItem = self.rootItem
+            for name in rel.split('/') if rel else []:
+                child = treeItem.findFolder(name)
+                if child is None:
+                    # A new folder, which only its parent's listing will show
+                    break
+                treeItem = child
+
+            if treeItem.loaded:
+                stale.add(treeItem)
+
+        for treeItem in stale:
+            self.reloadChildren(treeItem, rootdir)
+
+    def reloadChildren(self, treeItem, rootdir):
+        p4path = rootdir if treeItem is self.rootItem else self.directoryPath(self.itemIndex(treeItem), rootdir)
+        rootItem = self.rootItem
+
+        def onEntries(entries):
+            if self.rootItem is rootItem:
+                self.updateChildren(treeItem, entries)
+
+        def onFailed(e):
+            Utils.p4Logger().warning('Failed to refresh %s: %s' % (p4path, e))
+
+        future = CommandExecutor.getExecutor(self.p4).submit(listDirectory, p4path, rootdir, self.trie, self.pending,
+                                                             self.pageSize, self.showDeleted)
+        return future.then(onEntries, onFailed)
+
+    def updateChildren(self, treeItem, entries):
+        '''
+        Bring a loaded folder's rows in line with a new listing. Rows that are
+        still listed are kept, and updated in place when they've changed, so
+        selections and expanded sub folders survive. Files past the end of a
+        listing that was cut short are left until the rest is listed.
+        '''
+        parentIndex = self.itemIndex(treeItem)
+        self.unfetched.pop(treeItem, None)
+        self.unlisted.pop(treeItem, None)
+        if entries and entries[-1][0] == 'More':
+            self.unlisted[treeItem] = entries.pop()[1:]
+        complete = treeItem not in self.unlisted
+
+        folders = [x[1] for x in entries if x[0] == 'Folder']
+        files = [x for x in entries if x[0] != 'Folder']
+        listed = dict((x[1], x) for x in files)
+        lastListed = files[-1][1] if files else None
+
+        keep = set(folders)
+        stale = []
+        for i, item in enumerate(treeItem.childItems):
+            path = item.data[-1]
+            if item.data[1] == 'Folder':
+                if path not in keep:
+                    stale.append(i)
+            elif path in listed:
+                data = PerforceItem.fileData(*listed[path][1:])
+                if data != item.data:
+                    item.data = data
+                    self.dataChanged.emit(self.index(i, 0, parentIndex),
+                                          self.index(i, self.columnCount(parentIndex) - 1, parentIndex))
+            elif complete or path < lastListed:
+                stale.append(i)
+
+        # Remove runs of rows from the end, so the earlier rows don't move
+        while stale:
+            last = stale.pop()
+            first = last
+            while stale and stale[-1] == first - 1:
+                first = stale.pop()
+
+            self.beginRemoveRows(parentIndex, first, last)
+            treeItem.removeChildren(first, last)
+            self.endRemoveRows()
+
+        self.insertFolders(treeItem, folders)
+
+        # New files amongst those shown go in order, the rest are added a page at a time
+        shown = [x.data[-1] for x in treeItem.childItems if x.data[1] != 'Folder']
+        firstFile = len(treeItem.childItems) - len(shown)
+        known = set(shown)
+        remaining = []
+        for entry in files:
+            path = entry[1]
+            if path in known:
+                continue
+
+            row = bisect.bisect(shown, path)
+            if row == len(shown):
+                remaining.append(entry)
+                continue
+
+            self.beginInsertRows(parentIndex, firstFile + row, firstFile + row)
+            treeItem.insertFileItem(firstFile + row, *entry[1:])
+            shown.insert(row, path)
+            self.endInsertRows()
+
+        self.insertEntries(treeItem, remaining)
+
+    def insertFolders(self, treeItem, folders):
+        # In order amongst the folders already there, which come before the files
+        parentIndex = self.itemIndex(treeItem)
+        existing = [x.data[-1] for x in treeItem.childItems if x.data[1] == 'Folder']
+        for dirpath in folders:
+            if dirpath in existing:
+                continue
+
+            row = bisect.bisect(existing, dirpath)
+            self.beginInsertRows(parentIndex, row, row)
+            treeItem.insertFolderItem(row, dirpath)
+            existing.insert(row, dirpath)
+            self.endInsertRows()
+
+    def rebuild(self, rootdir):
+        # Top level of the tree from scratch, anything expanded is collapsed
+        with ConnectionPool.getPool(self.p4).lease() as p4:
+            entries = listDirectory(p4, rootdir, rootdir, self.trie, self.pending, showDeleted=self.showDeleted)
+
+        self.beginResetModel()
+        self.rootItem = PerforceItem(None)
+        self.rootItem.loaded = True
+        self.unfetched = {}
+        self.unlisted = {}
+        if len(entries) > self.pageSize:
+            self.unfetched[self.rootItem] = (entries, self.pageSize)
+        self.appendEntries(self.rootItem, entries[:self.pageSize])
+        self.endResetModel()
+
+    def directoryPath(self, idx, root):
         # Overcomplicated way to figure out if idx is root or not
         # Would be better to check if .parent() exists and if not return the root path
         if idx:
@@ -83,96 +502,156 @@ class PerforceItemModel(QtCore.QAbstractItemModel):
             idxPathSubDirs = [idxPath.data() for idxPath in idxPathModel]
             idxFullPath = '/'.join(idxPathSubDirs)
 
-            p4path = '/'.join([root, idxFullPath])
-            treeItem = idx.internalPointer()
+            return '/'.join([root, idxFullPath])
+        return root
 
-            # Pop empty "None" child
-            treeItem.popChild()
-        else:
-            p4path = root
-            treeItem = self.rootItem
+    def itemIndex(self, treeItem):
+        if treeItem is self.rootItem:
+            return QtCore.QModelIndex()
+        return self.createIndex(treeItem.row(), 0, treeItem)
 
-        isDepotPath = root.startswith("//depot")
-        isClientPath = not isDepotPath
-        clientRoot = "//{0}".format(self.p4.client)
+    def populateSubDir(self, idx=None, root="//depot"):
+        p4path = self.directoryPath(idx, root)
+        treeItem = idx.internalPointer() if idx else self.rootItem
 
-        # dirpath = '/'.join([p4path,'*'])
+        with ConnectionPool.getPool(self.p4).lease() as p4:
+            entries = listDirectory(p4, p4path, root, self.trie, self.pending, self.pageSize, self.showDeleted)
 
-        with self.p4.at_exception_level(P4.RAISE_ERRORS):
-            fstat_args = ['-Olhp', '-Dl', '/'.join([p4path,'*'])]
-            # if not showDeleted:
-            #     fstat_args.insert(1, '-F "^headAction=delete & ^headAction=move/delete"')
-            p4fstat = self.p4.run_fstat(*fstat_args)
-
-            files = []
-            folders = []
-            for f in p4fstat:
-                # p4 fstat returns directory information as well
-                if f.get('dir'):
-                    folders.append(f)
-                else:
-                    files.append(f)
-
-            for f in folders:
-                # For some reason fstat gives us the depot path, we ~should~ be safe with a simple replace
-                if isClientPath:
-                    f['dir'] = f['dir'].replace('//depot', clientRoot)
-
-                Utils.p4Logger().debug('Dir: \t%s' % f['dir'] )
-                treeItem.appendFolderItem(f['dir'])
-            
-            for f in files:
-                filepath = f['depotFile'] if isDepotPath else f['clientFile']
-                Utils.p4Logger().debug('File: \t%s' % filepath)
-
-                # Check if this is in a pending changelist,
-                # which gives us different fields to query
-                if f.get('change'):
-                    if f['action'] in ['delete','move/delete'] and isClientPath:
-                        continue
-
-                    treeItem.appendFileItem( filepath, f['type'], '', f['action'], f['workRev'] )
-                else:
-                    # Only show deleted files in depot view (for the purpose of undeleting them)
-                    if f['headAction'] in ['delete','move/delete'] and isClientPath:
-                        continue
+        self.insertChildren(treeItem, entries)
 
-                    treeItem.appendFileItem( filepath, f['headType'], f['headTime'], f['headAction'], f['headRev'] )
+    def fetchChildren(self, idx, root="//depot"):
+        '''
+        Load a folder's contents on a worker thread, the "Loading..." row
+        is replaced with them when they arrive
+        '''
+        treeItem = idx.internalPointer()
+        if treeItem.loaded or treeItem.loading:
+            return None
 
-            # Show pending changelist folders in client view
-            # (fstat is configured to automatically add the files above if they exist in the current directory,
-            # but if they exist in a subdir they won't be found by default)
-            if isClientPath:
-                # if not showDeleted:
-                #     fstat_args.insert(1, '-F "^headAction=delete & ^headAction=move/delete"')
+        p4path = self.directoryPath(idx, root)
+        rootItem = self.rootItem
+        treeItem.loading = True
+
+        def onEntries(entries):
+            treeItem.loading = False
+            # The tree has been repopulated since, or the folder was listed while revealing a file
+            if self.rootItem is rootItem and not treeItem.loaded:
+                self.insertChildren(treeItem, entries)
 
-                # Query pending changes (just default for now)
-                fstat_pending_args = ['-Or', '-F', 'change=default', '/'.join([p4path,'...'])]
-                p4fstat = self.p4.run_fstat(*fstat_pending_args)
-                if p4fstat:
-                    p4fstat = p4fstat[0]
-                    Utils.p4Logger().debug('fstat(%s): %s' % (fstat_pending_args, p4fstat['clientFile']))
+        def onFailed(e):
+            treeItem.loading = False
+            Utils.p4Logger().warning('Failed to list %s: %s' % (p4path, e))
 
-                    workspaceRoot = os.path.normpath(self.p4.run_info()[0]['clientRoot'].replace('\\', '/'))
-                    p4path = os.path.normpath(p4path).replace(workspaceRoot, '')
-                    p4PendingPath = os.path.normpath(p4fstat['clientFile']).replace(workspaceRoot, '')
+        future = CommandExecutor.getExecutor(self.p4).submit(listDirectory, p4path, root, self.trie,
+                                                             self.pending, self.pageSize, self.showDeleted)
+        return future.then(onEntries, onFailed)
 
-                    pendingPath, pendingFile = os.path.split(p4PendingPath)
-                    pendingPathSplit = pendingPath.split(os.sep)
-                    commonPrefixSplit = os.path.commonprefix([pendingPath, p4path]).split(os.sep)
-                    uncommonDirectories = filter(lambda x: x not in commonPrefixSplit, pendingPathSplit) 
+    def insertChildren(self, treeItem, entries):
+        parentIndex = self.itemIndex(treeItem)
+
+        # Remove the "Loading..." row
+        if treeItem.childItems and treeItem.childItems[0].isPlaceholder():
+            self.beginRemoveRows(parentIndex, 0, 0)
+            treeItem.popChild()
+            self.endRemoveRows()
+
+        treeItem.loaded = True
+        if entries and entries[-1][0] == 'More':
+            self.unlisted[treeItem] = entries.pop()[1:]
+        self.insertEntries(treeItem, entries)
+
+    def insertEntries(self, treeItem, entries):
+        # Only the first page is added, so huge folders show as quickly as small ones
+        if entries:
+            self.unfetched[treeItem] = (entries, 0)
+            self.fetchPage(treeItem)
+
+    def fetchPage(self, treeItem):
+        entries, offset = self.unfetched.pop(treeItem, (None, 0))
+        if not entries:
+            return
+
+        page = entries[offset:offset + self.pageSize]
+        if offset + len(page) < len(entries):
+            self.unfetched[treeItem] = (entries, offset + len(page))
+
+        first = len(treeItem.childItems)
+        self.beginInsertRows(self.itemIndex(treeItem), first, first + len(page) - 1)
+        self.appendEntries(treeItem, page)
+        self.endInsertRows()
+
+    def canFetchMore(self, parent):
+        treeItem = parent.internalPointer() if parent.isValid() else self.rootItem
+        return treeItem in self.unfetched or treeItem in self.unlisted
+
+    def fetchMore(self, parent):
+        treeItem = parent.internalPointer() if parent.isValid() else self.rootItem
+        if treeItem in self.unfetched:
+            self.fetchPage(treeItem)
+        elif treeItem in self.unlisted:
+            self.listRemainder(treeItem)
+
+    def listRemainder(self, treeItem):
+        '''
+        List the whole of a folder that was cut short, once the view has
+        scrolled to the end of what was listed
+        '''
+        p4path, root = self.unlisted.pop(treeItem)
+        rootItem = self.rootItem
+
+        def onEntries(entries):
+            # Keeps the rows already shown, the rest are added a page at a time as before
+            if self.rootItem is rootItem:
+                self.updateChildren(treeItem, entries)
+
+        def onFailed(e):
+            self.unlisted[treeItem] = (p4path, root)
+            Utils.p4Logger().warning('Failed to list %s: %s' % (p4path, e))
+
+        future = CommandExecutor.getExecutor(self.p4).submit(listDirectory, p4path, root, self.trie, self.pending,
+                                                             showDeleted=self.showDeleted)
+        return future.then(onEntries, onFailed)
+
+    def findChild(self, treeItem, name):
+        # Adding the rest of a paged folder until name turns up
+        while True:
+            for item in treeItem.childItems:
+                if item.data[0] == name:
+                    return item
+
+            if treeItem in self.unfetched:
+                self.fetchPage(treeItem)
+            elif treeItem in self.unlisted:
+                p4path, root = self.unlisted.pop(treeItem)
+                with ConnectionPool.getPool(self.p4).lease() as p4:
+                    entries = listDirectory(p4, p4path, root, self.trie, self.pending, showDeleted=self.showDeleted)
+                self.updateChildren(treeItem, entries)
+            else:
+                return None
 
-                    if uncommonDirectories:
-                        currentDir = uncommonDirectories[0]
-                        currentFolders = [ os.path.basename(f['dir']) for f in folders ]
+    def findPath(self, rootdir, relPath):
+        '''
+        Index of the file or folder at relPath (relative to rootdir), listing
+        the folders on the way down to it, or an invalid index if it isn't there
+        '''
+        treeItem = self.rootItem
+        for name in relPath.split('/'):
+            if treeItem is None:
+                break
+            if not treeItem.loaded:
+                self.populateSubDir(self.itemIndex(treeItem), rootdir)
+            treeItem = self.findChild(treeItem, name)
 
-                        Utils.p4Logger().debug( commonPrefixSplit )
-                        Utils.p4Logger().debug( uncommonDirectories )
-                        if not currentDir in currentFolders:
-                            Utils.p4Logger().debug('Adding pending path folder')
-                            treeItem.appendFolderItem( os.path.join(p4path, currentDir) )
+        if treeItem is None or treeItem is self.rootItem:
+            return QtCore.QModelIndex()
+        return self.itemIndex(treeItem)
 
-        Utils.p4Logger().debug('\n\n')
+    def appendEntries(self, treeItem, entries):
+        for entry in entries:
+            if entry[0] == 'Folder':
+                treeItem.appendFolderItem(entry[1])
+            else:
+                treeItem.appendFileItem(*entry[1:])
 
     def p4Filelist(self, path):
         results = []
@@ -224,29 +703,18 @@ class PerforceItemModel(QtCore.QAbstractItemModel):
         elif role == QtCore.Qt.SizeHintRole:
             return QtCore.QSize(20, 20)
         elif role == QtCore.Qt.DecorationRole:
-            if column == 1:
-                itemType = index.internalPointer().data[column]
-                isDeleted = index.internalPointer().data[3] == 'delete'
-
-                if isDeleted:
-                    return QtGui.QIcon(os.path.join(interop.getIconPath(), 'File0104.png'))
-
-                # Try to figure out which icon is most applicable to the item
-                if itemType == "Folder":
-                    return QtGui.QIcon(os.path.join(interop.getIconPath(), 'File0059.png'))
-                elif "binary" in itemType:
-                    return QtGui.QIcon(os.path.join(interop.getIconPath(), 'File0315.png'))
-                elif "text" in itemType:
-                    return QtGui.QIcon(os.path.join(interop.getIconPath(), 'File0027.png'))
-                else:
-                    return QtGui.QIcon(os.path.join(interop.getIconPath(), 'File0106.png'))
+            if index.internalPointer().isPlaceholder():
+                return None
+            elif column == 1:
+                data = index.internalPointer().data
+                return IconCache.fileIcon(data[column], data[3])
             else:
                 return None
 
         return None
 
     def flags(self, index):
-        if not index.isValid():
+        if not index.isValid() or index.internalPointer().isPlaceholder():
             return QtCore.Qt.NoItemFlags
         return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
 
@@ -274,7 +742,7 @@ class PerforceItemModel(QtCore.QAbstractItemModel):
         if not index.isValid():
             return QtCore.QModelIndex()
         parentItem = index.internalPointer().parentItem
-        if parentItem == self.rootItem:
+        if parentItem is self.rootItem:
             return QtCore.QModelIndex()
         return self.createIndex(parentItem.row(), 0, parentItem)
 
@@ -1,11 +1,15 @@
 from qtpy import QtCore, QtGui, QtWidgets
 from perforce.AppInterop import interop
 from perforce import PerforceUtils
+from perforce.PerforceUtils import Session
 
 def displayErrorUI(e):
     error_ui = QtWidgets.QMessageBox()
     error_ui.setWindowFlags(QtCore.Qt.WA_DeleteOnClose)
 
+    # Most commands report failures here, so use it to spot expired tickets
+    Session.noteException(e)
+
     eMsg, type = PerforceUtils.parsePerforceError(e)
 
     if type == "warning":
@@ -5,9 +5,40 @@ from qtpy import QtCore, QtGui, QtWidgets
 
 from perforce import Utils
 from perforce.PerforceUtils import CmdsChangelist
+from perforce.PerforceUtils import Session
+from perforce.PerforceUtils import ConnectionPool
+from perforce.PerforceUtils import PathIndex
+from perforce.PerforceUtils import RevisionCache
 from perforce.AppInterop import interop
 from ErrorMessageWindow import displayErrorUI
 import DepotClientViewModel
+import CommandExecutor
+import ChangeWatcher
+import IconCache
+import RevisionTableModel
+
+# Milliseconds the selection has to stay on a file before its revisions are fetched
+selectionDelay = 150
+
+def queryFileRevisions(p4, fullname, pageSize=RevisionTableModel.pageSize):
+    # Runs on a worker thread, a missing fstat just means the file isn't opened
+    try:
+        fileInfo = p4.run_fstat(fullname)
+    except P4Exception:
+        fileInfo = None
+
+    # The filelog is only run again once the file has a new head
+    stat = fileInfo[0] if fileInfo else {}
+    headRev = stat.get('headRev')
+    cache = RevisionCache.getCache()
+
+    revisions = cache.get(stat['depotFile'], headRev) if headRev else None
+    if revisions is None:
+        revisions = RevisionCache.parseFilelog(p4.run_filelog("-m", str(pageSize), fullname))
+        if headRev:
+            cache.put(stat['depotFile'], headRev, revisions, fullname)
+
+    return revisions, fileInfo
 
 class BaseRevisionTab(QtWidgets.QWidget):
     def __init__(self, p4, parent=None):
@@ -15,25 +46,44 @@ class BaseRevisionTab(QtWidgets.QWidget):
 
         self.p4 = p4
 
-        path = os.path.join(interop.getIconPath(), "p4.png")
-        icon = QtGui.QIcon(path)
+        icon = IconCache.icon("p4.png")
 
         self.setWindowTitle("File Revisions")
         self.setWindowIcon(icon)
         self.setWindowFlags(QtCore.Qt.Window)
 
         self.fileRevisions = []
+        self.revisionRequest = None
+        self.revisionFuture = None
+        self.prefetchFuture = None
+        self.pathIndex = None
+
+        # Restarted by every selection change, so arrowing through the tree only fetches where it stops
+        self.revisionTimer = QtCore.QTimer(self)
+        self.revisionTimer.setSingleShot(True)
+        self.revisionTimer.setInterval(selectionDelay)
+        self.revisionTimer.timeout.connect(self.populateFileRevisions)
 
     def create(self):
         self.create_controls()
         self.create_layout()
         self.create_connections()
 
-    def setRoot(self, root):
+    def setRoot(self, root, showDeleted=False):
         self.root = root
         self.model = DepotClientViewModel.PerforceItemModel(self.p4)
+        self.model.showDeleted = showDeleted
         self.model.populate(self.root)
 
+        # Keep the tree current as changes are submitted
+        self.watcher = ChangeWatcher.ChangeWatcher(self.model, self.root, self)
+        self.watcher.changed.connect(self.onFilesChanged)
+        self.watcher.start()
+
+        # Built behind anything the user is waiting on, the search box is enabled once it's ready
+        future = CommandExecutor.getExecutor(self.p4).submit(PathIndex.buildIndex, self.root, self.model.trie, priority=10)
+        future.then(self.onPathIndex, lambda e: Utils.p4Logger().warning('Failed to index %s: %s' % (self.root, e)))
+
     def create_controls(self):
         '''
         Create the widgets for the dialog
@@ -55,6 +105,17 @@ class BaseRevisionTab(QtWidgets.QWidget):
         # self.model.populate(self.root, showDeleted=False)
         # self.model.populate('//depot', showDeleted=True)
 
+        self.searchBox = QtWidgets.QLineEdit()
+        self.searchBox.setPlaceholderText("Indexing files...")
+        self.searchBox.setEnabled(False)
+        self.searchResults = QtCore.QStringListModel(self)
+        self.searchCompleter = QtWidgets.QCompleter(self.searchResults, self)
+        self.searchCompleter.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+        self.searchBox.setCompleter(self.searchCompleter)
+
+        self.chkboxShowDeleted = QtWidgets.QCheckBox("Show deleted files")
+        self.chkboxShowDeleted.setChecked(self.model.showDeleted)
+
         self.fileTree = QtWidgets.QTreeView()
         self.fileTree.expandAll()
         # self.fileTree.setModel(self.model)
@@ -68,17 +129,23 @@ class BaseRevisionTab(QtWidgets.QWidget):
         # self.fileTree.setRootIndex(self.model.index(self.p4.cwd))
         self.fileTree.setColumnWidth(0, 180)
 
-        headers = ["Revision", "User", "Action",
-                   "Date", "Client", "Description"]
-
-        self.tableWidget = QtWidgets.QTableWidget()
-        self.tableWidget.setColumnCount(len(headers))
-        self.tableWidget.setMaximumHeight(200)
-        self.tableWidget.setMinimumWidth(500)
-        self.tableWidget.setHorizontalHeaderLabels(headers)
-        self.tableWidget.verticalHeader().setVisible(False)
-        self.tableWidget.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
-        self.tableWidget.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.revisionModel = RevisionTableModel.RevisionTableModel(self.p4, self)
+
+        self.revisionTable = QtWidgets.QTableView()
+        self.revisionTable.setModel(self.revisionModel)
+        self.revisionTable.setItemDelegate(RevisionTableModel.RevisionDelegate(self.revisionTable))
+        self.revisionTable.setEditTriggers(QtWidgets.QAbstractItemView.DoubleClicked |
+                                           QtWidgets.QAbstractItemView.EditKeyPressed)
+        self.revisionTable.setWordWrap(False)
+        self.revisionTable.setMaximumHeight(200)
+        self.revisionTable.setMinimumWidth(500)
+        self.revisionTable.verticalHeader().setVisible(False)
+        self.revisionTable.horizontalHeader().setStretchLastSection(True)
+        # Columns are sized to the first rows rather than every revision, Qt4 only looks at the visible ones anyway
+        if hasattr(QtWidgets.QHeaderView, 'setResizeContentsPrecision'):
+            self.revisionTable.horizontalHeader().setResizeContentsPrecision(50)
+        self.revisionTable.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.revisionTable.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
 
         self.statusBar = QtWidgets.QStatusBar()
         # self.statusBar.showMessage("Test")
@@ -100,8 +167,13 @@ class BaseRevisionTab(QtWidgets.QWidget):
         main_layout = QtWidgets.QVBoxLayout()
         main_layout.setContentsMargins(6, 6, 6, 6)
 
+        searchLayout = QtWidgets.QHBoxLayout()
+        searchLayout.addWidget(self.searchBox)
+        searchLayout.addWidget(self.chkboxShowDeleted)
+
+        main_layout.addLayout(searchLayout)
         main_layout.addWidget(self.fileTree)
-        main_layout.addWidget(self.tableWidget)
+        main_layout.addWidget(self.revisionTable)
 
         bottomLayout = QtWidgets.QHBoxLayout()
         bottomLayout.addWidget(self.getRevisionBtn)
@@ -120,8 +192,13 @@ class BaseRevisionTab(QtWidgets.QWidget):
         '''
         Create the signal/slot connections
         '''
-        self.fileTree.clicked.connect(self.populateFileRevisions)
+        self.fileTree.clicked.connect(self.onSelectionChanged)
+        self.fileTree.selectionModel().currentChanged.connect(self.onSelectionChanged)
         self.fileTree.expanded.connect(self.onExpandedFolder)
+        self.searchBox.textEdited.connect(self.onSearchEdited)
+        self.searchBox.returnPressed.connect(self.onSearchReturn)
+        self.searchCompleter.activated[str].connect(self.revealFile)
+        self.chkboxShowDeleted.toggled.connect(self.onShowDeletedToggled)
         self.getLatestBtn.clicked.connect(self.onSyncLatest)
         self.getRevisionBtn.clicked.connect(self.onRevertToSelection)
         self.getPreviewBtn.clicked.connect(self.getPreview)
@@ -136,15 +213,98 @@ class BaseRevisionTab(QtWidgets.QWidget):
 
         Utils.p4Logger().debug('Expanding %s...' % treeItem.data[-1])
 
-        if not index.child(0,0).isValid():
+        # Rows are inserted into the model once they've been fetched
+        if not treeItem.loaded:
             Utils.p4Logger().debug('\tLoading empty directory')
-            self.model.populateSubDir(index, self.root)
+            future = self.model.fetchChildren(index, self.root)
+            if future is not None:
+                future.then(lambda entries: self.prefetchRevisions(treeItem))
+        else:
+            self.prefetchRevisions(treeItem)
 
-        self.fileTree.setModel(self.model)
-        self.model.layoutChanged.emit()
+    def prefetchRevisions(self, treeItem):
+        # The files in a folder are usually looked at one after another, nearest the selection first
+        files = [x for x in treeItem.childItems if not x.isPlaceholder() and x.data[1] != 'Folder']
+        if not files or RevisionCache.prefetchBudget <= 0 or RevisionCache.getCache().maxEntries <= 0:
+            return
+
+        current = self.fileTree.currentIndex()
+        row = current.row() if current.isValid() and current.internalPointer().parentItem is treeItem else 0
+        files.sort(key=lambda x: abs(x.row() - row))
+
+        # Only the latest folder is worth fetching ahead for
+        if self.prefetchFuture is not None:
+            self.prefetchFuture.cancel()
+
+        self.prefetchFuture = CommandExecutor.getExecutor(self.p4).submit(
+            RevisionCache.prefetch, [x.data[-1] for x in files], RevisionTableModel.pageSize, priority=10)
+        self.prefetchFuture.then(lambda count: Utils.p4Logger().debug('Prefetched revisions of %d files in %s' % (count, treeItem.data[-1])),
+                                 lambda e: Utils.p4Logger().warning('Failed to prefetch revisions: %s' % e))
+
+    def onSelectionChanged(self, *args):
+        # Whatever was asked for the previous file is no longer wanted
+        self.cancelRevisionRequest()
+        self.revisionTimer.start()
+
+    def cancelRevisionRequest(self):
+        if self.revisionFuture is not None:
+            self.revisionFuture.cancel()
+        self.revisionFuture = None
+        self.revisionRequest = None
+
+    def onShowDeletedToggled(self, checked):
+        self.model.setShowDeleted(checked, self.root)
+
+    def onPathIndex(self, index):
+        self.pathIndex = index
+        self.searchBox.setPlaceholderText("Find file...")
+        self.searchBox.setEnabled(True)
+
+    def onFilesChanged(self, depotFiles):
+        RevisionCache.getCache().invalidate(depotFiles)
+
+        if self.pathIndex is None:
+            return
+
+        pathIndex = self.pathIndex
+        future = CommandExecutor.getExecutor(self.p4).submit(PathIndex.filesChanged, depotFiles, priority=10)
+        future.then(lambda result: pathIndex.update(*result),
+                    lambda e: Utils.p4Logger().warning('Failed to update the index of %s: %s' % (self.root, e)))
+
+    def onSearchEdited(self, text):
+        if self.pathIndex is None:
+            return
+
+        matches = self.pathIndex.search(text)
+        self.searchResults.setStringList(matches)
+        if matches:
+            self.searchCompleter.complete()
+
+    def onSearchReturn(self):
+        if self.pathIndex is None:
+            return
+
+        matches = self.pathIndex.search(self.searchBox.text())
+        if matches:
+            self.revealFile(matches[0])
+
+    def revealFile(self, relPath):
+        # Expand the tree down to a search result and show its revisions
+        index = self.model.findPath(self.root, relPath)
+        if not index.isValid():
+            self.statusBar.showMessage("{0} isn't in the tree".format(os.path.basename(relPath)))
+            return
+
+        # Picking a completion also presses return
+        if index == self.fileTree.currentIndex():
+            return
+
+        self.fileTree.setCurrentIndex(index)
+        self.fileTree.scrollTo(index)
+        self.populateFileRevisions()
 
     def getPreview(self, *args):
-        index = self.tableWidget.currentRow()
+        index = self.revisionTable.currentIndex().row()
         item = self.fileRevisions[index]
         revision = item['revision']
 
@@ -171,8 +331,7 @@ class BaseRevisionTab(QtWidgets.QWidget):
             displayErrorUI(e)
 
     def clearRevisions(self):
-        self.tableWidget.clearContents()
-        self.tableWidget.setRowCount(0)
+        self.revisionModel.setRevisions(None, [])
 
     def getSelectedTreeItemData(self):
         index = self.fileTree.selectedIndexes()[0]
@@ -182,11 +341,11 @@ class BaseRevisionTab(QtWidgets.QWidget):
         return index.internalPointer().data
 
     def onRevertToSelection(self, *args):
-        index = self.tableWidget.rowCount() - 1
-        item = self.fileRevisions[index]
+        # Newest first, and the older pages may not be loaded yet
+        item = self.fileRevisions[0]
         currentRevision = item['revision']
 
-        index = self.tableWidget.currentRow()
+        index = self.revisionTable.currentIndex().row()
         item = self.fileRevisions[index]
         rollbackRevision = item['revision']
 
@@ -200,7 +359,10 @@ class BaseRevisionTab(QtWidgets.QWidget):
         Utils.p4Logger().debug(filePath)
 
         desc = "Rollback #{0} to #{1}".format(currentRevision, rollbackRevision)
-        if CmdsChangelist.syncPreviousRevision(self.p4, filePath, rollbackRevision, desc):
+        with ConnectionPool.getPool(self.p4).lease() as p4:
+            success = CmdsChangelist.syncPreviousRevision(p4, filePath, rollbackRevision, desc)
+
+        if success:
             QtWidgets.QMessageBox.information(interop.main_parent_window(), "Success", "Successful {0}".format(desc))
 
         self.populateFileRevisions()
@@ -214,45 +376,16 @@ class BaseRevisionTab(QtWidgets.QWidget):
         filePath = data[-1]
 
         try:
-            self.p4.run_sync("-f", filePath)
+            with ConnectionPool.getPool(self.p4).lease() as p4:
+                p4.run_sync("-f", filePath)
             Utils.p4Logger().info("{0} synced to latest version".format(filePath))
             self.populateFileRevisions()
         except P4Exception as e:
             displayErrorUI(e)
 
-    def setRevisionTableColumn(self, row, column, value, icon=None, isLongText=False):
-        value = str(value)
-
-        widget = QtWidgets.QWidget()
-        layout = QtWidgets.QHBoxLayout()
-        layout.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignHCenter)
-
-        # Use a QLineEdit to allow the text to be copied if the data is large
-        if isLongText:
-            textLabel = QtWidgets.QLineEdit()
-            textLabel.setText(value)
-            textLabel.setCursorPosition(0)
-            textLabel.setReadOnly(True)
-            textLabel.setStyleSheet("QLineEdit { border: none }")
-        else:
-            textLabel = QtWidgets.QLabel(value)
-            textLabel.setStyleSheet("QLabel { border: none } ")
-
-        # layout.setContentsMargins(4, 0, 4, 0)
-        
-        if icon:
-            iconPic = QtGui.QPixmap(icon)
-            iconPic = iconPic.scaled(16, 16)
-            iconLabel = QtWidgets.QLabel()
-            iconLabel.setPixmap(iconPic)
-            layout.addWidget(iconLabel)
-        layout.addWidget(textLabel)
-
-        widget.setLayout(layout)
-
-        self.tableWidget.setCellWidget(row, column, widget)
-
     def populateFileRevisions(self, *args):
+        self.revisionTimer.stop()
+        self.cancelRevisionRequest()
         self.statusBar.showMessage("")
 
         try:
@@ -297,102 +430,78 @@ class BaseRevisionTab(QtWidgets.QWidget):
             self.isSceneFile = False
 
 
-        try:
-            with self.p4.at_exception_level(P4.RAISE_ERRORS):
-                files = self.p4.run_filelog("-l", fullname)
-        except P4Exception as e:
-            # TODO - Better error handling here, what if we can't connect etc
-            #eMsg, type = parsePerforceError(e)
-            self.statusBar.showMessage("{0} isn't on client".format(os.path.basename(fullname)))
-            self.clearRevisions()
-            self.getLatestBtn.setEnabled(False)
-            self.getPreviewBtn.setEnabled(False)
+        self.statusBar.showMessage("Loading {0}...".format(os.path.basename(fullname)))
+        self.revisionRequest = fullname
+
+        future = self.revisionFuture = CommandExecutor.getExecutor(self.p4).submit(queryFileRevisions, fullname)
+        future.then(lambda result: self.onFileRevisions(fullname, *result),
+                    lambda e: self.onFileRevisionsFailed(fullname, e))
+
+    def onFileRevisionsFailed(self, fullname, e):
+        # A newer selection has been made since this was requested
+        if fullname != self.revisionRequest:
+            return
+
+        # TODO - Better error handling here, what if we can't connect etc
+        #eMsg, type = parsePerforceError(e)
+        self.statusBar.showMessage("{0} isn't on client".format(os.path.basename(fullname)))
+        self.clearRevisions()
+        self.getLatestBtn.setEnabled(False)
+        self.getPreviewBtn.setEnabled(False)
+
+    def onFileRevisions(self, fullname, revisions, p4FileInfo):
+        if fullname != self.revisionRequest:
             return
 
         self.getLatestBtn.setEnabled(True)
         self.getPreviewBtn.setEnabled(True)
 
-        try:
-            with self.p4.at_exception_level(P4.RAISE_ERRORS):
-                p4FileInfo = self.p4.run_fstat(fullname)
-
-            if p4FileInfo:
-                fileInfo = p4FileInfo[0]
-                
-                if 'otherLock' in fileInfo:
-                    self.statusBar.showMessage("{0} currently locked by {1}".format(os.path.basename(fullname), fileInfo['otherLock'][0]))
-
-                    if fileInfo['otherLock'][0].split('@')[0] != self.p4.user:
-                        self.getRevisionBtn.setEnabled(False)
-                elif 'otherOpen' in fileInfo:
-                    self.statusBar.showMessage("{0} currently opened by {1}".format(os.path.basename(fullname), fileInfo['otherOpen'][0]))
-
-                    if fileInfo['otherOpen'][0].split('@')[0] != self.p4.user:
-                        self.getRevisionBtn.setEnabled(False)
-                else:
-                    self.statusBar.showMessage("{0} currently opened by {1}@{2}".format(os.path.basename(fullname),  self.p4.user, self.p4.client))
-                    self.getRevisionBtn.setEnabled(True)
-
-        except P4Exception:
+        if p4FileInfo is None:
             self.statusBar.showMessage("{0} is not checked out".format(os.path.basename(fullname)))
             self.getRevisionBtn.setEnabled(True)
+        elif p4FileInfo:
+            fileInfo = p4FileInfo[0]
+            
+            if 'otherLock' in fileInfo:
+                self.statusBar.showMessage("{0} currently locked by {1}".format(os.path.basename(fullname), fileInfo['otherLock'][0]))
+
+                if fileInfo['otherLock'][0].split('@')[0] != self.p4.user:
+                    self.getRevisionBtn.setEnabled(False)
+            elif 'otherOpen' in fileInfo:
+                self.statusBar.showMessage("{0} currently opened by {1}".format(os.path.basename(fullname), fileInfo['otherOpen'][0]))
+
+                if fileInfo['otherOpen'][0].split('@')[0] != self.p4.user:
+                    self.getRevisionBtn.setEnabled(False)
+            else:
+                self.statusBar.showMessage("{0} currently opened by {1}@{2}".format(os.path.basename(fullname),  self.p4.user, self.p4.client))
+                self.getRevisionBtn.setEnabled(True)
 
-        # Generate revision dictionary
-        self.fileRevisions = []
+        if revisions:
+            Utils.p4Logger().debug( 'filelog(%s):%s' % (fullname, revisions) )
+
+        stat = p4FileInfo[0] if p4FileInfo else {}
+        self.revisionModel.setRevisions(fullname, revisions, stat.get('depotFile'), stat.get('headRev'))
+
+        # The model's own copy, which grows as older revisions are scrolled to
+        self.fileRevisions = self.revisionModel.revisions
 
-        if files:
-            Utils.p4Logger().debug( 'filelog(%s):%s' % (fullname, files) )
-
-            for revision in files[0].each_revision():
-                self.fileRevisions.append({"revision": revision.rev,
-                                           "action": revision.action,
-                                           "date": revision.time,
-                                           "desc": revision.desc,
-                                           "user": revision.user,
-                                           "client": revision.client
-                                           })
-
-            self.tableWidget.setRowCount(len(self.fileRevisions))
-
-            # Map a file action to the path of it's UI icon
-            actionToIcon = {
-                    'edit':         os.path.join(interop.getIconPath(), "File0440.png"),
-                    'add':          os.path.join(interop.getIconPath(), "File0242.png"),
-                    'delete':       os.path.join(interop.getIconPath(), "File0253.png"),
-                    'move/delete':  os.path.join(interop.getIconPath(), "File0253.png"),
-                    'purge':        os.path.join(interop.getIconPath(), "File0253.png")
-                }
-
-            # Populate table
-            for i, revision in enumerate(self.fileRevisions):
-                columns = [ 
-                        ("#{0}".format(revision['revision']), None, False),
-                        (revision['user'],  None, False),
-                        (revision['action'].capitalize(), actionToIcon.get(revision['action']), False),
-                        (revision['date'], None, False),
-                        (revision['client'], None, False),
-                        (revision['desc'], None, True)
-                    ]
-
-                for j, data in enumerate(columns):
-                    self.setRevisionTableColumn(i, j, *data)
-
-        self.tableWidget.resizeColumnsToContents()
-        self.tableWidget.resizeRowsToContents()
-        self.tableWidget.horizontalHeader().setStretchLastSection(True)
+        # The description column stretches, sizing it would fetch descriptions for rows that aren't shown
+        for column in range(RevisionTableModel.RevisionTableModel.descriptionColumn):
+            self.revisionTable.resizeColumnToContents(column)
 
 class ClientRevisionTab(BaseRevisionTab):
     def __init__(self, p4, parent=None):
         super(ClientRevisionTab, self).__init__(p4, parent)
 
         # self.setRoot( "//{0}".format(self.p4.client) )
-        self.setRoot( self.p4.run_info()[0]['clientRoot'].replace('\\', '/') )
+        self.setRoot( Session.getSession(self.p4).clientRoot() )
 
 class DepotRevisionTab(BaseRevisionTab):
     def __init__(self, p4, parent=None):
         super(DepotRevisionTab, self).__init__(p4, parent)
 
-        self.setRoot( "//depot" )
+        # Deleted files are shown in the depot so they can be undeleted
+        self.setRoot( "//depot", showDeleted=True )
 
 class FileRevisionUI(QtWidgets.QWidget):
     def __init__(self, p4, parent=None):
@@ -400,8 +509,7 @@ class FileRevisionUI(QtWidgets.QWidget):
 
         self.p4 = p4
 
-        path = os.path.join(interop.getIconPath(), "p4.png")
-        icon = QtGui.QIcon(path)
+        icon = IconCache.icon("p4.png")
 
         self.setWindowTitle("File Revisions")
         self.setWindowIcon(icon)
@@ -0,0 +1,62 @@
+import os
+
+from qtpy import QtGui
+
+from perforce.AppInterop import interop
+
+# Icon shown next to a file action, in the revision and changelist tables
+actionIcons = {
+    'edit':         'File0440.png',
+    'add':          'File0242.png',
+    'delete':       'File0253.png',
+    'move/delete':  'File0253.png',
+    'purge':        'File0253.png',
+}
+
+# Decorations for the depot/client tree
+deletedIcon = 'File0104.png'
+folderIcon = 'File0059.png'
+binaryIcon = 'File0315.png'
+textIcon = 'File0027.png'
+otherIcon = 'File0106.png'
+
+# Loaded once per process, Qt shares the pixel data between copies
+_icons = {}
+_pixmaps = {}
+
+def iconPath(name):
+    return os.path.join(interop.getIconPath(), name)
+
+def icon(name):
+    result = _icons.get(name)
+    if result is None:
+        result = _icons[name] = QtGui.QIcon(iconPath(name))
+    return result
+
+def pixmap(name, size=16):
+    key = (name, size)
+    result = _pixmaps.get(key)
+    if result is None:
+        result = _pixmaps[key] = QtGui.QPixmap(iconPath(name)).scaled(size, size)
+    return result
+
+def actionPixmap(action, size=16):
+    name = actionIcons.get(action)
+    return pixmap(name, size) if name else None
+
+def fileIcon(fileType, action):
+    # Try to figure out which icon is most applicable to the item
+    if action == 'delete':
+        return icon(deletedIcon)
+    elif fileType == 'Folder':
+        return icon(folderIcon)
+    elif 'binary' in fileType:
+        return icon(binaryIcon)
+    elif 'text' in fileType:
+        return icon(textIcon)
+    return icon(otherIcon)
+
+def clear():
+    # For when the icon path changes, e.g. switching interop in tests
+    _icons.clear()
+    _pixmaps.clear()
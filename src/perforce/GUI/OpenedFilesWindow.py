@@ -5,6 +5,9 @@ from qtpy import QtCore, QtGui, QtWidgets
 
 import perforce.Utils as Utils
 from perforce.AppInterop import interop
+from ErrorMessageWindow import displayErrorUI
+import CommandExecutor
+import IconCache
 
 class OpenedFilesUI(QtWidgets.QDialog):
 
@@ -45,17 +48,14 @@ class OpenedFilesUI(QtWidgets.QDialog):
 
         self.openSelectedBtn = QtWidgets.QPushButton("Open")
         self.openSelectedBtn.setEnabled(False)
-        self.openSelectedBtn.setIcon(QtGui.QIcon(
-            os.path.join(interop.getIconPath(), "File0228.png")))
+        self.openSelectedBtn.setIcon(IconCache.icon("File0228.png"))
 
         self.revertFileBtn = QtWidgets.QPushButton("Remove from changelist")
         self.revertFileBtn.setEnabled(False)
-        self.revertFileBtn.setIcon(QtGui.QIcon(
-            os.path.join(interop.getIconPath(), "File0308.png")))
+        self.revertFileBtn.setIcon(IconCache.icon("File0308.png"))
 
         self.refreshBtn = QtWidgets.QPushButton("Refresh")
-        self.refreshBtn.setIcon(QtGui.QIcon(
-            os.path.join(interop.getIconPath(), "File0175.png")))
+        self.refreshBtn.setIcon(IconCache.icon("File0175.png"))
 
         self.updateTable()
 
@@ -140,8 +140,21 @@ class OpenedFilesUI(QtWidgets.QDialog):
             displayErrorUI(e)
 
     def updateTable(self):
-        fileList = self.p4.run_opened(
-            "-u", self.p4.user, "-C", self.p4.client, "...")
+        self.refreshBtn.setEnabled(False)
+        self.refreshBtn.setText("Refreshing...")
+
+        future = CommandExecutor.getExecutor(self.p4).submit(
+            "opened", "-u", self.p4.user, "-C", self.p4.client, "...")
+        future.then(self.onOpenedFiles, self.onOpenedFailed)
+
+    def onOpenedFailed(self, e):
+        self.refreshBtn.setEnabled(True)
+        self.refreshBtn.setText("Refresh")
+        displayErrorUI(e)
+
+    def onOpenedFiles(self, fileList):
+        self.refreshBtn.setEnabled(True)
+        self.refreshBtn.setText("Refresh")
 
         self.entries = []
         for file in fileList:
@@ -183,21 +196,12 @@ class OpenedFilesUI(QtWidgets.QDialog):
             # Pending Action
             pendingAction = file['Pending_Action']
 
-            path = ""
-            if(pendingAction == "edit"):
-                path = os.path.join(interop.getIconPath(), "File0440.png")
-            elif(pendingAction == "add"):
-                path = os.path.join(interop.getIconPath(), "File0242.png")
-            elif(pendingAction == "delete"):
-                path = os.path.join(interop.getIconPath(), "File0253.png")
-
             widget = QtWidgets.QWidget()
 
-            icon = QtGui.QPixmap(path)
-            icon = icon.scaled(16, 16)
-
             iconLabel = QtWidgets.QLabel()
-            iconLabel.setPixmap(icon)
+            icon = IconCache.actionPixmap(pendingAction)
+            if icon:
+                iconLabel.setPixmap(icon)
             textLabel = QtWidgets.QLabel(pendingAction.capitalize())
 
             layout = QtWidgets.QHBoxLayout()
@@ -7,12 +7,16 @@ from P4 import P4, P4Exception
 
 from perforce import Utils
 from perforce.PerforceUtils import SetupConnection
+from perforce.PerforceUtils import Session
+from perforce.PerforceUtils import ConnectionPool
+from perforce.PerforceUtils import Instrumentation
 from perforce.AppInterop import interop
 from perforce.PerforceUtils.TestOutputAndProgress import TestOutputAndProgress
 from perforce.GUI.SubmitProgressWindow import SubmitProgressUI
 
 from LoginWindow import firstTimeLogin
 from ErrorMessageWindow import displayErrorUI
+import CommandExecutor
 import OpenedFilesWindow
 import SubmitChangeWindow
 import FileRevisionWindow
@@ -54,31 +58,37 @@ class MainShelf:
 
         Utils.p4Logger().info("Disconnecting from server")
         try:
+            CommandExecutor.shutdownExecutor(self.p4)
+            ConnectionPool.closePool(self.p4)
             self.p4.disconnect()
         except Exception as e:
             print "Error disconnecting P4 daemon : ", e
 
     def validateConnected(self, function, *args):
-        with self.p4.at_exception_level(P4.RAISE_ERRORS):
-            try:
-                result = self.p4.run_login('-s')
-            except P4Exception as e:
-                Utils.p4Logger().info('Connected to server, but no login session. Disconnecting and attempting to login again.')
-                with self.p4.at_exception_level(P4.RAISE_NONE):
-                    self.p4.disconnect()
-            
+        SetupConnection.waitForWarmup(self.p4)
+        session = Session.getSession(self.p4)
+
+        # Only asks the server once the cached ticket is close to expiring
+        if self.p4.connected() and not session.login.check():
+            Utils.p4Logger().info('Connected to server, but no login session. Disconnecting and attempting to login again.')
+            with self.p4.at_exception_level(P4.RAISE_NONE):
+                self.p4.disconnect()
 
         if not self.p4.connected():
             # QtWidgets.QMessageBox.critical(None, 'Perforce Error', "Not connected to Perforce server, please connect first.", QtWidgets.QMessageBox.Warning)
             self.connectToServer(args)
         else:
             # A little heavy handed, but forces the cwd to the client root even if we have a valid login ticket
-            self.p4.cwd = self.p4.run_info()[0]['clientRoot'].replace('\\', '/')
+            self.p4.cwd = session.clientRoot()
 
         if not self.p4.connected():
             QtWidgets.QMessageBox.critical(None, 'Perforce Error', "Can't connect to server, check 'p4 set' for more information about what could be wrong", QtWidgets.QMessageBox.Warning)
         else:
-            function(args)
+            try:
+                function(args)
+            except P4Exception as e:
+                session.login.noteException(e)
+                raise
 
 
     def addMenu(self):
@@ -119,7 +129,8 @@ class MainShelf:
                     {'label': "Create Workspace",           'image': os.path.join(interop.getIconPath(), "File0238.png"),    'command': lambda *args: self.validateConnected(self.createWorkspace, args)},
                     {'label': "Set Current Workspace",      'image': os.path.join(interop.getIconPath(), "File0044.png"),    'command': lambda *args: self.validateConnected(self.setCurrentWorkspace, args)},
                     {'label': "Debug",                      'divider': True},
-                    {'label': "Delete all pending changes", 'image': os.path.join(interop.getIconPath(), "File0280.png"),    'command': lambda *args: self.validateConnected(self.deletePending, args)}
+                    {'label': "Delete all pending changes", 'image': os.path.join(interop.getIconPath(), "File0280.png"),    'command': lambda *args: self.validateConnected(self.deletePending, args)},
+                    {'label': "Diagnostics",                'image': os.path.join(interop.getIconPath(), "File0409.png"),    'command': lambda *args: self.showDiagnostics(args)}
                 ]
             },
             # {'label': "Connect to server",          'image': os.path.join(interop.getIconPath(), "File0077.png"),    'command': self.connectToServer},
@@ -351,25 +362,43 @@ class MainShelf:
         Utils.forceChangelistDelete(self.p4, changes)
 
     def run_checkoutFile(self, *args):
-        for file in args[1:]:
-            Utils.p4Logger().info("Processing {0}...".format(file))
-            result = None
+        files = list(args[1:])
+        if not files:
+            return
+
+        Utils.p4Logger().info("Processing {0}...".format(files))
+
+        # Query every file at once, files missing from the result aren't in the depot yet
+        with self.p4.at_exception_level(P4.RAISE_NONE):
+            result = self.p4.run_fstat(files)
+
+        fileInfo = {}
+        for entry in result:
+            if isinstance(entry, dict) and 'clientFile' in entry:
+                fileInfo[os.path.normcase(os.path.normpath(entry['clientFile']))] = entry
+
+        editFiles = []
+        addFiles = []
+        for file in files:
+            info = fileInfo.get(os.path.normcase(os.path.normpath(file)))
+            if not info:
+                addFiles.append(file)
+            elif 'otherLock' in info:
+                displayErrorUI(P4Exception("[Warning]: {0} already locked by {1}\"".format(file, info['otherLock'][0])))
+            else:
+                editFiles.append(file)
+
+        for command, batch in [(self.p4.run_edit, editFiles), (self.p4.run_add, addFiles)]:
+            if not batch:
+                continue
             try:
-                # @ToDO set this up to use p4.at_exception_level
-                result = self.p4.run_fstat(file)
+                Utils.p4Logger().info(command(batch))
             except P4Exception as e:
-                pass
+                displayErrorUI(e)
 
+        if editFiles or addFiles:
             try:
-                if result:
-                    if 'otherLock' in result[0]:
-                        raise P4Exception("[Warning]: {0} already locked by {1}\"".format(file, result[0]['otherLock'][0]))
-                    else:
-                        Utils.p4Logger().info(self.p4.run_edit(file))
-                        Utils.p4Logger().info(self.p4.run_lock(file))
-                else:
-                    Utils.p4Logger().info(self.p4.run_add(file))
-                    Utils.p4Logger().info(self.p4.run_lock(file))
+                Utils.p4Logger().info(self.p4.run_lock(editFiles + addFiles))
             except P4Exception as e:
                 displayErrorUI(e)
 
@@ -413,13 +442,23 @@ class MainShelf:
 
     def queryServerStatus(self, *args):
         try:
-            result = self.p4.run_info()[0]
+            result = Session.getSession(self.p4).info(refresh=True)
             text = ''.join( ["{0} : {1}\n".format(x, result[x]) for x in result] )
 
             QtWidgets.QMessageBox.information(interop.main_parent_window(), "Server Info", text)
         except P4Exception as e:
             displayErrorUI(e)
 
+    def showDiagnostics(self, *args):
+        recorder = Instrumentation.getRecorder()
+
+        text = recorder.report() or "No Perforce commands have been run yet"
+        if recorder.logPath:
+            text += "\n\nFull command log: {0}".format(recorder.logPath)
+
+        Utils.p4Logger().info("P4 command timings:\n{0}".format(text))
+        QtWidgets.QMessageBox.information(interop.main_parent_window(), "Diagnostics", text)
+
     def fileRevisions(self, *args):
         try:
             self.revisionUi.deleteLater()
@@ -514,15 +553,10 @@ class MainShelf:
 
         # progress.show()
 
-        try:
-            self.p4.run_sync("-f", "...")
-            Utils.p4Logger().info("Got latest revisions for client")
-        except P4Exception as e:
-            displayErrorUI(e)
+        # Runs in the background, warnings such as 'up-to-date' are still reported
+        future = CommandExecutor.getExecutor(self.p4).submit("sync", "-f", "...", exceptionLevel=P4.RAISE_ALL)
+        future.then(lambda result: Utils.p4Logger().info("Got latest revisions for client"), displayErrorUI)
 
     def syncAllChanged(self, *args):
-        try:
-            self.p4.run_sync("...")
-            Utils.p4Logger().info("Got latest revisions for client")
-        except P4Exception as e:
-            displayErrorUI(e)
\ No newline at end of file
+        future = CommandExecutor.getExecutor(self.p4).submit("sync", "...", exceptionLevel=P4.RAISE_ALL)
+        future.then(lambda result: Utils.p4Logger().info("Got latest revisions for client"), displayErrorUI)
\ No newline at end of file
@@ -0,0 +1,243 @@
+import os
+
+from qtpy import QtCore, QtWidgets
+
+import perforce.Utils as Utils
+from perforce.PerforceUtils import RevisionCache
+import CommandExecutor
+import IconCache
+
+# Revisions per 'filelog -m', older ones are fetched as the table is scrolled to them
+pageSize = int(os.getenv('P4VFX_REVISION_PAGE_SIZE', 100))
+
+def queryRevisionPage(p4, fullname, rev, count=pageSize):
+    # The count revisions up to and including #rev
+    return RevisionCache.parseFilelog(p4.run_filelog("-m", str(count), "{0}#{1}".format(fullname, rev)))
+
+def queryDescriptions(p4, fullname, rev, count):
+    revisions = RevisionCache.parseFilelog(p4.run_filelog("-l", "-m", str(count), "{0}#{1}".format(fullname, rev)), True)
+    return dict((x['revision'], x['desc']) for x in revisions)
+
+class RevisionTableModel(QtCore.QAbstractTableModel):
+    '''
+    Revisions of one file, newest first, as parsed by RevisionCache.parseFilelog().
+    Only the newest page is fetched up front, older ones are fetched
+    through canFetchMore()/fetchMore() as the table is scrolled, and full
+    descriptions are fetched for the rows that get painted. Cells are only
+    formatted when the view asks for them.
+    '''
+
+    headers = ["Revision", "User", "Action", "Date", "Client", "Description"]
+    descriptionColumn = 5
+
+    def __init__(self, p4, parent=None):
+        super(RevisionTableModel, self).__init__(parent)
+        self.p4 = p4
+        self.pageSize = pageSize
+
+        self.fullname = None
+        self.revisions = []
+        # (depot path, head revision) the revisions are cached under
+        self.cacheKey = None
+        self.fetching = False
+        # Queries still to come back for the file shown
+        self.requests = []
+
+        # Revision numbers shown with a short description, and those being fetched
+        self.wantedDescriptions = set()
+        self.describing = set()
+
+        # Collects the rows painted in one pass into a single query
+        self.descriptionTimer = QtCore.QTimer(self)
+        self.descriptionTimer.setSingleShot(True)
+        self.descriptionTimer.setInterval(0)
+        self.descriptionTimer.timeout.connect(self.fetchDescriptions)
+
+    def setRevisions(self, fullname, revisions, depotFile=None, headRev=None):
+        # Anything still queued for the previous file isn't sent, the rest is ignored when it arrives
+        for future in self.requests:
+            future.cancel()
+        self.requests = []
+
+        self.beginResetModel()
+        self.fullname = fullname
+        # A copy of its own, what's fetched later is put back in the cache explicitly
+        self.revisions = [dict(x) for x in revisions]
+        self.cacheKey = (depotFile, headRev) if depotFile and headRev else None
+        self.fetching = False
+        self.wantedDescriptions = set()
+        self.describing = set()
+        self.endResetModel()
+
+    def revision(self, row):
+        return self.revisions[row]
+
+    def isComplete(self):
+        # Revisions are numbered down to #1 without gaps
+        return not self.revisions or self.revisions[-1]['revision'] <= 1
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.revisions)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.isComplete()
+
+    def fetchMore(self, parent):
+        if parent.isValid() or self.fetching or self.isComplete():
+            return
+
+        self.fetching = True
+        revisions = self.revisions
+        future = CommandExecutor.getExecutor(self.p4).submit(queryRevisionPage, self.fullname,
+                                                             revisions[-1]['revision'] - 1, self.pageSize)
+        self.track(future)
+        future.then(lambda page: self.onPage(revisions, page),
+                    lambda e: self.onFetchFailed(revisions, e))
+
+    def track(self, future):
+        self.requests = [x for x in self.requests if not x.isDone()]
+        self.requests.append(future)
+
+    def onPage(self, revisions, page):
+        if revisions is not self.revisions:
+            return
+        self.fetching = False
+
+        page = [x for x in page if x['revision'] < revisions[-1]['revision']]
+        if not page:
+            return
+
+        self.beginInsertRows(QtCore.QModelIndex(), len(revisions), len(revisions) + len(page) - 1)
+        revisions.extend(page)
+        self.endInsertRows()
+        self.storeRevisions()
+
+    def onFetchFailed(self, revisions, e):
+        if revisions is self.revisions:
+            self.fetching = False
+        Utils.p4Logger().warning('Failed to fetch revisions of %s: %s' % (self.fullname, e))
+
+    def wantDescription(self, revision):
+        if revision['revision'] in self.describing:
+            return
+        self.wantedDescriptions.add(revision['revision'])
+        if not self.descriptionTimer.isActive():
+            self.descriptionTimer.start()
+
+    def fetchDescriptions(self):
+        if not self.wantedDescriptions:
+            return
+
+        # One filelog -l over the range the painted rows span
+        wanted = self.wantedDescriptions
+        self.wantedDescriptions = set()
+        self.describing.update(wanted)
+
+        revisions = self.revisions
+        future = CommandExecutor.getExecutor(self.p4).submit(queryDescriptions, self.fullname,
+                                                             max(wanted), max(wanted) - min(wanted) + 1)
+        self.track(future)
+        future.then(lambda descriptions: self.onDescriptions(revisions, wanted, descriptions),
+                    lambda e: self.onDescriptionsFailed(revisions, wanted, e))
+
+    def onDescriptions(self, revisions, wanted, descriptions):
+        if revisions is not self.revisions:
+            return
+        self.describing.difference_update(wanted)
+
+        rows = []
+        for row, revision in enumerate(revisions):
+            desc = descriptions.get(revision['revision'])
+            if desc is not None and not revision['fullDesc']:
+                revision['desc'] = desc
+                revision['fullDesc'] = True
+                rows.append(row)
+
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), self.descriptionColumn),
+                                  self.index(max(rows), self.descriptionColumn))
+            self.storeRevisions()
+
+    def storeRevisions(self):
+        # So going back to the file keeps the pages and descriptions, the rows here keep changing
+        if self.cacheKey:
+            revisions = RevisionCache.newestRevisions(self.revisions, RevisionCache.maxEntrySize)
+            RevisionCache.getCache().put(self.cacheKey[0], self.cacheKey[1],
+                                         [dict(x) for x in revisions], self.fullname)
+
+    def onDescriptionsFailed(self, revisions, wanted, e):
+        # So the rows ask again the next time they're painted
+        if revisions is self.revisions:
+            self.describing.difference_update(wanted)
+        Utils.p4Logger().warning('Failed to fetch descriptions of %s: %s' % (self.fullname, e))
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        revision = self.revisions[index.row()]
+        column = index.column()
+
+        if role == QtCore.Qt.DisplayRole:
+            if column == 0:
+                return "#{0}".format(revision['revision'])
+            elif column == 1:
+                return revision['user']
+            elif column == 2:
+                return revision['action'].capitalize()
+            elif column == 3:
+                return str(revision['date'])
+            elif column == 4:
+                return revision['client']
+            else:
+                if not revision['fullDesc']:
+                    self.wantDescription(revision)
+                # One line per row, the whole description is in the tooltip and editor
+                return ' '.join(str(revision['desc']).split())
+        elif role == QtCore.Qt.EditRole and column == self.descriptionColumn:
+            return str(revision['desc'])
+        elif role == QtCore.Qt.ToolTipRole and column == self.descriptionColumn:
+            return str(revision['desc'])
+        elif role == QtCore.Qt.DecorationRole and column == 2:
+            return IconCache.actionPixmap(revision['action'])
+
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if index.column() == self.descriptionColumn:
+            # Only so the delegate can open a read only editor to copy from
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.headers[section]
+        return None
+
+
+class RevisionDelegate(QtWidgets.QStyledItemDelegate):
+    '''
+    Paints the cells rather than putting a widget in each one, the long
+    descriptions open in a read only QLineEdit so they can be copied
+    '''
+
+    def createEditor(self, parent, option, index):
+        editor = QtWidgets.QLineEdit(parent)
+        editor.setReadOnly(True)
+        editor.setFrame(False)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setText(index.data(QtCore.Qt.EditRole))
+        editor.setCursorPosition(0)
+        editor.selectAll()
+
+    def setModelData(self, editor, model, index):
+        pass
@@ -5,9 +5,12 @@ from qtpy import QtCore, QtGui, QtWidgets
 
 from perforce import Utils
 from perforce.PerforceUtils import CmdsChangelist
+from perforce.PerforceUtils import ConnectionPool
 from perforce.AppInterop import interop
 from perforce.PerforceUtils.TestOutputAndProgress import TestOutputAndProgress
 from SubmitProgressWindow import SubmitProgressUI
+import IconCache
+from ErrorMessageWindow import displayErrorUI
 
 class SubmitChangeUi(QtWidgets.QDialog):
 
@@ -17,8 +20,7 @@ class SubmitChangeUi(QtWidgets.QDialog):
     def create(self, p4, files=[]):
         self.p4 = p4
 
-        path = interop.getIconPath() + "p4.png"
-        icon = QtGui.QIcon(path)
+        icon = IconCache.icon("p4.png")
 
         self.setWindowTitle("Submit Change")
         self.setWindowIcon(icon)
@@ -84,21 +86,12 @@ class SubmitChangeUi(QtWidgets.QDialog):
             # Pending Action
             pendingAction = file['Pending_Action']
 
-            path = ""
-            if(pendingAction == "edit"):
-                path = os.path.join(interop.getIconPath(), "File0440.png")
-            elif(pendingAction == "add"):
-                path = os.path.join(interop.getIconPath(), "File0242.png")
-            elif(pendingAction == "delete"):
-                path = os.path.join(interop.getIconPath(), "File0253.png")
-
             widget = QtWidgets.QWidget()
 
-            icon = QtGui.QPixmap(path)
-            icon = icon.scaled(16, 16)
-
             iconLabel = QtWidgets.QLabel()
-            iconLabel.setPixmap(icon)
+            icon = IconCache.actionPixmap(pendingAction)
+            if icon:
+                iconLabel.setPixmap(icon)
             textLabel = QtWidgets.QLabel(pendingAction.capitalize())
 
             layout = QtWidgets.QHBoxLayout()
@@ -186,32 +179,33 @@ class SubmitChangeUi(QtWidgets.QDialog):
         #             print e
 
 
+        # Submit on a pooled connection, the progress/handler callbacks are
+        # cleared when it's returned to the pool
+        pool = ConnectionPool.getPool(self.p4)
+        p4 = pool.checkout()
+
         try:
-            CmdsChangelist.submitChange(self.p4, files, str(
+            CmdsChangelist.submitChange(p4, files, str(
                 self.descriptionWidget.toPlainText()), callback, keepCheckedOut)
             if not keepCheckedOut:
                 clientFiles = []
-                for file in files:
-                    try:
-                        path = self.p4.run_fstat(file)[0]
-                        clientFiles.append(path['clientFile'])
-                    except P4Exception as e:
-                        displayErrorUI(e)
+                try:
+                    with p4.at_exception_level(P4.RAISE_ERRORS):
+                        clientFiles = [x['clientFile'] for x in p4.run_fstat(files) if 'clientFile' in x]
+                except P4Exception as e:
+                    displayErrorUI(e)
 
                 # Bug with windows, doesn't make files writable on submit for
                 # some reason
                 Utils.removeReadOnlyBit(clientFiles)
             self.close()
         except P4Exception as e:
-            self.p4.progress = None
-            self.p4.handler = None
             displayErrorUI(e)
+        finally:
+            pool.checkin(p4)
 
         progress.close()
 
-        self.p4.progress = None
-        self.p4.handler = None
-
     def validateText(self):
         text = self.descriptionWidget.toPlainText()
         p = QtGui.QPalette()
@@ -3,6 +3,7 @@ import re
 from P4 import P4, P4Exception
 from perforce.Utils import p4Logger
 from perforce.PerforceUtils import SetupConnection
+from perforce.PerforceUtils import RevisionCache
 from perforce.GUI.ErrorMessageWindow import displayErrorUI
 
 def queryChangelists( p4, status = None):
@@ -20,26 +21,26 @@ def queryChangelists( p4, status = None):
 def submitChange(p4, files, description, callback, keepCheckedOut = False):
     # Shitty method #1
     p4Logger().info("Files Passed for submission = {0}".format(files))
-    
-    print "Opened ", p4.run_opened("...")
 
     fullChangelist = p4.run_opened("-u", p4.user, "-C", p4.client, "...")
-    
+
     if not fullChangelist:
         raise P4Exception("File changelist is empty")
 
     fileList = []
-    opened = [ p4.run_opened("-u", p4.user, "-C", p4.client, file)[0] for file in files ]
-   
+
+    # One query for all the files, rather than a round trip each
+    opened = p4.run_opened("-u", p4.user, "-C", p4.client, files) if files else []
+
     changeFiles = [ entry['clientFile'] for entry in opened ]# change._files
 
     p4Logger().info("Changelist = {0}".format(changeFiles))
 
-    for changeFile in changeFiles:
-        if changeFile in files:
-            fileList.append(changeFile)
+    for entry in opened:
+        if entry['clientFile'] in files:
+            fileList.append(entry['clientFile'])
         else:
-            p4Logger().warning("File {0} ({1}) not in changelist".format(changeFile, p4.run_opened(changeFile)[0]['action']))
+            p4Logger().warning("File {0} ({1}) not in changelist".format(entry['clientFile'], entry['action']))
             
     p4Logger().info("Final changelist files = {0}".format(fileList)) 
 
@@ -67,6 +68,9 @@ def submitChange(p4, files, description, callback, keepCheckedOut = False):
     p4.progress = None
     p4.handler = None
 
+    # New heads, the old filelogs won't be looked up again
+    RevisionCache.getCache().invalidate([ entry['depotFile'] for entry in opened if entry['clientFile'] in fileList ])
+
     # change = p4.fetch_change()
 
     # change._description = description    
@@ -131,6 +135,8 @@ def syncPreviousRevision(p4, file, revision, description):
         except P4Exception as e:
             errors.append(e)
         
+        RevisionCache.getCache().invalidate([file])
+
         if errors:
             raise tuple(errors)
     except P4Exception as e:
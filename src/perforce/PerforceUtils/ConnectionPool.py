@@ -0,0 +1,128 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from P4 import P4, P4Exception
+
+from perforce.Utils import p4Logger
+from perforce.PerforceUtils import Session
+
+class ConnectionPool(object):
+    '''
+    A capped set of extra connections configured like the main P4 object
+    (same port/user/client/ticket), so long running work doesn't have to
+    share the connection the GUI is using.
+    '''
+
+    defaultMaxSize = 4
+
+    # Settings copied across from the main connection
+    settings = ['port', 'user', 'client', 'password', 'ticket_file', 'charset', 'prog', 'exception_level']
+
+    def __init__(self, p4, maxSize=None):
+        self.p4 = p4
+        self.maxSize = maxSize or self.defaultMaxSize
+        self.idle = []
+        self.total = 0
+        self.condition = threading.Condition()
+
+    def connectionKey(self, p4):
+        return (p4.port, p4.user, p4.client)
+
+    def createConnection(self):
+        conn = self.p4.__class__()
+        for attr in self.settings:
+            value = getattr(self.p4, attr, None)
+            if value is not None:
+                setattr(conn, attr, value)
+
+        p4Logger().debug('Opening pooled connection to %s' % conn.port)
+        conn.connect()
+        return conn
+
+    def discard(self, conn):
+        with conn.at_exception_level(P4.RAISE_NONE):
+            if conn.connected():
+                conn.disconnect()
+        Session.releaseSession(conn)
+
+    def checkout(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        key = self.connectionKey(self.p4)
+
+        with self.condition:
+            while True:
+                while self.idle:
+                    conn = self.idle.pop()
+                    if conn.connected() and self.connectionKey(conn) == key:
+                        conn.cwd = self.p4.cwd
+                        return conn
+                    self.total -= 1
+                    self.discard(conn)
+
+                if self.total < self.maxSize:
+                    self.total += 1
+                    break
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise P4Exception('Timed out waiting for a free Perforce connection')
+                self.condition.wait(remaining)
+
+        try:
+            conn = self.createConnection()
+        except Exception:
+            with self.condition:
+                self.total -= 1
+                self.condition.notify()
+            raise
+
+        conn.cwd = self.p4.cwd
+        return conn
+
+    def checkin(self, conn):
+        with self.condition:
+            conn.progress = None
+            conn.handler = None
+            # at_exception_level() isn't restored when a command raises inside it
+            conn.exception_level = self.p4.exception_level
+            conn.cwd = self.p4.cwd
+
+            if conn.connected() and self.connectionKey(conn) == self.connectionKey(self.p4):
+                self.idle.append(conn)
+            else:
+                self.total -= 1
+                self.discard(conn)
+            self.condition.notify()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        conn = self.checkout(timeout)
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def close(self):
+        with self.condition:
+            for conn in self.idle:
+                self.discard(conn)
+            self.total -= len(self.idle)
+            self.idle = []
+            self.condition.notify_all()
+
+
+# One pool per main P4 object
+_pools = {}
+
+def getPool(p4):
+    pool = _pools.get(id(p4))
+    if pool is None or pool.p4 is not p4:
+        pool = ConnectionPool(p4)
+        _pools[id(p4)] = pool
+    return pool
+
+def closePool(p4):
+    pool = _pools.pop(id(p4), None)
+    if pool:
+        pool.close()
@@ -0,0 +1,288 @@
+import bisect
+
+from P4 import P4, P4Exception, OutputHandler
+
+from perforce.Utils import p4Logger
+
+# Only what PerforceItemModel shows, the rest of fstat's output isn't transferred
+prefetchFields = ['depotFile', 'clientFile', 'headType', 'headTime', 'headAction', 'headRev',
+                  'type', 'action', 'workRev', 'change']
+
+# Stored per file, the paths are rebuilt from the node the file is in
+entryFields = prefetchFields[2:]
+
+class TrieNode(object):
+    __slots__ = ('children', 'files', 'path', 'depotPath')
+
+    def __init__(self, path, depotPath=None):
+        self.children = {}
+        self.files = []
+        self.path = path
+        self.depotPath = depotPath
+
+
+class DepotTrie(object):
+    '''
+    Every file under root from a single 'fstat root/...', indexed by path
+    relative to root so folder listings don't need a server round trip.
+    Files are kept as a name plus a tuple of entryFields values.
+    Once built, insert(replace=True) and remove() give a folder new
+    children and files rather than changing them in place, so it can still
+    be listed on worker threads while changes are applied.
+    '''
+
+    def __init__(self, root):
+        self.root = root.replace('\\', '/').rstrip('/')
+        self.isDepotPath = self.root.startswith('//')
+        self.rootNode = TrieNode(self.root)
+        self.fileCount = 0
+
+    def relativePath(self, path):
+        path = path.replace('\\', '/')
+        if path == self.root:
+            return ''
+        if path.startswith(self.root + '/'):
+            return path[len(self.root) + 1:]
+        return None
+
+    def covers(self, path):
+        return self.relativePath(path) is not None
+
+    def insert(self, fstat, replace=False):
+        # Files are placed by the same kind of path as the root (depot or local)
+        rel = self.relativePath(fstat['depotFile'] if self.isDepotPath else fstat.get('clientFile', ''))
+        if not rel:
+            return False
+
+        parts = rel.split('/')
+        depotDir = fstat['depotFile'].rsplit('/', 1)[0]
+
+        # Depot folders for the parts of the path, assuming the view maps them 1:1
+        depotParts = depotDir.split('/')
+        depotParts = depotParts[:len(depotParts) - len(parts) + 1]
+
+        node = self.rootNode
+        if node.depotPath is None:
+            node.depotPath = '/'.join(depotParts)
+
+        for name in parts[:-1]:
+            depotParts.append(name)
+            child = node.children.get(name)
+            if child is None:
+                child = TrieNode(node.path + '/' + name, '/'.join(depotParts))
+                children = dict(node.children) if replace else node.children
+                children[intern(name)] = child
+                node.children = children
+            node = child
+
+        # Types, actions etc. repeat endlessly, so share the strings
+        values = tuple(intern(str(fstat[x])) if x in fstat else None for x in entryFields)
+
+        # Updating the odd changed file, returns False when nothing changed
+        if replace:
+            files = list(node.files)
+            for i, (name, existing) in enumerate(files):
+                if name == parts[-1]:
+                    if existing == values:
+                        return False
+                    files[i] = (name, values)
+                    node.files = files
+                    return True
+
+            bisect.insort(files, (intern(parts[-1]), values))
+            node.files = files
+            self.fileCount += 1
+            return True
+
+        node.files.append((parts[-1], values))
+        self.fileCount += 1
+        return True
+
+    def relativeDepotPath(self, depotFile):
+        # Assumes the view maps the root 1:1, as insert() does
+        if self.rootNode.depotPath is None or not depotFile.startswith(self.rootNode.depotPath + '/'):
+            return None
+        return depotFile[len(self.rootNode.depotPath) + 1:]
+
+    def remove(self, depotFile):
+        # Looked up by depot path, which is all a deleted or unmapped file still has
+        rel = self.relativeDepotPath(depotFile)
+        if rel is None:
+            return False
+
+        parts = rel.split('/')
+        node = self.rootNode
+        for name in parts[:-1]:
+            node = node.children.get(name)
+            if node is None:
+                return False
+
+        for i, (name, _) in enumerate(node.files):
+            if name == parts[-1]:
+                node.files = node.files[:i] + node.files[i + 1:]
+                self.fileCount -= 1
+                return True
+        return False
+
+    def findNode(self, path):
+        rel = self.relativePath(path)
+        if rel is None:
+            return None
+
+        node = self.rootNode
+        for name in rel.split('/') if rel else []:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def asFstat(self, node, entry):
+        name, values = entry
+        result = dict((k, v) for k, v in zip(entryFields, values) if v is not None)
+        result['depotFile'] = '/'.join([node.depotPath, name])
+        if not self.isDepotPath:
+            result['clientFile'] = '/'.join([node.path, name])
+        return result
+
+    def listDirectory(self, path):
+        '''
+        Same entries as 'fstat -Dl path/*', {'dir': ...} for sub folders
+        followed by the files, or None when path isn't in the trie
+        '''
+        node = self.findNode(path)
+        if node is None:
+            return None
+
+        # Each read once, they may be swapped for updated ones meanwhile
+        children = node.children
+        files = node.files
+
+        result = [{'dir': children[name].depotPath} for name in sorted(children)]
+        result += [self.asFstat(node, x) for x in files]
+        return result
+
+    def walk(self):
+        # Every file as an fstat dict, in depot order
+        stack = [self.rootNode]
+        while stack:
+            node = stack.pop()
+            for entry in node.files:
+                yield self.asFstat(node, entry)
+            stack.extend(node.children[name] for name in sorted(node.children, reverse=True))
+
+    def openedFiles(self):
+        # Only builds dicts for the files that have a pending action
+        action = entryFields.index('action')
+        stack = [self.rootNode]
+        while stack:
+            node = stack.pop()
+            for entry in node.files:
+                if entry[1][action] is not None:
+                    yield self.asFstat(node, entry)
+            stack.extend(node.children.values())
+
+
+class PendingIndex(object):
+    '''
+    Opened files under a client root indexed by folder (relative to the root),
+    along with the folders they're in, which a folder listing won't show
+    while they only exist in a pending change
+    '''
+
+    def __init__(self, root, fstats=[]):
+        self.root = root.replace('\\', '/').rstrip('/')
+        self.files = {}
+        self.folders = {}
+
+        for f in fstats:
+            self.add(f)
+
+    def relativePath(self, path):
+        path = path.replace('\\', '/')
+        if path == self.root:
+            return ''
+        if path.startswith(self.root + '/'):
+            return path[len(self.root) + 1:]
+        return None
+
+    def add(self, fstat):
+        rel = self.relativePath(fstat.get('clientFile', ''))
+        if not rel:
+            return
+
+        parts = rel.split('/')
+        depotParts = fstat['depotFile'].split('/')
+        depotParts = depotParts[:len(depotParts) - len(parts)]
+
+        # Every folder on the way down, by its depot path like fstat's 'dir'
+        for i, name in enumerate(parts[:-1]):
+            depotParts.append(name)
+            self.folders.setdefault('/'.join(parts[:i]), {})[name] = '/'.join(depotParts)
+
+        self.files.setdefault('/'.join(parts[:-1]), []).append(fstat)
+
+    def foldersIn(self, path):
+        # {name: depot path} of folders under path holding opened files
+        return self.folders.get(self.relativePath(path), {})
+
+    def filesIn(self, path):
+        return self.files.get(self.relativePath(path), [])
+
+
+def queryPending(p4, root, trie=None):
+    '''
+    PendingIndex of root, from the prefetched tree when there is one,
+    otherwise with a single query for the files opened under it
+    '''
+    if trie is not None:
+        return PendingIndex(root, trie.openedFiles())
+
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        fstats = p4.run_fstat('-Ro', '-T', ','.join(prefetchFields), '/'.join([root.rstrip('/'), '...']))
+    return PendingIndex(root, [x for x in fstats if 'depotFile' in x])
+
+
+class TrieBuilder(OutputHandler):
+    '''
+    Inserts fstat output into the trie as it arrives rather than keeping a
+    list of dicts, and cancels the command once limit files have been seen
+    '''
+
+    def __init__(self, trie, limit):
+        OutputHandler.__init__(self)
+        self.trie = trie
+        self.limit = limit
+        self.exceeded = False
+
+    def outputStat(self, stat):
+        if self.trie.fileCount >= self.limit:
+            self.exceeded = True
+            return OutputHandler.HANDLED | OutputHandler.CANCEL
+
+        if 'depotFile' in stat:
+            self.trie.insert(stat)
+        return OutputHandler.HANDLED
+
+
+def prefetch(p4, root, limit):
+    '''
+    Build a DepotTrie of root with one fstat, or return None when root holds
+    more than limit files (or can't be queried), so callers fall back to
+    listing a folder at a time
+    '''
+    trie = DepotTrie(root)
+    builder = TrieBuilder(trie, limit)
+
+    try:
+        with p4.at_exception_level(P4.RAISE_ERRORS), p4.using_handler(builder):
+            p4.run_fstat('-m', str(limit + 1), '-T', ','.join(prefetchFields), '/'.join([trie.root, '...']))
+    except P4Exception as e:
+        p4Logger().info('Prefetching %s failed, listing folders individually: %s' % (root, e))
+        return None
+
+    if builder.exceeded:
+        p4Logger().info('%s has more than %d files, listing folders individually' % (root, limit))
+        return None
+
+    p4Logger().debug('Prefetched %d files under %s' % (trie.fileCount, root))
+    return trie
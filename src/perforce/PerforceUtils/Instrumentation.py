@@ -0,0 +1,269 @@
+import time
+import json
+import threading
+import logging
+import logging.handlers
+
+from P4 import P4, P4Exception
+
+from perforce.Utils import p4Logger
+
+def flattenArgs(args):
+    result = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            result.extend(flattenArgs(arg))
+        else:
+            result.append(arg)
+    return result
+
+def commandShape(args):
+    '''
+    Group commands by name and flags, file arguments are only counted
+    e.g. ('fstat', '-Olhp', '-Dl', '//depot/a/*') -> 'fstat -Olhp -Dl [1]'
+    '''
+    args = [str(x) for x in flattenArgs(args)]
+    if not args:
+        return ''
+
+    flags = [x for x in args[1:] if x.startswith('-')]
+    others = len(args) - 1 - len(flags)
+
+    if others:
+        flags.append('[%d]' % others)
+
+    return ' '.join([args[0]] + flags)
+
+def payloadSize(result):
+    # Rough number of bytes of output, good enough to compare commands
+    if result is None:
+        return 0
+    if isinstance(result, basestring):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(len(str(k)) + payloadSize(v) for k, v in result.items())
+    if isinstance(result, (list, tuple)):
+        return sum(payloadSize(x) for x in result)
+    return len(str(result))
+
+
+class CommandStats(object):
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.errors = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * len(CommandRecorder.buckets)
+
+    def add(self, elapsed, rows, size, failed):
+        self.count += 1
+        self.errors += int(failed)
+        self.totalTime += elapsed
+        self.maxTime = max(self.maxTime, elapsed)
+        self.rows += rows
+        self.bytes += size
+
+        for i, limit in enumerate(CommandRecorder.buckets):
+            if elapsed <= limit:
+                self.buckets[i] += 1
+                break
+
+    def asDict(self):
+        return {
+            'shape': self.shape,
+            'count': self.count,
+            'errors': self.errors,
+            'totalTime': self.totalTime,
+            'averageTime': self.totalTime / self.count if self.count else 0.0,
+            'maxTime': self.maxTime,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'buckets': list(self.buckets),
+        }
+
+
+class CommandRecorder(object):
+    '''
+    Collects call count, wall time, result rows and payload size for every
+    P4 command, grouped by commandShape(). Optionally writes every call to a
+    rotating JSON-lines file.
+    '''
+
+    # Upper bounds (in seconds) of the latency histogram buckets
+    buckets = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf')]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.logPath = None
+        self.logger = None
+        self.listeners = []
+
+    def enableLog(self, path, maxBytes=5 * 1024 * 1024, backupCount=3):
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backupCount)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+
+        self.disableLog()
+        self.logger = logging.getLogger('Perforce.Commands')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(handler)
+        self.logPath = path
+
+        p4Logger().info('Logging P4 command timings to %s' % path)
+
+    def disableLog(self):
+        if self.logger:
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+        self.logger = None
+        self.logPath = None
+
+    def addListener(self, callback):
+        self.listeners.append(callback)
+
+    def removeListener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def record(self, args, elapsed, result, error=None):
+        shape = commandShape(args)
+        rows = len(result) if isinstance(result, (list, tuple)) else 0
+        size = payloadSize(result)
+
+        with self.lock:
+            stats = self.stats.get(shape)
+            if stats is None:
+                stats = self.stats[shape] = CommandStats(shape)
+            stats.add(elapsed, rows, size, error is not None)
+
+        if self.logger:
+            self.logger.info(json.dumps({
+                'time': time.time(),
+                'thread': threading.current_thread().name,
+                'shape': shape,
+                'elapsed': elapsed,
+                'rows': rows,
+                'bytes': size,
+                'error': str(error) if error is not None else None,
+            }))
+
+        for listener in list(self.listeners):
+            listener(args, elapsed, result, error)
+
+    def histogram(self, command=None):
+        with self.lock:
+            return dict((shape, list(stats.buckets)) for shape, stats in self.stats.items()
+                        if command is None or shape.split(' ')[0] == command)
+
+    def summary(self):
+        with self.lock:
+            results = [stats.asDict() for stats in self.stats.values()]
+        return sorted(results, key=lambda x: x['totalTime'], reverse=True)
+
+    def report(self, limit=20):
+        lines = []
+        for entry in self.summary()[:limit]:
+            lines.append('{shape}: {count} calls, {totalTime:.2f}s total, {averageTime:.3f}s avg, '
+                         '{maxTime:.3f}s max, {rows} rows, {kb:.1f}KB'.format(kb=entry['bytes'] / 1024.0, **entry))
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+
+_recorder = CommandRecorder()
+
+def getRecorder():
+    return _recorder
+
+
+class CommandBudgetExceeded(AssertionError):
+    pass
+
+class CommandCounter(object):
+    '''
+    Counts the commands issued while it's active, on any connection.
+
+        with CommandCounter('Expand folder', budget=2) as counter:
+            model.populateSubDir(index, root)
+
+    Leaving the block raises CommandBudgetExceeded when more than budget
+    commands were run, or more than commandBudgets[command] of one command.
+    '''
+
+    def __init__(self, action='', budget=None, commandBudgets=None):
+        self.action = action
+        self.budget = budget
+        self.commandBudgets = commandBudgets or {}
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def __call__(self, args, elapsed, result, error=None):
+        with self.lock:
+            self.calls.append(commandShape(args))
+
+    def __enter__(self):
+        self.calls = []
+        _recorder.addListener(self)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        _recorder.removeListener(self)
+        if excType is None:
+            self.check()
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    def commands(self):
+        result = {}
+        for shape in self.calls:
+            command = shape.split(' ')[0]
+            result[command] = result.get(command, 0) + 1
+        return result
+
+    def check(self):
+        commands = self.commands()
+        failures = []
+
+        if self.budget is not None and self.count > self.budget:
+            failures.append('%d commands, budget is %d' % (self.count, self.budget))
+
+        for command, budget in sorted(self.commandBudgets.items()):
+            if commands.get(command, 0) > budget:
+                failures.append('%d %s, budget is %d' % (commands[command], command, budget))
+
+        if failures:
+            raise CommandBudgetExceeded('%s: %s\n\t%s' % (self.action, ', '.join(failures), '\n\t'.join(self.calls)))
+
+
+class InstrumentedP4(P4):
+    '''
+    P4 that reports every command to the CommandRecorder.
+    Everything (run_*, fetch_*, save_* etc.) goes through run() so this is
+    the only method that needs wrapping.
+    '''
+
+    def run(self, *args, **kargs):
+        start = time.time()
+        result = None
+        error = None
+
+        try:
+            result = super(InstrumentedP4, self).run(*args, **kargs)
+            return result
+        except P4Exception as e:
+            error = e
+            raise
+        finally:
+            try:
+                _recorder.record(args, time.time() - start, result, error)
+            except Exception as e:
+                p4Logger().debug('Failed to record command timing: %s' % e)
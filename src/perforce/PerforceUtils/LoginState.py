@@ -0,0 +1,81 @@
+import time
+
+from P4 import P4, P4Exception
+
+from perforce.Utils import p4Logger
+
+# Server messages that mean the ticket is no longer usable
+authErrors = [
+    'P4PASSWD',
+    'session has expired',
+    'session was logged out',
+    'Password invalid',
+    'Perforce password',
+]
+
+def isAuthError(e):
+    msg = str(e)
+    return any(x in msg for x in authErrors)
+
+class LoginTracker(object):
+    '''
+    Keeps the ticket expiry from 'p4 login -s' in memory so we only
+    go back to the server when the ticket is about to run out, or after
+    a command has failed with an authentication error.
+    '''
+
+    # Revalidate this many seconds before the ticket actually expires
+    expiryMargin = 5 * 60
+
+    # How long to trust a login that didn't report an expiry (e.g. no password set)
+    defaultLifetime = 60 * 60
+
+    def __init__(self, p4):
+        self.p4 = p4
+        self.expires = None
+
+    def invalidate(self):
+        self.expires = None
+
+    def isExpiring(self):
+        return self.expires is None or time.time() >= self.expires - self.expiryMargin
+
+    def update(self, result):
+        lifetime = self.defaultLifetime
+
+        for entry in result or []:
+            if isinstance(entry, dict) and 'TicketExpiration' in entry:
+                try:
+                    lifetime = int(entry['TicketExpiration'])
+                except ValueError:
+                    pass
+                break
+
+        self.expires = time.time() + lifetime
+        p4Logger().debug('Login ticket valid for another %ss' % lifetime)
+
+    def check(self):
+        if not self.p4.connected():
+            self.invalidate()
+            return False
+
+        if not self.isExpiring():
+            return True
+
+        with self.p4.at_exception_level(P4.RAISE_ERRORS):
+            try:
+                result = self.p4.run_login('-s')
+            except P4Exception as e:
+                p4Logger().debug(e)
+                self.invalidate()
+                return False
+
+        self.update(result)
+        return True
+
+    def noteException(self, e):
+        if isAuthError(e):
+            p4Logger().info('Authentication error, login will be revalidated')
+            self.invalidate()
+            return True
+        return False
@@ -0,0 +1,203 @@
+import os
+
+try:
+    import sqlite3
+except ImportError:
+    # Some DCC builds of Python ship without it, the browser just isn't cached
+    sqlite3 = None
+
+from P4 import P4, P4Exception
+
+from perforce.Utils import p4Logger
+from perforce.PerforceUtils import DepotTrie
+
+# Bump when the tables change, older caches are dropped rather than migrated
+schemaVersion = 1
+
+# Further behind than this and it's quicker to prefetch the tree again
+maxChanges = 1000
+
+# Changelists per 'describe -s'
+describeBatch = 100
+
+class MetadataCache(object):
+    '''
+    Prefetched trees kept in SQLite between sessions, so the browser can be
+    shown without asking the server. Each tree is stamped with the last
+    submitted change it includes, everything after that is picked up with
+    changesSince() rather than fetching the whole tree again.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        # Paths etc. come back as str, same as P4Python gives us
+        self.db.text_factory = str
+        self.createTables()
+
+    def createTables(self):
+        with self.db:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != schemaVersion:
+                self.db.execute('DROP TABLE IF EXISTS roots')
+                self.db.execute('DROP TABLE IF EXISTS files')
+
+            self.db.execute('CREATE TABLE IF NOT EXISTS roots (id INTEGER PRIMARY KEY, port TEXT, client TEXT, '
+                            'root TEXT, change INTEGER, UNIQUE (port, client, root))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files (root INTEGER, %s, PRIMARY KEY (root, depotFile))'
+                            % ', '.join('%s TEXT' % x for x in DepotTrie.prefetchFields))
+            self.db.execute('PRAGMA user_version = %d' % schemaVersion)
+
+    def close(self):
+        self.db.close()
+
+    def findRoot(self, p4, root):
+        return self.db.execute('SELECT id, change FROM roots WHERE port = ? AND client = ? AND root = ?',
+                               (p4.port, p4.client, root)).fetchone()
+
+    def fileRows(self, rootId, fstats):
+        for f in fstats:
+            yield (rootId,) + tuple(f.get(x) for x in DepotTrie.prefetchFields)
+
+    def load(self, p4, root):
+        '''
+        The cached tree for root and the change it's up to date with,
+        or None when it hasn't been cached
+        '''
+        row = self.findRoot(p4, root)
+        if row is None:
+            return None
+
+        rootId, change = row
+        trie = DepotTrie.DepotTrie(root)
+        for values in self.db.execute('SELECT %s FROM files WHERE root = ? ORDER BY depotFile'
+                                      % ', '.join(DepotTrie.prefetchFields), (rootId,)):
+            trie.insert(dict((k, v) for k, v in zip(DepotTrie.prefetchFields, values) if v is not None))
+
+        p4Logger().debug('Loaded %d cached files under %s at change %d' % (trie.fileCount, root, change))
+        return trie, change
+
+    def store(self, p4, root, trie, change):
+        with self.db:
+            self.forget(p4, root)
+            rootId = self.db.execute('INSERT INTO roots (port, client, root, change) VALUES (?, ?, ?, ?)',
+                                     (p4.port, p4.client, root, change)).lastrowid
+            self.db.executemany('INSERT INTO files VALUES (%s)' % ', '.join('?' * (len(DepotTrie.prefetchFields) + 1)),
+                                self.fileRows(rootId, trie.walk()))
+
+    def update(self, p4, root, fstats, removed, change):
+        row = self.findRoot(p4, root)
+        if row is None:
+            return
+
+        rootId = row[0]
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (%s)' % ', '.join('?' * (len(DepotTrie.prefetchFields) + 1)),
+                                self.fileRows(rootId, fstats))
+            self.db.executemany('DELETE FROM files WHERE root = ? AND depotFile = ?', [(rootId, x) for x in removed])
+            self.db.execute('UPDATE roots SET change = ? WHERE id = ?', (change, rootId))
+
+    def forget(self, p4, root):
+        row = self.findRoot(p4, root)
+        if row is None:
+            return
+
+        with self.db:
+            self.db.execute('DELETE FROM files WHERE root = ?', (row[0],))
+            self.db.execute('DELETE FROM roots WHERE id = ?', (row[0],))
+
+    def openedFiles(self, p4, root):
+        # Opened when cached, they may have been submitted or reverted since
+        row = self.findRoot(p4, root)
+        if row is None:
+            return []
+        return [x[0] for x in self.db.execute('SELECT depotFile FROM files WHERE root = ? AND action IS NOT NULL', (row[0],))]
+
+
+def latestChange(p4, root):
+    # Taken before fetching the tree, so anything submitted meanwhile is picked up next time
+    try:
+        with p4.at_exception_level(P4.RAISE_ERRORS):
+            changes = p4.run_changes('-m', '1', '-s', 'submitted', '/'.join([root, '...']))
+    except P4Exception as e:
+        p4Logger().info('Failed to query the latest change of %s: %s' % (root, e))
+        return None
+    return int(changes[0]['change']) if changes else 0
+
+def submittedSince(p4, root, since):
+    '''
+    The latest change submitted under root and the depot paths of the files
+    changed after change since, or None when more than maxChanges have gone in
+    '''
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        changes = p4.run_changes('-s', 'submitted', '-m', str(maxChanges + 1), '%s/...@>%d' % (root, since))
+        if len(changes) > maxChanges:
+            return None
+
+        numbers = [int(x['change']) for x in changes]
+
+        files = set()
+        for i in range(0, len(numbers), describeBatch):
+            for described in p4.run_describe('-s', *[str(x) for x in numbers[i:i + describeBatch]]):
+                files.update(described.get('depotFile', []))
+
+    return max(numbers + [since]), sorted(files)
+
+def changesSince(p4, root, since, openedFiles=[], depotRoot=None, includeOpened=True):
+    '''
+    fstat rows for files under root that changed after change since, and the
+    depot paths of files that have gone, as (change, fstats, removed).
+    Returns None when more than maxChanges have been submitted since.
+    Doesn't touch the cache so it can run on a worker thread.
+    '''
+    fields = ','.join(DepotTrie.prefetchFields)
+
+    submitted = submittedSince(p4, root, since)
+    if submitted is None:
+        return None
+
+    latest, dirty = submitted
+    dirty = set(dirty).union(openedFiles)
+    if depotRoot:
+        dirty = set(x for x in dirty if x.startswith(depotRoot + '/'))
+
+    fstats = {}
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        # Opened files can change without anything being submitted
+        if includeOpened:
+            fstats.update((x['depotFile'], x) for x in p4.run_fstat('-Ro', '-T', fields, '/'.join([root, '...']))
+                          if 'depotFile' in x)
+
+        stale = sorted(dirty.difference(fstats))
+        if stale:
+            fstats.update((x['depotFile'], x) for x in p4.run_fstat('-T', fields, *stale) if 'depotFile' in x)
+
+    removed = sorted(dirty.difference(fstats))
+    return latest, fstats.values(), removed
+
+
+_cache = None
+
+def cachePath():
+    path = os.getenv('P4VFX_METADATA_CACHE')
+    if path is None:
+        from perforce.AppInterop import interop
+        path = os.path.join(interop.getSettingsPath(), 'p4vfx_metadata.db')
+    return path
+
+def getCache():
+    '''
+    The process wide cache, or None when it's disabled (P4VFX_METADATA_CACHE=0)
+    or can't be opened
+    '''
+    global _cache
+    if _cache is None:
+        path = cachePath()
+        if path in ('', '0') or sqlite3 is None:
+            return None
+
+        try:
+            _cache = MetadataCache(path)
+        except (sqlite3.Error, EnvironmentError, NotImplementedError) as e:
+            p4Logger().warning('Failed to open metadata cache %s: %s' % (path, e))
+            return None
+    return _cache
@@ -0,0 +1,209 @@
+import bisect
+import re
+
+from P4 import P4, P4Exception, OutputHandler
+
+from perforce.Utils import p4Logger
+
+# Matches looked at per search, enough to rank the likely hits without scanning everything
+maxCandidates = 5000
+
+# Paths per 'files' when checking what a change did to them
+filesBatch = 500
+
+deletedActions = ('delete', 'move/delete', 'purge', 'archive')
+
+class PathIndex(object):
+    '''
+    Paths of every file under a depot folder, relative to it, for type-ahead
+    search. They're kept sorted along with one lowercase string of all of
+    them, so a search is a scan of that string rather than a loop in Python.
+    '''
+
+    def __init__(self, depotRoot, paths=()):
+        self.depotRoot = depotRoot.rstrip('/')
+        self.paths = sorted(paths)
+        self.text = None
+        self.offsets = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def relativePath(self, depotFile):
+        if depotFile.startswith(self.depotRoot + '/'):
+            return depotFile[len(self.depotRoot) + 1:]
+        return None
+
+    def add(self, depotFile):
+        rel = self.relativePath(depotFile)
+        if rel is None:
+            return False
+
+        i = bisect.bisect_left(self.paths, rel)
+        if i < len(self.paths) and self.paths[i] == rel:
+            return False
+
+        self.paths.insert(i, rel)
+        self.text = None
+        return True
+
+    def remove(self, depotFile):
+        rel = self.relativePath(depotFile)
+        i = bisect.bisect_left(self.paths, rel) if rel is not None else len(self.paths)
+        if i == len(self.paths) or self.paths[i] != rel:
+            return False
+
+        del self.paths[i]
+        self.text = None
+        return True
+
+    def update(self, present, gone):
+        changed = False
+        for depotFile in present:
+            changed = self.add(depotFile) or changed
+        for depotFile in gone:
+            changed = self.remove(depotFile) or changed
+        return changed
+
+    def buildText(self):
+        # Rebuilt on the next search after the paths change
+        self.text = '\n'.join(self.paths).lower()
+        self.offsets = []
+        offset = 0
+        for path in self.paths:
+            self.offsets.append(offset)
+            offset += len(path) + 1
+
+    def matchOffsets(self, word, pattern=None):
+        # str.find is quicker than a regex for plain words
+        if pattern is not None:
+            for match in pattern.finditer(self.text):
+                yield match.start()
+            return
+
+        offset = self.text.find(word)
+        while offset != -1:
+            yield offset
+            offset = self.text.find(word, offset + 1)
+
+    def candidates(self, word, pattern=None):
+        # Indices of the paths word is in (or pattern matches), in path order
+        result = []
+        last = -1
+        for offset in self.matchOffsets(word, pattern):
+            i = bisect.bisect_right(self.offsets, offset) - 1
+            if i != last:
+                result.append(i)
+                last = i
+                if len(result) >= maxCandidates:
+                    break
+        return result
+
+    def search(self, query, limit=50):
+        '''
+        Paths matching every word of query, best first: file names that match
+        exactly, then ones starting with it, containing it, and then paths
+        matching anywhere. When nothing contains the words they're matched
+        fuzzily, their letters in order within a file or folder name.
+        '''
+        words = sorted(query.lower().split(), key=len, reverse=True)
+        if not words:
+            return []
+
+        if self.text is None:
+            self.buildText()
+
+        matches = [i for i in self.candidates(words[0])
+                   if all(x in self.paths[i].lower() for x in words[1:])]
+        if not matches:
+            patterns = [fuzzyPattern(x) for x in words]
+            matches = [i for i in self.candidates(words[0], patterns[0])
+                       if all(x.search(self.paths[i].lower()) for x in patterns[1:])]
+
+        word = words[0]
+
+        def rank(i):
+            path = self.paths[i]
+            name = path.rsplit('/', 1)[-1].lower()
+            if name == word:
+                order = 0
+            elif name.startswith(word):
+                order = 1
+            elif word in name:
+                order = 2
+            else:
+                order = 3
+            return order, len(path), path
+
+        return [self.paths[i] for i in sorted(matches, key=rank)[:limit]]
+
+
+def fuzzyPattern(word):
+    # Letters of word in order within one name, each gap stops at the next letter so nothing backtracks
+    gaps = ['%s[^%s/\n]*' % (re.escape(c), re.escape(n)) for c, n in zip(word, word[1:])]
+    return re.compile(''.join(gaps) + re.escape(word[-1]))
+
+
+class IndexBuilder(OutputHandler):
+    # Keeps just the paths rather than a dict per file
+    def __init__(self, index):
+        OutputHandler.__init__(self)
+        self.index = index
+        self.paths = []
+
+    def outputStat(self, stat):
+        rel = self.index.relativePath(stat.get('depotFile', ''))
+        if rel is not None:
+            self.paths.append(rel)
+        return OutputHandler.HANDLED
+
+
+def depotRootOf(p4, root):
+    # The depot folder a client root maps to
+    if root.startswith('//'):
+        return root.rstrip('/')
+
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        where = p4.run_where('/'.join([root.rstrip('/'), '...']))
+    return where[-1]['depotFile'][:-len('/...')] if where else None
+
+def buildIndex(p4, root, trie=None):
+    '''
+    PathIndex of the files under root that haven't been deleted, from the
+    prefetched tree when there is one, otherwise with a single 'files'
+    '''
+    if trie is not None and trie.rootNode.depotPath:
+        index = PathIndex(trie.rootNode.depotPath)
+        # Folders mapped from elsewhere in the depot aren't under the root's depot path
+        paths = (index.relativePath(x['depotFile']) for x in trie.walk()
+                 if x.get('headAction') not in deletedActions)
+        index.paths = sorted(x for x in paths if x is not None)
+        return index
+
+    index = PathIndex(depotRootOf(p4, root) or root)
+    builder = IndexBuilder(index)
+    with p4.at_exception_level(P4.RAISE_ERRORS), p4.using_handler(builder):
+        p4.run_files('-e', '/'.join([root.rstrip('/'), '...']))
+
+    builder.paths.sort()
+    index.paths = builder.paths
+    p4Logger().debug('Indexed %d files under %s' % (len(index), root))
+    return index
+
+def filesChanged(p4, depotFiles):
+    '''
+    Split the depot paths touched by newly submitted changes into the files
+    that are there now and the ones that have been deleted, as (present, gone)
+    '''
+    present = set()
+    with p4.at_exception_level(P4.RAISE_ERROR):
+        for i in range(0, len(depotFiles), filesBatch):
+            try:
+                files = p4.run_files(*depotFiles[i:i + filesBatch])
+            except P4Exception as e:
+                p4Logger().info('Failed to check changed files: %s' % e)
+                continue
+            present.update(x['depotFile'] for x in files
+                           if 'depotFile' in x and x.get('action') not in deletedActions)
+
+    return sorted(present), sorted(set(depotFiles).difference(present))
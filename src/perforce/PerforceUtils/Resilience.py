@@ -0,0 +1,125 @@
+import time
+
+from P4 import P4, P4Exception
+
+from perforce.Utils import p4Logger
+from perforce.PerforceUtils import Instrumentation
+
+# Messages that mean the connection itself failed, rather than the command
+transportErrors = [
+    'connect to server failed',
+    'tcp receive failed',
+    'tcp send failed',
+    'tcp connect to',
+    'partner exited unexpectedly',
+    'rpctransport',
+    'connection reset',
+    'connection refused',
+    'connection timed out',
+    'network is unreachable',
+    'broken pipe',
+    'not connected',
+]
+
+# Commands that can be run twice without changing anything
+readOnlyCommands = set(['fstat', 'filelog', 'opened', 'changes', 'info', 'describe', 'files', 'dirs', 'where'])
+
+# Spec commands that are read-only when only fetching the spec
+specCommands = set(['client', 'user', 'change', 'label'])
+
+def isTransportError(e):
+    msg = str(e).lower()
+    return any(x in msg for x in transportErrors)
+
+def isReadOnly(args):
+    args = [str(x) for x in Instrumentation.flattenArgs(args)]
+    if not args:
+        return False
+    if args[0] in readOnlyCommands:
+        return True
+    return args[0] in specCommands and '-o' in args[1:]
+
+
+class ResilientP4(Instrumentation.InstrumentedP4):
+    '''
+    Reconnects when a command fails because the connection dropped (VPN
+    blips, server restarts), backing off exponentially until reconnectTimeout.
+    Read-only commands are then run again, anything else still raises since
+    there's no telling whether the server applied it.
+
+    Only connections that have been established before are reconnected, the
+    first connection (and login) is still up to SetupConnection.connect(),
+    and one that was disconnected on purpose stays that way.
+    '''
+
+    reconnectTimeout = 20.0
+    initialDelay = 0.25
+    maxDelay = 4.0
+    backoffFactor = 2.0
+
+    def __init__(self, *args, **kargs):
+        super(ResilientP4, self).__init__(*args, **kargs)
+        self.wasConnected = False
+        self.reconnecting = False
+
+    def connect(self):
+        result = super(ResilientP4, self).connect()
+        self.wasConnected = True
+        return result
+
+    def disconnect(self):
+        self.wasConnected = False
+        return super(ResilientP4, self).disconnect()
+
+    def run(self, *args, **kargs):
+        deadline = None
+
+        while True:
+            try:
+                return super(ResilientP4, self).run(*args, **kargs)
+            except P4Exception as e:
+                if self.reconnecting or not self.wasConnected or not isTransportError(e):
+                    raise
+
+                if deadline is None:
+                    deadline = time.time() + self.reconnectTimeout
+
+                p4Logger().warning('Lost connection to %s: %s' % (self.port, str(e).strip()))
+
+                if not self.reconnect(deadline):
+                    raise
+
+                if not isReadOnly(args):
+                    raise
+
+                p4Logger().info('Retrying %s' % Instrumentation.commandShape(args))
+
+    def reconnect(self, deadline):
+        delay = self.initialDelay
+        attempt = 0
+
+        self.reconnecting = True
+        try:
+            while True:
+                attempt += 1
+                try:
+                    if self.connected():
+                        super(ResilientP4, self).disconnect()
+                except P4Exception:
+                    pass
+
+                try:
+                    super(ResilientP4, self).connect()
+                    p4Logger().info('Reconnected to %s after %d attempt(s)' % (self.port, attempt))
+                    return True
+                except P4Exception as e:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        p4Logger().warning('Giving up reconnecting to %s: %s' % (self.port, str(e).strip()))
+                        return False
+
+                    p4Logger().debug('Reconnect attempt %d failed, retrying in %.2fs' % (attempt, min(delay, remaining)))
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * self.backoffFactor, self.maxDelay)
+        finally:
+            self.reconnecting = False
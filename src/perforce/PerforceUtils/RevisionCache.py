@@ -0,0 +1,190 @@
+import os
+import threading
+from collections import OrderedDict
+
+from P4 import P4
+
+from perforce.Utils import p4Logger
+
+# Files whose revisions are kept, the least recently shown are dropped first
+maxEntries = int(os.getenv('P4VFX_REVISION_CACHE', 200))
+
+# Bytes of revisions fetched ahead for the files in an expanded folder, 0 disables it
+prefetchBudget = int(os.getenv('P4VFX_REVISION_PREFETCH', 1024 * 1024))
+
+# Files per 'filelog' when prefetching
+prefetchBatch = 50
+
+# Bytes of revisions put back for a file once more have been shown, older ones are fetched again
+maxEntrySize = 256 * 1024
+
+# Rough size of a parsed revision besides its strings, and of a whole one before it's been fetched
+revisionOverhead = 64
+revisionEstimate = 200
+
+def parseDepotFile(depotFile, fullDescriptions=False):
+    # Without -l the server cuts descriptions short, those are loaded once they're shown
+    revisions = []
+    for revision in depotFile.each_revision():
+        revisions.append({"revision": int(revision.rev),
+                          "action": revision.action,
+                          "date": revision.time,
+                          "desc": revision.desc,
+                          "fullDesc": fullDescriptions,
+                          "user": revision.user,
+                          "client": revision.client
+                          })
+    return revisions
+
+def parseFilelog(files, fullDescriptions=False):
+    return parseDepotFile(files[0], fullDescriptions) if files else []
+
+def revisionsSize(revisions):
+    return sum(revisionOverhead + len(x['desc'] or '') + len(x['user'] or '') + len(x['client'] or '')
+               for x in revisions)
+
+def newestRevisions(revisions, byteBudget):
+    # At least one, and as many more as fit in byteBudget
+    size = 0
+    for i, revision in enumerate(revisions):
+        size += revisionsSize([revision])
+        if size > byteBudget:
+            return revisions[:max(i, 1)]
+    return revisions
+
+class RevisionCache(object):
+    '''
+    Parsed filelogs of recently shown files, keyed by depot path and head
+    revision. A file is only looked up with the head revision fstat just
+    reported for it, so a newer head drops the old entry rather than showing
+    it. Shared between worker threads, so the lists put() here aren't
+    changed afterwards, callers copy them to add to.
+    '''
+
+    def __init__(self, maxEntries=maxEntries):
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Client paths etc. a file was asked for by -> depot path
+        self.aliases = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, depotFile, headRev):
+        with self.lock:
+            entry = self.entries.pop(depotFile, None)
+            if entry is None:
+                return None
+
+            if entry[0] != str(headRev):
+                p4Logger().debug('%s has a new head #%s, dropped #%s' % (depotFile, headRev, entry[0]))
+                self.dropAliases(depotFile)
+                return None
+
+            # Most recently used last
+            self.entries[depotFile] = entry
+            return entry[1]
+
+    def contains(self, depotFile, headRev):
+        # Without making it the most recently used
+        with self.lock:
+            entry = self.entries.get(depotFile)
+            return entry is not None and entry[0] == str(headRev)
+
+    def put(self, depotFile, headRev, revisions, name=None):
+        if self.maxEntries <= 0:
+            return
+
+        with self.lock:
+            self.entries.pop(depotFile, None)
+            self.entries[depotFile] = (str(headRev), revisions)
+            if name and name != depotFile:
+                self.aliases[name] = depotFile
+
+            while len(self.entries) > self.maxEntries:
+                oldest, _ = self.entries.popitem(last=False)
+                self.dropAliases(oldest)
+
+    def invalidate(self, paths):
+        '''
+        Drop the files in paths, given as depot paths or whatever name they
+        were put() with
+        '''
+        with self.lock:
+            for path in paths:
+                depotFile = self.aliases.get(path, path)
+                if self.entries.pop(depotFile, None) is not None:
+                    self.dropAliases(depotFile)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.aliases.clear()
+
+    def dropAliases(self, depotFile):
+        for name in [x for x, y in self.aliases.items() if y == depotFile]:
+            del self.aliases[name]
+
+
+_cache = RevisionCache()
+
+def getCache():
+    return _cache
+
+def prefetch(p4, paths, pageSize, byteBudget=prefetchBudget):
+    '''
+    Cache the newest pageSize revisions of the files in one folder, nearest
+    first, so clicking through them doesn't wait on the server. Their head
+    revisions come from one 'fstat' and the revisions from a 'filelog' per
+    batch of files, until about byteBudget bytes of revisions have been
+    fetched. Returns the number of files cached.
+    '''
+    cache = getCache()
+    if byteBudget <= 0 or cache.maxEntries <= 0 or not paths:
+        return 0
+
+    # Leave most of the cache to the files actually shown
+    paths = paths[:max(cache.maxEntries // 2, 1)]
+    # Client paths from the server use backslashes on Windows
+    order = dict((x.replace('\\', '/').rsplit('/', 1)[-1], (i, x)) for i, x in enumerate(paths))
+
+    with p4.at_exception_level(P4.RAISE_ERROR):
+        stats = p4.run_fstat('-T', 'depotFile,headRev', *paths)
+
+    wanted = []
+    estimate = 0
+    for stat in stats:
+        name = order.get(stat.get('depotFile', '').rsplit('/', 1)[-1])
+        if name is None or 'headRev' not in stat or cache.contains(stat['depotFile'], stat['headRev']):
+            continue
+        wanted.append((name[0], name[1], stat['depotFile'], stat['headRev']))
+    wanted.sort()
+
+    # Roughly what they'll cost, so the last batch doesn't go far over
+    for i, entry in enumerate(wanted):
+        estimate += min(int(entry[3]), pageSize) * revisionEstimate
+        if estimate > byteBudget:
+            wanted = wanted[:i + 1]
+            break
+
+    spent = 0
+    cached = 0
+    for i in range(0, len(wanted), prefetchBatch):
+        if spent >= byteBudget:
+            break
+
+        batch = dict((x[2], x) for x in wanted[i:i + prefetchBatch])
+        with p4.at_exception_level(P4.RAISE_ERROR):
+            files = p4.run_filelog('-m', str(pageSize), *['%s#%s' % (x[2], x[3]) for x in wanted[i:i + prefetchBatch]])
+
+        for depotFile in files:
+            entry = batch.get(getattr(depotFile, 'depotFile', None))
+            if entry is None:
+                continue
+            revisions = parseDepotFile(depotFile)
+            spent += revisionsSize(revisions)
+            cache.put(entry[2], entry[3], revisions, entry[1])
+            cached += 1
+
+    return cached
@@ -0,0 +1,74 @@
+from P4 import P4, P4Exception
+
+from perforce.Utils import p4Logger
+from perforce.PerforceUtils import LoginState
+
+class P4Session(object):
+    '''
+    Cached snapshot of the server state for a P4 connection.
+    'p4 info', the client spec and the user spec are queried once and reused
+    until the port/user/client change or the connection is re-established.
+    '''
+
+    def __init__(self, p4):
+        self.p4 = p4
+        self.key = None
+        self.login = LoginState.LoginTracker(p4)
+        self.warmupThread = None
+        self.invalidate()
+
+    def connectionKey(self):
+        return (self.p4.port, self.p4.user, self.p4.client, self.p4.connected())
+
+    def invalidate(self):
+        self.cachedInfo = None
+        self.cachedClient = None
+        self.cachedUser = None
+        self.login.invalidate()
+        self.key = self.connectionKey()
+
+    def validate(self):
+        key = self.connectionKey()
+        if key != self.key:
+            p4Logger().debug('Connection changed (%s -> %s), clearing session cache' % (self.key, key))
+            self.invalidate()
+
+    def info(self, refresh=False):
+        self.validate()
+        if refresh or self.cachedInfo is None:
+            self.cachedInfo = self.p4.run_info()[0]
+        return self.cachedInfo
+
+    def client(self, refresh=False):
+        self.validate()
+        if refresh or self.cachedClient is None:
+            self.cachedClient = self.p4.fetch_client()
+        return self.cachedClient
+
+    def user(self, refresh=False):
+        self.validate()
+        if refresh or self.cachedUser is None:
+            self.cachedUser = self.p4.fetch_user()
+        return self.cachedUser
+
+    def clientRoot(self):
+        return self.info()['clientRoot'].replace('\\', '/')
+
+
+# One session per P4 object
+_sessions = {}
+
+def getSession(p4):
+    session = _sessions.get(id(p4))
+    if session is None or session.p4 is not p4:
+        session = P4Session(p4)
+        _sessions[id(p4)] = session
+    return session
+
+def releaseSession(p4):
+    _sessions.pop(id(p4), None)
+
+def noteException(e):
+    # An auth failure on any connection means the ticket needs checking again
+    for session in _sessions.values():
+        session.login.noteException(e)
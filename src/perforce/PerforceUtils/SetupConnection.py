@@ -1,24 +1,36 @@
 import os
+import threading
 
 from P4 import P4, P4Exception
 
 from perforce.Utils import p4Logger
+from perforce.PerforceUtils import Session
+
+def openConnection(p4):
+    # By setting P4's CWD to the settings folder, the user can create a 
+    # P4CONFIG file per app. If they have already set an absolute path
+    # for P4CONFIG, then this will have no effect.
+    # Otherwise P4 will search upwards until it finds a p4config file
+    from perforce.AppInterop import interop
+    p4.cwd = interop.getSettingsPath()
+
+    p4Logger().info('Connecting to server... %s' % p4.port)
+    p4Logger().debug('Using p4config file: %s' % p4.p4config_file)
+    p4.connect()
+
+    # Anything cached from a previous connection may be stale now
+    Session.getSession(p4).invalidate()
 
 def connect(p4):
+    waitForWarmup(p4)
+
     if not p4.connected():
-        # By setting P4's CWD to the settings folder, the user can create a 
-        # P4CONFIG file per app. If they have already set an absolute path
-        # for P4CONFIG, then this will have no effect.
-        # Otherwise P4 will search upwards until it finds a p4config file
-        from perforce.AppInterop import interop
-        p4.cwd = interop.getSettingsPath()
+        openConnection(p4)
 
-        p4Logger().info('Connecting to server... %s' % p4.port)
-        p4Logger().debug('Using p4config file: %s' % p4.p4config_file)
-        p4.connect()
+    session = Session.getSession(p4)
 
     try:
-        root = p4.fetch_client()
+        root = session.client()
     except P4Exception as e:
         p4Logger().info('Attempting to login...')
         try:
@@ -30,15 +42,14 @@ def connect(p4):
             raise
 
         try:
-            root = p4.fetch_client()
+            root = session.client(refresh=True)
         except P4Exception as e:
             raise e
 
         p4Logger().info('Connected to server! [%s]' % (root))
 
     try:
-        tmp = p4.run_info()
-        info = tmp[0]
+        info = session.info()
     except P4Exception as e:
         p4Logger().error( e.msg )
         raise e
@@ -63,3 +74,42 @@ def connect(p4):
     #     p4Logger().debug( '\t%s:\t%s' % (key, info[key]) )
 
     p4Logger().debug("Perforce CWD: %s" % p4.cwd)
+
+
+def warmup(p4):
+    '''
+    Connect and prime the session caches on a background thread so the host
+    stays responsive while the plugin loads. Login dialogs can't be shown from
+    here, so if the ticket isn't valid this stops and leaves it to connect()
+    '''
+    session = Session.getSession(p4)
+
+    def run():
+        try:
+            if not p4.connected():
+                openConnection(p4)
+
+            if not session.login.check():
+                p4Logger().info('Warm-up: no valid login ticket, skipping')
+                return
+
+            session.client()
+            session.user()
+            p4.cwd = session.clientRoot()
+            p4Logger().info('Warm-up: connected to %s as %s@%s' % (p4.port, p4.user, p4.client))
+        except Exception as e:
+            p4Logger().warning('Warm-up failed: %s' % e)
+
+    thread = threading.Thread(target=run, name='P4Warmup')
+    thread.daemon = True
+    session.warmupThread = thread
+    thread.start()
+
+    return thread
+
+def waitForWarmup(p4):
+    # P4 objects can't be shared between threads, so block until it's done
+    thread = Session.getSession(p4).warmupThread
+    if thread and thread.is_alive() and thread is not threading.current_thread():
+        p4Logger().debug('Waiting for connection warm-up to finish')
+        thread.join()
@@ -17,22 +17,40 @@ logging.basicConfig(
 
 from PerforceUtils import SetupConnection
 reload(SetupConnection)
+from PerforceUtils import ConnectionPool
+from PerforceUtils import Instrumentation
+from PerforceUtils import Resilience
 
 import GUI
 reload(GUI)
 
 
 # Evil global
-p4 = P4()
+# (every command it runs is timed, see Miscellaneous > Diagnostics,
+# and dropped connections are re-established automatically)
+p4 = Resilience.ResilientP4()
 
-def init():
+# Optionally keep a rotating JSON-lines log of every command
+if os.getenv('P4VFX_COMMAND_LOG'):
+    Instrumentation.getRecorder().enableLog(os.getenv('P4VFX_COMMAND_LOG'))
+
+def init(warmup=None):
     # Everything relies on the P4 environment being setup, so don't even try and load if it's not set properly
     # if p4.p4config_file == 'noconfig':
     #     raise RuntimeError("Can't find P4CONFIG, please ensure your Perforce is set correctly. (Look at 'p4 set' and set the P4CONFIG environment variable to the location of your configuration file")
 
     GUI.initMenu(p4)
 
+    # Opt-in, connect in the background so the first menu click doesn't stall the host
+    if warmup is None:
+        warmup = os.getenv('P4VFX_WARMUP', '').lower() in ('1', 'true', 'yes', 'on')
+
+    if warmup:
+        SetupConnection.warmup(p4)
+
 def close():
+    SetupConnection.waitForWarmup(p4)
+    ConnectionPool.closePool(p4)
     p4.disconnect()
 
     GUI.cleanupMenu()
@@ -33,7 +33,8 @@ def displayMenuItem(ui, args):
             "server.info":                      ui.queryServerStatus,
             "create.workspace":                 ui.createWorkspace,
             "set.current.workspace":            ui.setCurrentWorkspace,
-            "delete.pending":                   ui.deletePending
+            "delete.pending":                   ui.deletePending,
+            "diagnostics":                      ui.showDiagnostics
     }
 
     for arg in args:
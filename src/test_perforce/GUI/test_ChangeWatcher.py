@@ -0,0 +1,94 @@
+import time
+import unittest
+import logging
+
+from perforce.GUI.qtpy import QtCore
+
+from test_perforce import FakeServerTestCase, qtApplication
+from perforce.PerforceUtils import Instrumentation
+from perforce.GUI import DepotClientViewModel
+from perforce.GUI import ChangeWatcher
+
+class ChangeWatcherTests(FakeServerTestCase):
+    clientRoot = '/tmp/p4vfx_watcher_ws'
+
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+        self.app = qtApplication()
+        super(ChangeWatcherTests, self).setUp()
+
+    def waitFor(self, watcher):
+        while watcher.request is not None:
+            self.app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+
+    def expandAll(self, model):
+        stack = [QtCore.QModelIndex()]
+        while stack:
+            parent = stack.pop()
+            for row in range(model.rowCount(parent)):
+                index = model.index(row, 0, parent)
+                if index.internalPointer().data[1] == 'Folder':
+                    model.populateSubDir(index, self.clientRoot)
+                    stack.append(index)
+
+    def refresh(self, prefetchLimit):
+        model = DepotClientViewModel.PerforceItemModel(self.p4)
+        model.prefetchLimit = prefetchLimit
+        model.populate(self.clientRoot)
+        self.expandAll(model)
+
+        watcher = ChangeWatcher.ChangeWatcher(model, self.clientRoot)
+        watcher.start()
+        self.waitFor(watcher)
+
+        # First folder with files in it
+        folder = model.rootItem.childItems[0]
+        while folder.childItems[-1].data[1] == 'Folder':
+            folder = folder.childItems[0]
+        edited = folder.childItems[-1]
+        self.failUnless(edited.data[3] != 'delete')
+
+        # Rows that are still there are kept, the current one along with them
+        self.submitted = folder.childItems[-2]
+        self.submittedRev = int(self.submitted.data[4])
+        self.kept = QtCore.QPersistentModelIndex(model.itemIndex(folder.childItems[-3]))
+        self.removed = []
+        model.rowsRemoved.connect(lambda parent, first, last: self.removed.append((first, last)))
+
+        # Delete one file in an expanded folder, submit another and add a new folder next to them
+        self.p4.run_delete(edited.data[-1])
+        self.p4.run_edit(self.submitted.data[-1])
+        self.p4.run_add(edited.data[-1].rsplit('/', 1)[0] + '/new/file.ma')
+        self.p4.run_submit('-d', 'Changed')
+
+        with Instrumentation.CommandCounter('Poll', budget=3):
+            watcher.poll()
+            self.waitFor(watcher)
+
+            # The folders are listed again on a worker
+            deadline = time.time() + 5
+            while any(x is edited for x in folder.childItems) and time.time() < deadline:
+                self.app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+
+        return model, folder, edited
+
+    def testRefreshListedFolders(self):
+        model, folder, edited = self.refresh(prefetchLimit=0)
+
+        # Deleted files are hidden in client views, the untouched sub folders stay expanded
+        self.failIf(any(x.data[-1] == edited.data[-1] for x in folder.childItems))
+        self.failUnless(folder.findFolder('new') is not None)
+        self.failUnless(all(x.loaded for x in folder.childItems if x.data[1] == 'Folder' and x.data[0] != 'new'))
+        self.failUnless([x.row() for x in folder.childItems] == range(len(folder.childItems)))
+
+        self.failUnless(self.removed == [(edited.row(), edited.row())])
+        self.failUnless(self.kept.isValid() and self.kept.internalPointer().parentItem is folder)
+        self.failUnless(self.submitted.parentItem is folder and self.submitted in folder.childItems)
+        self.failUnless(int(self.submitted.data[4]) == self.submittedRev + 1)
+
+    def testRefreshPrefetchedFolders(self):
+        model, folder, edited = self.refresh(prefetchLimit=1000)
+
+        self.failIf(any(x.data[-1] == edited.data[-1] for x in folder.childItems))
+        self.failUnless(folder.findFolder('new') is not None)
+        self.failUnless(model.trie.findNode(edited.data[-1].rsplit('/', 1)[0] + '/new') is not None)
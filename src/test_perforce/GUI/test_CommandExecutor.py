@@ -0,0 +1,59 @@
+import unittest
+import logging
+
+from P4 import P4Exception
+
+from perforce.GUI.qtpy import QtCore
+from perforce.GUI import CommandExecutor
+
+from test_perforce import TestingEnvironment, qtApplication
+
+class CommandExecutorTests(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+        self.app = qtApplication()
+        self.p4 = TestingEnvironment()
+        self.executor = CommandExecutor.CommandExecutor(self.p4, maxWorkers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.executor.pool.close()
+        self.p4.disconnect()
+
+    def waitFor(self, future):
+        result = future.wait(10)
+        self.app.processEvents()
+        return result
+
+    def testResultIsDeliveredOnGuiThread(self):
+        results = []
+        future = self.executor.submit('info')
+        future.then(lambda result: results.append((result, QtCore.QThread.currentThread())))
+
+        info = self.waitFor(future)
+        self.failUnless(results)
+        self.failUnless(results[0][0] is info)
+        self.failUnless(results[0][1] is self.app.thread())
+
+    def testErrorsAreDelivered(self):
+        def fail(p4):
+            raise P4Exception('Failed on purpose')
+
+        errors = []
+        future = self.executor.submit(fail)
+        future.then(lambda result: None, lambda e: errors.append(e))
+
+        self.assertRaises(P4Exception, future.wait, 10)
+        self.app.processEvents()
+        self.failUnless(len(errors) == 1)
+
+    def testCancelledResultIsIgnored(self):
+        results = []
+        future = self.executor.submit('info')
+        future.then(lambda result: results.append(result))
+        future.cancel()
+
+        future.wait(10)
+        self.app.processEvents()
+        self.failIf(results)
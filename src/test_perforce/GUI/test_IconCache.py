@@ -0,0 +1,20 @@
+import unittest
+
+from test_perforce import qtApplication
+from perforce.GUI import IconCache
+
+class IconCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.app = qtApplication()
+        IconCache.clear()
+
+    def testIconsAreShared(self):
+        self.failUnless(IconCache.icon('File0059.png') is IconCache.icon('File0059.png'))
+        self.failUnless(IconCache.fileIcon('Folder', '') is IconCache.icon(IconCache.folderIcon))
+        self.failUnless(IconCache.fileIcon('text', 'delete') is IconCache.icon(IconCache.deletedIcon))
+
+    def testActionPixmaps(self):
+        pixmap = IconCache.actionPixmap('edit')
+        self.failUnless(pixmap is IconCache.actionPixmap('edit'))
+        self.failUnless(pixmap is not IconCache.actionPixmap('edit', 32))
+        self.failUnless(IconCache.actionPixmap('integrate') is None)
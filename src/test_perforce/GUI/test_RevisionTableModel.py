@@ -0,0 +1,57 @@
+import unittest
+
+from test_perforce import qtApplication
+from perforce.GUI.qtpy import QtCore, QtWidgets
+from perforce.GUI import RevisionTableModel
+from perforce.GUI import IconCache
+
+class RevisionTableModelTests(unittest.TestCase):
+    def setUp(self):
+        self.app = qtApplication()
+
+        self.model = RevisionTableModel.RevisionTableModel(None)
+        self.model.setRevisions('//depot/file.ma', [{"revision": 1000 - i, "action": "edit", "date": "2017/01/01",
+                                                     "desc": "Line one\nline two", "fullDesc": True,
+                                                     "user": "artist", "client": "ws"}
+                                                    for i in range(1000)])
+
+    def testData(self):
+        self.failUnless(self.model.rowCount() == 1000)
+        self.failUnless(self.model.columnCount() == 6)
+
+        index = self.model.index(0, 0)
+        self.failUnless(index.data() == '#1000')
+        self.failUnless(self.model.index(0, 2).data() == 'Edit')
+        self.failUnless(self.model.index(0, 2).data(QtCore.Qt.DecorationRole).cacheKey() == IconCache.actionPixmap('edit').cacheKey())
+
+        # Descriptions are shown on one line, in full when edited to copy them
+        description = self.model.index(999, 5)
+        self.failUnless(description.data() == 'Line one line two')
+        self.failUnless(description.data(QtCore.Qt.EditRole) == 'Line one\nline two')
+        self.failUnless(description.flags() & QtCore.Qt.ItemIsEditable)
+        self.failIf(index.flags() & QtCore.Qt.ItemIsEditable)
+
+    def testDelegate(self):
+        view = QtWidgets.QTableView()
+        view.setModel(self.model)
+        delegate = RevisionTableModel.RevisionDelegate(view)
+
+        index = self.model.index(0, 5)
+        editor = delegate.createEditor(view.viewport(), QtWidgets.QStyleOptionViewItem(), index)
+        delegate.setEditorData(editor, index)
+        self.failUnless(editor.isReadOnly() and editor.selectedText())
+
+        # Nothing is written back
+        delegate.setModelData(editor, self.model, index)
+        self.failUnless(self.model.revision(0)['desc'] == 'Line one\nline two')
+
+    def testDescriptionsFailed(self):
+        revision = self.model.revision(0)
+        revision['fullDesc'] = False
+        self.model.describing.add(revision['revision'])
+
+        # A failed query lets the row ask for its description again
+        self.model.onDescriptionsFailed(self.model.revisions, set([revision['revision']]), Exception('Timed out'))
+        self.failIf(self.model.describing)
+        self.model.wantDescription(revision)
+        self.failUnless(revision['revision'] in self.model.wantedDescriptions)
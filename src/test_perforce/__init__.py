@@ -1,14 +1,25 @@
+import os
+import sys
 import unittest
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
 
 def setupPythonEnvironment():
+    # Keep the browser's metadata cache out of the source tree, tests open their own
+    os.environ.setdefault('P4VFX_METADATA_CACHE', '0')
+
+    # Run against the pure Python fake instead of a real server
+    if os.environ.get('P4VFX_FAKE_P4'):
+        import FakeP4
+        server = FakeP4.FakeServer()
+        server.generate(int(os.environ.get('P4VFX_FAKE_P4_FILES', 1000)))
+        FakeP4.install(server, force=True)
+
     try:
         import P4
     except ImportError:
         import sys
-        import os
         import platform
 
         if platform.system() == 'Linux':
@@ -32,8 +43,52 @@ setupPythonEnvironment()
 
 from P4 import P4, P4Exception
 from perforce.PerforceUtils import SetupConnection
+from perforce.PerforceUtils import Instrumentation
+from perforce.PerforceUtils import ConnectionPool
+
+import FakeP4
+
 def TestingEnvironment():
     p4 = P4()
     p4.connect()
 
-    return p4
\ No newline at end of file
+    return p4
+
+def qtApplication():
+    # One per process, shared by every test that needs Qt
+    from perforce.GUI.qtpy import QtWidgets
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+# Tests against a generated depot only run with P4VFX_FAKE_P4=1
+usingFake = sys.modules.get('P4') is FakeP4
+requiresFakeP4 = unittest.skipUnless(usingFake, 'Needs the FakeP4 server (set P4VFX_FAKE_P4=1)')
+
+@requiresFakeP4
+class FakeServerTestCase(unittest.TestCase):
+    '''
+    Each test gets its own generated depot mapped under clientRoot, and an
+    InstrumentedP4 connected to it as self.p4
+    '''
+
+    clientRoot = '/tmp/p4vfx_test_ws'
+    fileCount = 100
+    filesPerDir = 10
+    dirsPerDir = 5
+
+    def setUp(self):
+        self.previousServer = FakeP4.P4.server
+        self.server = FakeP4.P4.server = FakeP4.FakeServer(clientRoot=self.clientRoot)
+        self.server.generate(fileCount=self.fileCount, filesPerDir=self.filesPerDir, dirsPerDir=self.dirsPerDir)
+
+        self.p4 = Instrumentation.InstrumentedP4()
+        self.p4.connect()
+        self.p4.cwd = self.clientRoot
+
+    def tearDown(self):
+        # Only GUI tests start an executor, the rest shouldn't have to load Qt
+        CommandExecutor = sys.modules.get('perforce.GUI.CommandExecutor')
+        if CommandExecutor:
+            CommandExecutor.shutdownExecutor(self.p4)
+        ConnectionPool.closePool(self.p4)
+        FakeP4.P4.server = self.previousServer
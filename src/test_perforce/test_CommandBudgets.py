@@ -0,0 +1,335 @@
+import time
+import unittest
+import logging
+
+from test_perforce import FakeServerTestCase, qtApplication
+from perforce.PerforceUtils import Instrumentation
+from perforce.PerforceUtils import CmdsChangelist
+from perforce.PerforceUtils import RevisionCache
+
+# Budgets are counted against a generated depot, run with P4VFX_FAKE_P4=1
+class CommandBudgetTests(FakeServerTestCase):
+    clientRoot = '/tmp/p4vfx_budget_ws'
+    fileCount = 2000
+    filesPerDir = 200
+
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+        self.app = qtApplication()
+        super(CommandBudgetTests, self).setUp()
+
+        self.files = [self.server.toLocal(self.p4, x) for x in sorted(self.server.files)[:50]]
+
+    def testBudgetExceeded(self):
+        def overBudget():
+            with Instrumentation.CommandCounter('Test', budget=1):
+                self.p4.run_info()
+                self.p4.run_info()
+
+        self.assertRaises(Instrumentation.CommandBudgetExceeded, overBudget)
+
+        with Instrumentation.CommandCounter('Test', commandBudgets={'info': 2}) as counter:
+            self.p4.run_info()
+            self.p4.run_info()
+        self.failUnless(counter.commands() == {'info': 2})
+
+    def testExpandFolder(self):
+        from perforce.GUI import DepotClientViewModel
+
+        model = DepotClientViewModel.PerforceItemModel(self.p4)
+        model.populate(self.clientRoot)
+        index = model.index(0, 0, DepotClientViewModel.QtCore.QModelIndex())
+
+        with Instrumentation.CommandCounter('Expand folder', budget=1):
+            model.populateSubDir(index, self.clientRoot)
+
+    def testExpandPendingFolder(self):
+        from perforce.GUI import DepotClientViewModel
+
+        # A folder that only exists in the default change
+        newFile = self.files[0].rsplit('/', 1)[0] + '/new/file.ma'
+        self.p4.run_add(newFile)
+
+        model = DepotClientViewModel.PerforceItemModel(self.p4)
+        model.prefetchLimit = 0
+        model.populate(self.clientRoot)
+
+        # One listing per folder expanded on the way down, nothing for the pending ones
+        folders = newFile[len(self.clientRoot) + 1:].split('/')[:-1]
+        treeItem = model.rootItem
+        with Instrumentation.CommandCounter('Expand to pending folder', budget=len(folders)):
+            for name in folders:
+                treeItem = treeItem.findFolder(name)
+                self.failUnless(treeItem is not None)
+                model.populateSubDir(model.itemIndex(treeItem), self.clientRoot)
+
+        self.failUnless([x.data[-1] for x in treeItem.childItems] == [newFile])
+
+    def testExpandLargeFolder(self):
+        from perforce.GUI import DepotClientViewModel
+
+        model = DepotClientViewModel.PerforceItemModel(self.p4)
+        model.prefetchLimit = 0
+        model.pageSize = 50
+        model.populate(self.clientRoot)
+
+        # Down to the first folder with files in it, only a page of them is listed
+        treeItem = model.rootItem
+        while treeItem.childItems[-1].data[1] == 'Folder':
+            treeItem = treeItem.childItems[0]
+            with Instrumentation.CommandCounter('Expand large folder', budget=2):
+                model.populateSubDir(model.itemIndex(treeItem), self.clientRoot)
+
+        index = model.itemIndex(treeItem)
+        p4path = model.directoryPath(index, self.clientRoot)
+        expected = [x[1] for x in DepotClientViewModel.listDirectory(self.p4, p4path, self.clientRoot)]
+        self.failUnless(len(treeItem.childItems) < len(expected))
+
+        # Scrolling to the end lists the rest
+        deadline = time.time() + 5
+        while len(treeItem.childItems) < len(expected) and time.time() < deadline:
+            if model.canFetchMore(index):
+                model.fetchMore(index)
+            self.app.processEvents()
+
+        self.failUnless([x.data[-1] for x in treeItem.childItems] == expected)
+        self.failIf(model.canFetchMore(index))
+
+        # Listed again a page at a time, keeping the rows already shown
+        last = DepotClientViewModel.QtCore.QPersistentModelIndex(model.itemIndex(treeItem.childItems[-1]))
+        refreshed = []
+        with Instrumentation.CommandCounter('Refresh large folder', budget=2) as counter:
+            model.reloadChildren(treeItem, self.clientRoot).then(lambda entries: refreshed.append(entries))
+            deadline = time.time() + 5
+            while not refreshed and time.time() < deadline:
+                self.app.processEvents()
+
+        self.failUnless(all('-m' in x.split() for x in counter.calls if x.startswith('fstat')))
+        self.failUnless([x.data[-1] for x in treeItem.childItems] == expected)
+        self.failUnless(last.isValid() and last.internalPointer() is treeItem.childItems[-1])
+
+    def testHideDeleted(self):
+        from perforce.GUI import DepotClientViewModel
+
+        folder = self.files[0].rsplit('/', 1)[0]
+        shown = DepotClientViewModel.listDirectory(self.p4, folder, self.clientRoot, showDeleted=True)
+        deleted = [x for x in shown if x[0] == 'File' and x[4] in DepotClientViewModel.deletedActions]
+        self.failUnless(deleted)
+
+        # The deleted rows are left out by the server rather than sent and skipped
+        recorder = Instrumentation.getRecorder()
+        recorder.reset()
+        with Instrumentation.CommandCounter('Hide deleted', budget=1):
+            hidden = DepotClientViewModel.listDirectory(self.p4, folder, self.clientRoot)
+
+        self.failUnless(hidden == [x for x in shown if x not in deleted])
+        self.failUnless(sum(x['rows'] for x in recorder.summary()) == len(hidden))
+
+    def testShowDeleted(self):
+        from perforce.GUI import DepotClientViewModel
+
+        model = DepotClientViewModel.PerforceItemModel(self.p4)
+        model.prefetchLimit = 0
+        model.pageSize = 50
+        model.populate(self.clientRoot)
+
+        treeItem = model.rootItem
+        while treeItem.childItems[-1].data[1] == 'Folder':
+            treeItem = treeItem.childItems[0]
+            model.populateSubDir(model.itemIndex(treeItem), self.clientRoot)
+
+        # The deleted files are added amongst the rows already shown, which are kept
+        shown = list(treeItem.childItems)
+        current = DepotClientViewModel.QtCore.QPersistentModelIndex(model.itemIndex(shown[-1]))
+        with Instrumentation.CommandCounter('Show deleted') as counter:
+            model.setShowDeleted(True, self.clientRoot)
+            deadline = time.time() + 5
+            while len(treeItem.childItems) == len(shown) and time.time() < deadline:
+                self.app.processEvents()
+
+        self.failUnless(all('-m' in x.split() for x in counter.calls if x.startswith('fstat')))
+        self.failUnless(all(x in treeItem.childItems for x in shown))
+        self.failUnless(current.isValid() and current.internalPointer() is shown[-1])
+
+        paths = [x.data[-1] for x in treeItem.childItems]
+        self.failUnless(paths == sorted(paths))
+        self.failUnless(any(x.data[3] in DepotClientViewModel.deletedActions for x in treeItem.childItems))
+
+    def testRevealFile(self):
+        from perforce.GUI import DepotClientViewModel
+
+        model = DepotClientViewModel.PerforceItemModel(self.p4)
+        model.prefetchLimit = 0
+        model.pageSize = 50
+        model.populate(self.clientRoot)
+
+        # One listing per folder on the way down, plus the rest of the last one
+        path = self.server.toLocal(self.p4, sorted(self.server.files)[-1])
+        relPath = path[len(self.clientRoot) + 1:]
+        with Instrumentation.CommandCounter('Reveal file', budget=relPath.count('/') + 2):
+            index = model.findPath(self.clientRoot, relPath)
+
+        self.failUnless(index.isValid() and index.internalPointer().data[-1] == path)
+        self.failIf(model.findPath(self.clientRoot, relPath + '.missing').isValid())
+
+    def testSelectFile(self):
+        from perforce.GUI import FileRevisionWindow
+
+        RevisionCache.getCache().clear()
+        with Instrumentation.CommandCounter('Select file', budget=2):
+            revisions, fileInfo = FileRevisionWindow.queryFileRevisions(self.p4, self.files[0])
+
+        # Selecting it again only checks the head revision
+        with Instrumentation.CommandCounter('Select file again', commandBudgets={'fstat': 1, 'filelog': 0}):
+            self.failUnless(FileRevisionWindow.queryFileRevisions(self.p4, self.files[0])[0] is revisions)
+
+        # Until there's a new one
+        self.p4.run_edit(self.files[0])
+        CmdsChangelist.submitChange(self.p4, [self.files[0]], 'Budget test', None)
+        with Instrumentation.CommandCounter('Select submitted file', budget=2):
+            newRevisions = FileRevisionWindow.queryFileRevisions(self.p4, self.files[0])[0]
+        self.failUnless(len(newRevisions) == len(revisions) + 1)
+
+    def testArrowThroughFiles(self):
+        from perforce.GUI import FileRevisionWindow
+
+        tab = FileRevisionWindow.BaseRevisionTab(self.p4)
+        tab.setRoot(self.clientRoot)
+        tab.create()
+
+        treeItem = tab.model.rootItem
+        while treeItem.childItems[-1].data[1] == 'Folder':
+            treeItem = treeItem.childItems[0]
+            tab.model.populateSubDir(tab.model.itemIndex(treeItem), self.clientRoot)
+
+        deadline = time.time() + 5
+        while (tab.pathIndex is None or tab.watcher.request is not None) and time.time() < deadline:
+            self.app.processEvents()
+
+        # Only the file the selection stops on is fetched
+        RevisionCache.getCache().clear()
+        files = [x for x in treeItem.childItems if x.data[1] != 'Folder'][:10]
+        with Instrumentation.CommandCounter('Arrow through files', budget=2):
+            for item in files:
+                tab.fileTree.setCurrentIndex(tab.model.itemIndex(item))
+                self.app.processEvents()
+
+            deadline = time.time() + 5
+            while not tab.fileRevisions and time.time() < deadline:
+                self.app.processEvents()
+
+        self.failUnless(tab.revisionRequest == files[-1].data[-1])
+        self.failUnless(tab.revisionModel.fullname == files[-1].data[-1])
+        tab.deleteLater()
+
+    def testClickAfterExpand(self):
+        from perforce.GUI import FileRevisionWindow
+
+        tab = FileRevisionWindow.BaseRevisionTab(self.p4)
+        tab.setRoot(self.clientRoot)
+        tab.create()
+        RevisionCache.getCache().clear()
+
+        treeItem = tab.model.rootItem
+        while treeItem.childItems[-1].data[1] == 'Folder':
+            treeItem = treeItem.childItems[0]
+            tab.model.populateSubDir(tab.model.itemIndex(treeItem), self.clientRoot)
+
+        # Expanding a folder fetches its files' revisions in the background
+        tab.onExpandedFolder(tab.model.itemIndex(treeItem))
+        deadline = time.time() + 5
+        while not tab.prefetchFuture.isDone() and time.time() < deadline:
+            self.app.processEvents()
+
+        # So clicking one of them only checks its head revision
+        item = treeItem.childItems[len(treeItem.childItems) // 2]
+        tab.fileTree.setCurrentIndex(tab.model.itemIndex(item))
+        with Instrumentation.CommandCounter('Click prefetched file', commandBudgets={'fstat': 1, 'filelog': 0}):
+            tab.populateFileRevisions()
+            deadline = time.time() + 5
+            while not tab.fileRevisions and time.time() < deadline:
+                self.app.processEvents()
+
+        self.failUnless(tab.revisionModel.fullname == item.data[-1])
+        RevisionCache.getCache().clear()
+        tab.deleteLater()
+
+    def testScrollRevisions(self):
+        from perforce.GUI import FileRevisionWindow
+        from perforce.GUI import RevisionTableModel
+
+        # A file with a few pages of history
+        depotFile = [x for x in sorted(self.server.files) if self.server.files[x][1] >= 7][0]
+        path = self.server.toLocal(self.p4, depotFile)
+        headRev = self.server.files[depotFile][1]
+
+        RevisionCache.getCache().clear()
+        with Instrumentation.CommandCounter('Select long history', commandBudgets={'fstat': 1, 'filelog': 1}):
+            revisions = FileRevisionWindow.queryFileRevisions(self.p4, path, pageSize=3)[0]
+        self.failUnless([x['revision'] for x in revisions] == range(headRev, headRev - 3, -1))
+
+        model = RevisionTableModel.RevisionTableModel(self.p4)
+        model.pageSize = 3
+        model.setRevisions(path, revisions, depotFile, str(headRev))
+        cached = revisions
+        revisions = model.revisions
+
+        # Older pages as the table is scrolled to the end
+        parent = RevisionTableModel.QtCore.QModelIndex()
+        with Instrumentation.CommandCounter('Scroll revisions', budget=(headRev - 3 + 2) // 3):
+            deadline = time.time() + 5
+            while model.canFetchMore(parent) and time.time() < deadline:
+                model.fetchMore(parent)
+                self.app.processEvents()
+        self.failUnless([x['revision'] for x in revisions] == range(headRev, 0, -1))
+
+        # Full descriptions for the rows that are shown, in one query
+        fullDescriptions = RevisionTableModel.queryDescriptions(self.p4, path, headRev, headRev)
+        with Instrumentation.CommandCounter('Show descriptions', budget=1):
+            for row in range(1, 4):
+                model.index(row, model.descriptionColumn).data()
+            deadline = time.time() + 5
+            while not revisions[3]['fullDesc'] and time.time() < deadline:
+                self.app.processEvents()
+
+        self.failUnless([x['desc'] for x in revisions[1:4]] ==
+                        [fullDescriptions[x['revision']] for x in revisions[1:4]])
+        self.failIf(revisions[0]['fullDesc'] or revisions[4]['fullDesc'])
+
+        # What the cache handed out isn't changed, the grown copy is put back in its place
+        self.failUnless(len(cached) == 3 and not any(x['fullDesc'] for x in cached))
+        with Instrumentation.CommandCounter('Select scrolled file', commandBudgets={'fstat': 1, 'filelog': 0}):
+            again = FileRevisionWindow.queryFileRevisions(self.p4, path, pageSize=3)[0]
+        self.failUnless(again == revisions and again is not revisions)
+
+    def testOpenSubmit(self):
+        from perforce.GUI import PerforceMenu
+
+        self.p4.run_edit(self.files)
+        shelf = PerforceMenu.MainShelf(self.p4)
+
+        with Instrumentation.CommandCounter('Open submit', budget=1):
+            shelf.submitChange()
+        shelf.submitUI.deleteLater()
+
+    def testSubmitFiles(self):
+        # Keep the cost flat in the number of files submitted
+        for files in [self.files[:1], self.files]:
+            self.p4.run_edit(files)
+            with Instrumentation.CommandCounter('Submit %d files' % len(files), budget=4):
+                CmdsChangelist.submitChange(self.p4, files, 'Budget test', None)
+
+    def testCheckoutFiles(self):
+        from perforce.GUI import PerforceMenu
+
+        shelf = PerforceMenu.MainShelf(self.p4)
+        newFile = self.clientRoot + '/new/file.ma'
+
+        for files in [self.files[:1], self.files[1:] + [newFile]]:
+            with Instrumentation.CommandCounter('Checkout %d files' % len(files), budget=4):
+                shelf.run_checkoutFile(None, *files)
+
+        opened = self.p4.run_opened()
+        self.failUnless(len(opened) == len(self.files) + 1)
+        self.failUnless(all('ourLock' in x for x in opened))
@@ -0,0 +1,66 @@
+import unittest
+import logging
+
+from P4 import P4, P4Exception
+
+from test_perforce import TestingEnvironment
+from perforce.PerforceUtils import ConnectionPool
+
+class ConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+        self.p4 = TestingEnvironment()
+        self.pool = ConnectionPool.ConnectionPool(self.p4, maxSize=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.p4.disconnect()
+
+    def testLeaseUsesSameSettings(self):
+        with self.pool.lease() as conn:
+            self.failIf(conn is self.p4)
+            self.failUnless(conn.connected())
+            self.failUnless(conn.port == self.p4.port)
+            self.failUnless(conn.client == self.p4.client)
+            self.failUnless(conn.user == self.p4.user)
+
+    def testConnectionsAreReused(self):
+        with self.pool.lease() as conn:
+            pass
+        with self.pool.lease() as conn2:
+            self.failUnless(conn is conn2)
+
+    def testLeaseResetsExceptionLevel(self):
+        def failingCommand():
+            with self.pool.lease() as conn, conn.at_exception_level(P4.RAISE_ERRORS):
+                raise P4Exception('Command failed')
+
+        self.assertRaises(P4Exception, failingCommand)
+
+        # The next user gets the main connection's level back
+        with self.pool.lease() as conn:
+            self.failUnless(conn.exception_level == self.p4.exception_level)
+            self.failUnless(conn.cwd == self.p4.cwd)
+
+    def testPoolIsCapped(self):
+        conn1 = self.pool.checkout()
+        conn2 = self.pool.checkout()
+        self.assertRaises(P4Exception, self.pool.checkout, 0.1)
+
+        self.pool.checkin(conn1)
+        self.failUnless(self.pool.checkout(0.1) is conn1)
+
+        self.pool.checkin(conn1)
+        self.pool.checkin(conn2)
+
+    def testClientChangeDropsIdleConnections(self):
+        with self.pool.lease() as conn:
+            pass
+
+        client = self.p4.client
+        self.p4.client = client + '_other'
+        with self.pool.lease() as conn2:
+            self.failIf(conn is conn2)
+            self.failUnless(conn2.client == self.p4.client)
+        self.p4.client = client
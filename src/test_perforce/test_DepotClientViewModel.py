@@ -49,4 +49,52 @@ class DepotClientViewModelTests(unittest.TestCase):
     		self.rootItem.appendFolderItem(data)
 
     	for i, item in enumerate(self.rootItem.childItems):
-    		self.failUnless(item.data == testDataOut[i])
\ No newline at end of file
+    		self.failUnless(item.data == testDataOut[i])
+
+    def testInsertChildren(self):
+    	self.rootItem.appendFolderItem('//depot/subfolder')
+    	folderItem = self.rootItem.childItems[0]
+    	self.failUnless(folderItem.childItems[0].isPlaceholder())
+
+    	model = DepotClientViewModel.PerforceItemModel(None)
+    	model.rootItem = self.rootItem
+
+    	inserted = []
+    	model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+
+    	model.insertChildren(folderItem, [
+    			('Folder', '//depot/subfolder/subfolder2'),
+    			('File', '//depot/subfolder/test0.txt', 'txt', '12:34:56', 'Add', '1'),
+    			])
+
+    	self.failUnless(folderItem.loaded)
+    	self.failUnless(inserted == [(0, 1)])
+    	self.failUnless([x.data[0] for x in folderItem.childItems] == ['subfolder2', 'test0.txt'])
+
+    def testItemRows(self):
+    	for i in range(100):
+    		self.rootItem.appendFileItem('//depot/test%d.txt' % i, 'text', '12:34:56', 'add', '1')
+
+    	self.failUnless([x.row() for x in self.rootItem.childItems] == range(100))
+    	self.failUnless(self.rootItem.childItems[0].childItems is DepotClientViewModel.PerforceItem.noChildren)
+    	self.failIf(hasattr(self.rootItem, '__dict__'))
+
+    def testFetchMore(self):
+    	self.rootItem.appendFolderItem('//depot/subfolder')
+    	folderItem = self.rootItem.childItems[0]
+
+    	model = DepotClientViewModel.PerforceItemModel(None)
+    	model.rootItem = self.rootItem
+    	model.pageSize = 40
+
+    	model.insertChildren(folderItem, [('File', '//depot/subfolder/test%d.txt' % i, 'text', '12:34:56', 'add', '1')
+    			for i in range(100)])
+
+    	folderIndex = model.itemIndex(folderItem)
+    	self.failUnless(len(folderItem.childItems) == 40)
+    	self.failUnless(model.canFetchMore(folderIndex))
+
+    	model.fetchMore(folderIndex)
+    	model.fetchMore(folderIndex)
+    	self.failUnless([x.data[0] for x in folderItem.childItems] == ['test%d.txt' % i for i in range(100)])
+    	self.failIf(model.canFetchMore(folderIndex))
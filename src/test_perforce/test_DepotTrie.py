@@ -0,0 +1,64 @@
+import unittest
+import logging
+
+from test_perforce import TestingEnvironment
+from perforce.PerforceUtils import DepotTrie
+
+class DepotTrieTests(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+        self.trie = DepotTrie.DepotTrie('/ws/')
+        for path, change in [('a/b/one.ma', None), ('a/b/two.ma', 'default'), ('a/three.ma', None), ('four.ma', None)]:
+            fstat = {'depotFile': '//depot/' + path, 'clientFile': '/ws/' + path, 'headRev': '1'}
+            if change:
+                fstat['change'] = change
+                fstat['action'] = 'edit'
+            self.trie.insert(fstat)
+
+    def testListDirectory(self):
+        listing = self.trie.listDirectory('/ws')
+        self.failUnless(listing[0] == {'dir': '//depot/a'})
+        self.failUnless([x['clientFile'] for x in listing[1:]] == ['/ws/four.ma'])
+
+        listing = self.trie.listDirectory('/ws/a/b')
+        self.failUnless([x['depotFile'] for x in listing] == ['//depot/a/b/one.ma', '//depot/a/b/two.ma'])
+
+        self.failUnless(self.trie.listDirectory('/ws/missing') is None)
+        self.failUnless(self.trie.listDirectory('/elsewhere') is None)
+
+    def testReplaceAndRemove(self):
+        fstat = {'depotFile': '//depot/a/b/one.ma', 'clientFile': '/ws/a/b/one.ma', 'headRev': '1'}
+        self.failIf(self.trie.insert(fstat, replace=True))
+
+        fstat['headRev'] = '2'
+        self.failUnless(self.trie.insert(fstat, replace=True))
+        self.failUnless(self.trie.listDirectory('/ws/a/b')[0]['headRev'] == '2')
+
+        self.failUnless(self.trie.insert({'depotFile': '//depot/a/b/a.ma', 'clientFile': '/ws/a/b/a.ma'}, replace=True))
+        self.failUnless([x['depotFile'] for x in self.trie.listDirectory('/ws/a/b')][0] == '//depot/a/b/a.ma')
+
+        self.failUnless(self.trie.remove('//depot/a/b/two.ma'))
+        self.failIf(self.trie.remove('//depot/a/b/two.ma'))
+        self.failUnless(self.trie.fileCount == 4)
+        self.failUnless(len(list(self.trie.walk())) == 4)
+
+    def testUpdateWhileListing(self):
+        # A listing on a worker holds on to what the folder had when it started
+        node = self.trie.findNode('/ws/a')
+        children, files = node.children, node.files
+
+        self.trie.insert({'depotFile': '//depot/a/c/new.ma', 'clientFile': '/ws/a/c/new.ma'}, replace=True)
+        self.trie.insert({'depotFile': '//depot/a/new.ma', 'clientFile': '/ws/a/new.ma'}, replace=True)
+        self.trie.remove('//depot/a/three.ma')
+
+        self.failUnless(sorted(children) == ['b'] and [x[0] for x in files] == ['three.ma'])
+        self.failUnless(sorted(node.children) == ['b', 'c'] and [x[0] for x in node.files] == ['new.ma'])
+
+    def testPendingIndex(self):
+        pending = DepotTrie.queryPending(None, '/ws', self.trie)
+        self.failUnless(pending.foldersIn('/ws') == {'a': '//depot/a'})
+        self.failUnless(pending.foldersIn('/ws/a') == {'b': '//depot/a/b'})
+        self.failUnless([x['clientFile'] for x in pending.filesIn('/ws/a/b')] == ['/ws/a/b/two.ma'])
+        self.failUnless(pending.foldersIn('/ws/a/b') == {})
+        self.failUnless(pending.filesIn('/elsewhere') == [])
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+import unittest
+
+import FakeP4
+
+class FakeP4Tests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeP4.FakeServer(clientRoot='/tmp/fakews')
+        self.server.generate(fileCount=250, revisions=(2, 20), filesPerDir=50, dirsPerDir=5)
+        self.p4 = FakeP4.P4(self.server)
+        self.p4.connect()
+
+    def testDirectoryListing(self):
+        result = self.p4.run_fstat('-Olhp', '-Dl', '//depot/assets/*')
+        dirs = [x['dir'] for x in result if 'dir' in x]
+        files = [x for x in result if 'depotFile' in x]
+
+        self.failUnless(dirs == ['//depot/assets/d%d' % i for i in range(5)])
+        self.failUnless(not files)
+
+        result = self.p4.run_fstat('-Olhp', '-Dl', '/tmp/fakews/assets/d1/*')
+        self.failUnless(len(result) == 50)
+        self.failUnless(result[0]['clientFile'].startswith('/tmp/fakews/assets/d1/'))
+
+    def testFilelog(self):
+        path = self.p4.run_fstat('//depot/assets/d0/*')[0]['depotFile']
+        headRev = int(self.p4.run_fstat(path)[0]['headRev'])
+
+        log = self.p4.run_filelog('-l', path)
+        self.failUnless(len(log[0].revisions) == headRev)
+        self.failUnless(log[0].revisions[0].rev == headRev)
+
+        log = self.p4.run_filelog('-m', '1', path)
+        self.failUnless(len(log[0].revisions) == 1)
+
+    def testEditAndSubmit(self):
+        path = self.p4.run_fstat('//depot/assets/d0/*')[0]['depotFile']
+        headRev = int(self.p4.run_fstat(path)[0]['headRev'])
+
+        self.p4.run_edit(path)
+        self.failUnless(self.p4.run_opened()[0]['depotFile'] == path)
+
+        change = self.p4.fetch_change()
+        change._description = 'Test'
+        self.p4.run_submit(change)
+
+        self.failUnless(int(self.p4.run_fstat(path)[0]['headRev']) == headRev + 1)
+        self.failUnless(self.p4.run_changes('-m', '1')[0]['desc'] == 'Test')
+        with self.p4.at_exception_level(FakeP4.P4.RAISE_ERRORS):
+            self.failUnless(self.p4.run_opened() == [])
+
+    def testErrors(self):
+        self.assertRaises(FakeP4.P4Exception, self.p4.run_fstat, '//depot/missing.ma')
+
+        with self.p4.at_exception_level(FakeP4.P4.RAISE_ERRORS):
+            self.failUnless(self.p4.run_fstat('//depot/missing.ma') == [])
+            self.failUnless(self.p4.warnings)
+
+    def testLatency(self):
+        self.server.latency = {'fstat': 0.1}
+        start = time.time()
+        self.p4.run_fstat('//depot/assets/d0/*')
+        self.failUnless(time.time() - start >= 0.1)
+
+    def testReplay(self):
+        path = tempfile.mktemp(suffix='.jsonl')
+        recorder = FakeP4.SessionRecorder(path)
+        try:
+            for args in [('fstat', '//depot/assets/d0/*'), ('info',)]:
+                result = self.p4.run(*args)
+                recorder(args, 0.0, result)
+
+            replayed = FakeP4.P4(FakeP4.ReplayServer(path))
+            replayed.connect()
+            self.failUnless(replayed.run_fstat('//depot/assets/d0/*') == self.p4.run_fstat('//depot/assets/d0/*'))
+            self.assertRaises(FakeP4.P4Exception, replayed.run_opened)
+        finally:
+            os.remove(path)
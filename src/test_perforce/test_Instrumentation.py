@@ -0,0 +1,44 @@
+import unittest
+import logging
+
+from test_perforce import TestingEnvironment
+from perforce.PerforceUtils import Instrumentation
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+        self.recorder = Instrumentation.CommandRecorder()
+
+    def testCommandShape(self):
+        shape = Instrumentation.commandShape
+        self.failUnless(shape(('fstat', '-Olhp', '-Dl', '//depot/a/*')) == 'fstat -Olhp -Dl [1]')
+        self.failUnless(shape(('filelog', ('-l', '//depot/a.ma'))) == 'filelog -l [1]')
+        self.failUnless(shape(('info',)) == 'info')
+
+    def testRecordGroupsByShape(self):
+        rows = [{'depotFile': '//depot/a.ma', 'headRev': '1'}]
+        self.recorder.record(('fstat', '//depot/a.ma'), 0.02, rows)
+        self.recorder.record(('fstat', '//depot/b.ma'), 0.2, rows)
+        self.recorder.record(('opened', '...'), 3.0, [], Exception('failed'))
+
+        summary = dict((x['shape'], x) for x in self.recorder.summary())
+        self.failUnless(summary['fstat [1]']['count'] == 2)
+        self.failUnless(summary['fstat [1]']['rows'] == 2)
+        self.failUnless(summary['fstat [1]']['bytes'] > 0)
+        self.failUnless(summary['opened [1]']['errors'] == 1)
+
+        histogram = self.recorder.histogram('fstat')
+        self.failUnless(sum(histogram['fstat [1]']) == 2)
+        self.failUnless(self.recorder.summary()[0]['shape'] == 'opened [1]')
+
+    def testInstrumentedP4Records(self):
+        p4 = Instrumentation.InstrumentedP4()
+        p4.connect()
+
+        recorder = Instrumentation.getRecorder()
+        recorder.reset()
+        p4.run_info()
+        p4.disconnect()
+
+        self.failUnless([x for x in recorder.summary() if x['shape'] == 'info'])
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+
+from test_perforce import FakeServerTestCase
+from perforce.PerforceUtils import DepotTrie
+from perforce.PerforceUtils import MetadataCache
+
+class MetadataCacheTests(FakeServerTestCase):
+    clientRoot = '/tmp/p4vfx_cache_ws'
+    fileCount = 500
+    filesPerDir = 50
+
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+        super(MetadataCacheTests, self).setUp()
+
+        self.tempDir = tempfile.mkdtemp()
+        self.cache = MetadataCache.MetadataCache(os.path.join(self.tempDir, 'metadata.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tempDir)
+        super(MetadataCacheTests, self).tearDown()
+
+    def cacheTree(self):
+        change = MetadataCache.latestChange(self.p4, '//depot')
+        trie = DepotTrie.prefetch(self.p4, '//depot', 1000)
+        self.cache.store(self.p4, '//depot', trie, change)
+        return trie, change
+
+    def testStoreAndLoad(self):
+        trie, change = self.cacheTree()
+        cached, cachedChange = self.cache.load(self.p4, '//depot')
+
+        self.failUnless(cachedChange == change)
+        self.failUnless(list(cached.walk()) == list(trie.walk()))
+        self.failUnless(self.cache.load(self.p4, '//other') is None)
+
+    def testChangesSince(self):
+        trie, change = self.cacheTree()
+        files = sorted(self.server.files)
+
+        self.failUnless(MetadataCache.changesSince(self.p4, '//depot', change) == (change, [], []))
+
+        self.p4.run_edit(files[0])
+        self.p4.run_submit('-d', 'Changed')
+        self.p4.run_edit(files[1])
+
+        latest, fstats, removed = MetadataCache.changesSince(self.p4, '//depot', change, depotRoot='//depot')
+        self.failUnless(latest > change)
+        self.failUnless(sorted(x['depotFile'] for x in fstats) == files[:2])
+        self.failUnless(removed == [])
+
+        # Only the opened file is looked at again once it's been reverted
+        self.cache.update(self.p4, '//depot', fstats, removed, latest)
+        self.failUnless(self.cache.openedFiles(self.p4, '//depot') == [files[1]])
+
+        self.p4.run_revert(files[1])
+        latest, fstats, removed = MetadataCache.changesSince(self.p4, '//depot', latest, self.cache.openedFiles(self.p4, '//depot'))
+        self.failUnless([x['depotFile'] for x in fstats] == [files[1]])
+        self.failIf('action' in fstats[0])
+
+    def testTooFarBehind(self):
+        trie, change = self.cacheTree()
+        maxChanges = MetadataCache.maxChanges
+        MetadataCache.maxChanges = 1
+        try:
+            for path in sorted(self.server.files)[:2]:
+                self.p4.run_edit(path)
+                self.p4.run_submit('-d', 'Changed')
+            self.failUnless(MetadataCache.changesSince(self.p4, '//depot', change) is None)
+        finally:
+            MetadataCache.maxChanges = maxChanges
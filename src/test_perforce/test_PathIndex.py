@@ -0,0 +1,74 @@
+import unittest
+import logging
+
+from test_perforce import FakeServerTestCase
+from perforce.PerforceUtils import DepotTrie
+from perforce.PerforceUtils import PathIndex
+
+class PathIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = PathIndex.PathIndex('//depot/show', [
+            'shots/sh010/comp/sh010_comp.nk',
+            'shots/sh010/comp/sh010_comp_v002.nk',
+            'shots/sh020/anim/sh020_anim.ma',
+            'assets/chars/hero/hero_rig.ma',
+            'assets/comp/templates/comp.nk',
+        ])
+
+    def testSearch(self):
+        # Exact file names first, then names starting with the word, then anywhere in the path
+        self.failUnless(self.index.search('comp.nk') == ['assets/comp/templates/comp.nk',
+                                                         'shots/sh010/comp/sh010_comp.nk'])
+        self.failUnless(self.index.search('sh010 v002') == ['shots/sh010/comp/sh010_comp_v002.nk'])
+        self.failUnless(self.index.search('HERO')[0] == 'assets/chars/hero/hero_rig.ma')
+        self.failUnless(self.index.search('') == [])
+        self.failUnless(self.index.search('comp', limit=2) == ['assets/comp/templates/comp.nk',
+                                                               'shots/sh010/comp/sh010_comp.nk'])
+
+    def testFuzzySearch(self):
+        # Only when nothing contains the word, letters in order within one name
+        self.failUnless(self.index.search('hrrig') == ['assets/chars/hero/hero_rig.ma'])
+        self.failUnless(self.index.search('hrmx') == [])
+
+    def testUpdate(self):
+        self.failUnless(self.index.search('sh030') == [])
+
+        changed = self.index.update(['//depot/show/shots/sh030/comp/sh030_comp.nk', '//depot/other/file.nk'],
+                                    ['//depot/show/shots/sh020/anim/sh020_anim.ma'])
+        self.failUnless(changed)
+        self.failUnless(self.index.search('sh030') == ['shots/sh030/comp/sh030_comp.nk'])
+        self.failUnless(self.index.search('anim') == [])
+        self.failUnless(self.index.paths == sorted(self.index.paths))
+        self.failIf(self.index.update(['//depot/show/shots/sh030/comp/sh030_comp.nk'], []))
+
+    def testBuildIndexFromMappedFolders(self):
+        # A client view that maps a second depot folder into the workspace
+        trie = DepotTrie.DepotTrie('/ws')
+        trie.insert({'depotFile': '//depot/show/shots/sh010.nk', 'clientFile': '/ws/shots/sh010.nk'})
+        trie.insert({'depotFile': '//depot/library/tools/tool.py', 'clientFile': '/ws/tools/tool.py'})
+
+        index = PathIndex.buildIndex(None, '/ws', trie)
+        self.failUnless(index.paths == ['shots/sh010.nk'])
+        self.failUnless(index.search('sh010') == ['shots/sh010.nk'])
+
+
+class BuildIndexTests(FakeServerTestCase):
+    clientRoot = '/tmp/p4vfx_index_ws'
+    fileCount = 500
+    filesPerDir = 50
+
+    def testBuildIndex(self):
+        # The same paths from one 'files' as from the prefetched tree, without the deleted files
+        index = PathIndex.buildIndex(self.p4, self.clientRoot)
+        trie = DepotTrie.prefetch(self.p4, self.clientRoot, 1000)
+        self.failUnless(PathIndex.buildIndex(self.p4, self.clientRoot, trie).paths == index.paths)
+        self.failUnless(0 < len(index) < len(self.server.files))
+
+        name = index.paths[-1].rsplit('/', 1)[-1]
+        self.failUnless(index.search(name) == [index.paths[-1]])
+
+        depotFile = '/'.join([index.depotRoot, index.paths[0]])
+        self.p4.run_delete(depotFile)
+        self.p4.run_submit('-d', 'Deleted')
+        self.failUnless(PathIndex.filesChanged(self.p4, [depotFile, index.depotRoot + '/missing.ma']) ==
+                        ([], [depotFile, index.depotRoot + '/missing.ma']))
@@ -0,0 +1,76 @@
+import unittest
+import logging
+
+from test_perforce import requiresFakeP4
+from P4 import P4Exception
+from perforce.PerforceUtils import Resilience
+from perforce.PerforceUtils import Session
+
+import FakeP4
+
+class ResilienceTests(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+    def testClassifyErrors(self):
+        self.failUnless(Resilience.isTransportError(Exception('TCP receive failed.\nread: socket: Connection reset by peer')))
+        self.failUnless(Resilience.isTransportError(Exception('Connect to server failed; check $P4PORT.')))
+        self.failIf(Resilience.isTransportError(Exception('//depot/a.ma - no such file(s).')))
+
+        self.failUnless(Resilience.isReadOnly(('fstat', '-Olhp', '//depot/...')))
+        self.failUnless(Resilience.isReadOnly((['changes', '-s', 'pending'],)))
+        self.failUnless(Resilience.isReadOnly(('client', '-o')))
+        self.failIf(Resilience.isReadOnly(('client', '-i')))
+        self.failIf(Resilience.isReadOnly(('submit', '-d', 'test')))
+
+@requiresFakeP4
+class ReconnectTests(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+        self.server = FakeP4.FakeServer()
+        self.server.generate(100)
+
+        self.p4 = Resilience.ResilientP4(self.server)
+        self.p4.initialDelay = 0.01
+        self.p4.reconnectTimeout = 1.0
+        self.p4.connect()
+
+    def testReadOnlyRetried(self):
+        info = Session.getSession(self.p4).info()
+
+        self.server.outage(commands=1, connections=2)
+        self.failUnless(self.p4.run_fstat('//depot/d0/*'))
+        self.failUnless(self.p4.connected())
+
+        # Same connection settings, so the cached session survives
+        self.failUnless(Session.getSession(self.p4).info() is info)
+
+    def testWriteNotRetried(self):
+        self.server.outage(commands=1)
+        self.assertRaises(P4Exception, self.p4.run_edit, '//depot/d0/file_000000.ma')
+
+        # Reconnected for the next command
+        self.failUnless(self.p4.connected())
+        with self.p4.at_exception_level(FakeP4.P4.RAISE_ERRORS):
+            self.failIf(self.p4.run_opened())
+
+    def testDeadline(self):
+        self.p4.reconnectTimeout = 0.1
+        self.server.outage(commands=1, connections=1000)
+        self.assertRaises(P4Exception, self.p4.run_info)
+        self.failIf(self.p4.connected())
+
+    def testDisconnected(self):
+        # Closed on purpose, so it isn't reconnected behind the caller's back
+        self.p4.disconnect()
+        self.assertRaises(P4Exception, self.p4.run_info)
+        self.failIf(self.p4.connected())
+
+        self.p4.connect()
+        self.server.outage(commands=1, connections=2)
+        self.failUnless(self.p4.run_info())
+
+    def testServerErrorsRaised(self):
+        self.assertRaises(P4Exception, self.p4.run_fstat, '//depot/missing.ma')
+        self.failUnless(self.server.commandCount == 1)
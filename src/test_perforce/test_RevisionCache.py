@@ -0,0 +1,93 @@
+import unittest
+
+from test_perforce import FakeServerTestCase
+from perforce.PerforceUtils import Instrumentation
+from perforce.PerforceUtils import RevisionCache
+
+class RevisionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = RevisionCache.RevisionCache(maxEntries=2)
+
+    def testLeastRecentlyUsed(self):
+        self.cache.put('//depot/a.ma', 1, ['a'])
+        self.cache.put('//depot/b.ma', 3, ['b'])
+        self.failUnless(self.cache.get('//depot/a.ma', 1) == ['a'])
+
+        # b was shown longest ago
+        self.cache.put('//depot/c.ma', 2, ['c'])
+        self.failUnless(self.cache.get('//depot/b.ma', 3) is None)
+        self.failUnless(self.cache.get('//depot/a.ma', '1') == ['a'])
+        self.failUnless(len(self.cache) == 2)
+
+    def testNewHead(self):
+        self.cache.put('//depot/a.ma', 1, ['a'], name='/ws/a.ma')
+        self.failUnless(self.cache.get('//depot/a.ma', 2) is None)
+        self.failUnless(self.cache.get('//depot/a.ma', 1) is None)
+        self.failIf(self.cache.aliases)
+
+    def testInvalidate(self):
+        self.cache.put('//depot/a.ma', 1, ['a'], name='/ws/a.ma')
+        self.cache.put('//depot/b.ma', 1, ['b'])
+
+        # By the client path it was asked for, or the depot path
+        self.cache.invalidate(['/ws/a.ma', '//depot/b.ma', '//depot/missing.ma'])
+        self.failUnless(len(self.cache) == 0)
+        self.failIf(self.cache.aliases)
+
+    def testNewestRevisions(self):
+        revisions = [{'revision': 100 - i, 'desc': 'x' * 100, 'user': 'artist', 'client': 'ws'} for i in range(100)]
+
+        # Only the newest revisions of a long history are kept, always at least one
+        self.failUnless(RevisionCache.newestRevisions(revisions, RevisionCache.revisionsSize(revisions[:10])) == revisions[:10])
+        self.failUnless(RevisionCache.newestRevisions(revisions, 0) == revisions[:1])
+        self.failUnless(RevisionCache.newestRevisions(revisions, RevisionCache.maxEntrySize) == revisions)
+
+
+class PrefetchTests(FakeServerTestCase):
+    clientRoot = '/tmp/p4vfx_revisions_ws'
+    fileCount = 120
+    filesPerDir = 120
+
+    def setUp(self):
+        super(PrefetchTests, self).setUp()
+        self.cache = RevisionCache.getCache()
+        self.cache.clear()
+
+    def tearDown(self):
+        self.cache.maxEntries = RevisionCache.maxEntries
+        self.cache.clear()
+        super(PrefetchTests, self).tearDown()
+
+    def testPrefetch(self):
+        cache = self.cache
+        paths = [self.server.toLocal(self.p4, x) for x in sorted(self.server.files)[:60]]
+
+        # One fstat and a filelog per batch of files
+        with Instrumentation.CommandCounter('Prefetch', commandBudgets={'fstat': 1, 'filelog': 2}):
+            self.failUnless(RevisionCache.prefetch(self.p4, paths, 5) == len(paths))
+
+        stat = self.p4.run_fstat(paths[-1])[0]
+        revisions = cache.get(stat['depotFile'], stat['headRev'])
+        expected = RevisionCache.parseFilelog(self.p4.run_filelog('-m', '5', paths[-1]))
+        self.failUnless(revisions == expected)
+
+        # Already cached, or over the budget
+        with Instrumentation.CommandCounter('Prefetch again', commandBudgets={'fstat': 1, 'filelog': 0}):
+            self.failUnless(RevisionCache.prefetch(self.p4, paths, 5) == 0)
+
+        cache.clear()
+        self.failUnless(0 < RevisionCache.prefetch(self.p4, paths, 5, byteBudget=2000) < len(paths))
+        self.failUnless(cache.contains(stat['depotFile'], stat['headRev']) is False)
+
+        # Nothing is asked for when the cache is turned off
+        cache.clear()
+        cache.maxEntries = 0
+        with Instrumentation.CommandCounter('Prefetch disabled', budget=0):
+            self.failUnless(RevisionCache.prefetch(self.p4, paths, 5) == 0)
+
+    def testPrefetchWindowsPaths(self):
+        paths = [self.server.toLocal(self.p4, x).replace('/', '\\') for x in sorted(self.server.files)[:10]]
+        self.failUnless(RevisionCache.prefetch(self.p4, paths, 5) == len(paths))
+
+        stat = self.p4.run_fstat(paths[0])[0]
+        self.failUnless(self.cache.contains(stat['depotFile'], stat['headRev']))
@@ -0,0 +1,62 @@
+import unittest
+import logging
+
+from P4 import P4Exception
+
+from test_perforce import TestingEnvironment
+from perforce.PerforceUtils import Session, LoginState
+
+class SessionTests(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.DEBUG)
+
+        self.p4 = TestingEnvironment()
+        self.session = Session.P4Session(self.p4)
+
+    def tearDown(self):
+        self.p4.disconnect()
+
+    def testInfoIsCached(self):
+        info = self.session.info()
+        self.failUnless(self.session.info() is info)
+        self.failIf(self.session.info(refresh=True) is info)
+
+    def testClientChangeInvalidates(self):
+        info = self.session.info()
+        client = self.p4.client
+
+        self.p4.client = client + '_other'
+        self.failUnless(self.session.cachedInfo is info)
+        self.session.validate()
+        self.failUnless(self.session.cachedInfo is None)
+
+        self.p4.client = client
+
+    def testDisconnectInvalidates(self):
+        self.session.client()
+        self.p4.disconnect()
+        self.session.validate()
+        self.failUnless(self.session.cachedClient is None)
+
+        self.p4.connect()
+
+    def testGetSessionIsShared(self):
+        self.failUnless(Session.getSession(self.p4) is Session.getSession(self.p4))
+
+    def testLoginExpiryIsTracked(self):
+        tracker = LoginState.LoginTracker(self.p4)
+        self.failUnless(tracker.isExpiring())
+
+        self.failUnless(tracker.check())
+        self.failIf(tracker.isExpiring())
+
+        tracker.noteException(P4Exception('Your session has expired, please login again.'))
+        self.failUnless(tracker.isExpiring())
+
+    def testTicketExpirationIsParsed(self):
+        tracker = LoginState.LoginTracker(self.p4)
+        tracker.update([{'User': self.p4.user, 'TicketExpiration': '60'}])
+        self.failUnless(tracker.isExpiring())
+
+        tracker.update([{'User': self.p4.user, 'TicketExpiration': '43200'}])
+        self.failIf(tracker.isExpiring())